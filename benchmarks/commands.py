@@ -0,0 +1,167 @@
+# resippy command benchmarks
+#
+# Times each command path (adding, updating and printing recipes, viewing and filtering the menu, random suggestions,
+# the grocery list, ...) in-process against a synthetic database built by generate.py, with the grocery store scraper stubbed out.
+# Every run works on a fresh copy of the database, so the write benchmarks don't change what the read benchmarks see.
+# Output goes to os.devnull, so the read commands use their piped --format (tsv) unless a benchmark asks for another.
+# Save the JSON results of two commits and pass one to --compare to see what changed.
+#
+# usage: python benchmarks/commands.py [--db GENERATED.db] [--recipes N] [--runs N] [--only NAME ...] [--json] [--output FILE] [--compare BASELINE.json]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import ROOT, generate, load_resippy
+
+# Each benchmark: the command line(s) to time for run number i, and optionally the command line(s) that set it up (not timed)
+BENCHMARKS = {
+    'new_recipe': {'run': lambda i: [['--new', 'Benchmark Dish {}'.format(i), '--cuisine', 'Thai', '--ian_rating', '4']]},
+    'update_menu': {'run': lambda i: [['--update_menu', RECIPES[i % len(RECIPES)], '--ian_rating', '3', '--last_made', '01/02/2025']]},
+    'add_ingredients': {'setup': lambda i: [['--new', 'Benchmark Stew {}'.format(i)]],
+                        'run': lambda i: [['--addingredients', 'Benchmark Stew {}'.format(i), INGREDIENTS_CSV]]},
+    'print_recipe': {'run': lambda i: [['--printrecipe', RECIPES[i % len(RECIPES)]]]},
+    'view_menu': {'run': lambda i: [['--viewmenu', '--limit', '50']]},
+    'view_menu_grid': {'run': lambda i: [['--viewmenu', '--limit', '50', '--format', 'grid']]},
+    'view_menu_all': {'run': lambda i: [['--viewmenu', '--format', 'jsonl']]},
+    'view_menu_filtered': {'run': lambda i: [['--viewmenu', '--filter', "ian_rating >= 4 AND cuisine IN ('Thai', 'Greek')", '--order', 'last_made DESC, name', '--limit', '50']]},
+    'view_menu_page': {'run': lambda i: [['--viewmenu', '--page', '50', '--order', 'last_made DESC', '--after', str(PAGE_AFTER)]]},
+    'random_recipe': {'run': lambda i: [['--random', '3', '--seed', str(i)]]},
+    'search': {'run': lambda i: [['--search', 'smoky curry', '--limit', '10']]},
+    'plan_week': {'run': lambda i: [['--plan-week', '--seed', str(i)]]},
+    'grocery_list': {'run': lambda i: [['--groceries']]},
+    'groceries_replanned': {'setup': lambda i: [['--addtomealplan', 'Monday', RECIPES[i % len(RECIPES)]]],
+                            'run': lambda i: [['--groceries']]},
+    'print_mealplan': {'run': lambda i: [['--printmealplan']]},
+}
+RECIPES = []
+INGREDIENTS_CSV = None
+# Id of the recipe in the middle of the menu, where view_menu_page starts its page
+PAGE_AFTER = None
+
+def stub_scraper(resippy):
+    """Answers every grocery location lookup locally, so no benchmark touches the network."""
+    resippy.find_grocery_location = lambda ingredient: "Produce"
+
+def run_commands(resippy, parser, command_lines):
+    """Runs command lines like the command line would, answering Y to every prompt (e.g. replacing the meal plan)."""
+    stdin = sys.stdin
+    sys.stdin = io.StringIO("Y\n" * 10)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for command_line in command_lines:
+                if not resippy.run_command(parser.parse_args(command_line)):
+                    raise RuntimeError("{} failed.".format(" ".join(command_line)))
+    finally:
+        sys.stdin = stdin
+
+def time_benchmark(resippy, name, database, scratch, runs):
+    """Runs one benchmark runs times (after one warm-up run) on a fresh copy of the database.
+
+    Returns:
+        dict: Times in milliseconds.
+    """
+    copy = os.path.join(scratch, name + '.db')
+    shutil.copyfile(database, copy)
+    resippy.DATABASE_PATH = copy
+    resippy.connection, resippy.cursor = None, None
+    resippy.open_database()
+    parser = resippy.create_parser()
+    benchmark = BENCHMARKS[name]
+    times = []
+    for i in range(runs + 1):
+        if 'setup' in benchmark:
+            run_commands(resippy, parser, benchmark['setup'](i))
+        start = time.perf_counter()
+        run_commands(resippy, parser, benchmark['run'](i))
+        if i > 0:
+            times.append((time.perf_counter() - start) * 1000)
+    resippy.connection.close()
+    resippy.connection, resippy.cursor = None, None
+    os.remove(copy)
+    return {
+        'runs': runs,
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+        'max_ms': round(max(times), 3),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Prints the change in median time of every benchmark against a baseline results file."""
+    print("{:<20} {:>14} {:>14} {:>9}".format('benchmark', 'baseline (ms)', 'current (ms)', 'change'))
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            print("{:<20} {:>14} {:>14} {:>9}".format(name, '-', result['median_ms'], 'new'))
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+        print("{:<20} {:>14} {:>14} {:>+9.1%}".format(name, before['median_ms'], result['median_ms'], change))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each resippy command path against a synthetic database.")
+    parser.add_argument('--db', help="Database built by generate.py. Builds one with --recipes recipes if not given.")
+    parser.add_argument('--recipes', type=int, default=10000, help="Without --db, number of recipes to generate (default: 10000, with 5000 ingredients and 20 per recipe).")
+    parser.add_argument('--runs', type=int, default=10, help="Timed runs per benchmark, after one warm-up run (default: 10).")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="Only run these benchmarks.", metavar="NAME")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON.")
+    parser.add_argument('--output', help="Also write the JSON results to FILE.", metavar="FILE")
+    parser.add_argument('--compare', help="Compare with the JSON results of an earlier run.", metavar="BASELINE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database = args.db
+        if database is None:
+            database = os.path.join(scratch, 'generated.db')
+            generate(database, recipes=args.recipes, ingredients=args.recipes // 2)
+        with sqlite3.connect(database) as source:
+            RECIPES = [row[0] for row in source.execute("SELECT name FROM menu ORDER BY id LIMIT 1000")]
+            PAGE_AFTER = source.execute("SELECT id FROM menu ORDER BY id LIMIT 1 OFFSET (SELECT count(*) FROM menu) / 2").fetchone()[0]
+            sizes = {table: source.execute("SELECT count(*) FROM {t}".format(t=table)).fetchone()[0] for table in ['menu', 'ingredients', 'recipe_ingredients', 'instructions']}
+            ingredients = [row[0] for row in source.execute("SELECT ingredient_name FROM ingredients ORDER BY ingredient_id LIMIT 12")]
+        source.close()
+        # A typical recipe: a dozen known ingredients and three new ones (looked up through the stubbed scraper)
+        INGREDIENTS_CSV = os.path.join(scratch, 'ingredients.csv')
+        with open(INGREDIENTS_CSV, 'w') as file:
+            file.write("ingredient,quantity,units,prepmethod\n")
+            for name in ingredients + ["Benchmark Spice A", "Benchmark Spice B", "Benchmark Spice C"]:
+                file.write("{},1,cup,chopped\n".format(name.lower()))
+        resippy = load_resippy(database)
+        stub_scraper(resippy)
+        results = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': sizes,
+            'benchmarks': {name: time_benchmark(resippy, name, database, scratch, args.runs) for name in (args.only or BENCHMARKS)},
+        }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+    else:
+        print("commit {commit}, Python {python}, SQLite {sqlite}, ".format(**results) + ", ".join("{n} {t}".format(n=n, t=t) for t, n in results['database'].items()))
+        print("{:<20} {:>10} {:>12} {:>10}".format('benchmark', 'min (ms)', 'median (ms)', 'max (ms)'))
+        for name, result in results['benchmarks'].items():
+            print("{:<20} {:>10} {:>12} {:>10}".format(name, result['min_ms'], result['median_ms'], result['max_ms']))
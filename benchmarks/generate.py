@@ -0,0 +1,108 @@
+# resippy synthetic data generator
+#
+# Builds a realistic resippy database of any size: recipes with cuisines, dish types, ratings and last-made dates,
+# ingredients spread over grocery aisles, units, prepmethods, instructions, and a full meal plan for the coming week.
+# The same --seed always builds the same database.
+#
+# usage: python benchmarks/generate.py OUTPUT.db [--recipes N] [--ingredients N] [--per-recipe N] [--seed N]
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CUISINES = ["Thai", "Mexican", "Italian", "Indian", "French", "Japanese", "Korean", "Greek", "Lebanese", "Ethiopian", "Canadian", "Chinese"]
+DISH_TYPES = ["Soup", "Salad", "Pasta", "Curry", "Stew", "Tacos", "Stir Fry", "Casserole", "Sandwich", "Bowl", "Potatoes", "Rice"]
+DISH_WORDS = ["Spicy", "Roasted", "Smoky", "Creamy", "Lemony", "Garlicky", "Crispy", "Herbed", "Braised", "Grilled", "Sweet", "Sour"]
+INGREDIENT_BASES = ["Onion", "Garlic", "Tomato", "Chickpeas", "Lentils", "Rice", "Spinach", "Carrot", "Potato", "Tofu", "Chicken", "Beef",
+                    "Cilantro", "Basil", "Lime", "Lemon", "Ginger", "Cumin", "Paprika", "Coconut Milk", "Pasta", "Feta", "Yogurt", "Pepper"]
+INGREDIENT_WORDS = ["Red", "Green", "Yellow", "Smoked", "Dried", "Fresh", "Frozen", "Baby", "Wild", "Organic", "Sweet", "Hot"]
+AISLES = ["Produce", "Dairy", "Meat", "Bakery", "Frozen", "Canned Goods", "Spices", "International", "Pasta & Rice", "Snacks", "Beverages", "Unknown"]
+UNITS = ["Cup", "Tbsp", "Tsp", "Gram", "Can", "Clove", "Bunch", "Pound"]
+PREPMETHODS = ["Chopped", "Diced", "Minced", "Sliced", "Grated", "Drained", "Rinsed", "Crushed"]
+STEPS = ["Preheat the oven.", "Chop the vegetables.", "Heat the oil in a large pan.", "Add the spices and stir for a minute.",
+         "Simmer for twenty minutes.", "Season to taste.", "Toss everything together.", "Serve hot.", "Garnish and serve."]
+
+def load_resippy(database):
+    """Imports resippy.py against the given database (its path is read from RESIPPY_DB at import time)."""
+    os.environ['RESIPPY_DB'] = database
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import resippy
+    return resippy
+
+def unique_combinations(count, *parts, rng):
+    """Picks count distinct combinations of one word from each list, as (name, combination) pairs.
+    Names are like "Smoky Thai Curry", with a number added once the combinations run out.
+    """
+    combinations = [()]
+    for words in parts:
+        combinations = [combination + (word,) for combination in combinations for word in words]
+    rng.shuffle(combinations)
+    return [(" ".join(combinations[i % len(combinations)]) + ("" if i < len(combinations) else " {}".format(i // len(combinations) + 1)), combinations[i % len(combinations)])
+            for i in range(count)]
+
+def generate(path, recipes=10000, ingredients=5000, per_recipe=20, seed=1):
+    """Builds a synthetic database at path (which must not exist yet).
+
+    Args:
+        path (str): Path of the new database.
+        recipes (int): Number of recipes on the menu.
+        ingredients (int): Number of distinct ingredients.
+        per_recipe (int): Average number of ingredients per recipe (each recipe has between half and one and a half times as many).
+        seed (int): Seed for the random choices.
+
+    Returns:
+        dict: The number of rows in each table.
+    """
+    rng = random.Random(seed)
+    resippy = load_resippy(path)
+    connection, cursor = resippy.open_database()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    ingredient_names = [name for name, _ in unique_combinations(ingredients, INGREDIENT_WORDS, INGREDIENT_BASES, rng=rng)]
+    recipe_names = unique_combinations(recipes, DISH_WORDS, CUISINES, DISH_TYPES, rng=rng)
+    with connection:
+        cursor.executemany("INSERT INTO units (unit_id, unit_name) VALUES (?, ?)", enumerate(UNITS, start=1))
+        cursor.executemany("INSERT INTO prepmethod (prepmethod_id, prepmethod_name) VALUES (?, ?)", enumerate(PREPMETHODS, start=1))
+        cursor.executemany("INSERT INTO ingredients (ingredient_id, ingredient_name, grocery_location) VALUES (?, ?, ?)",
+                           ((i, name, rng.choice(AISLES)) for i, name in enumerate(ingredient_names, start=1)))
+        low, high = max(1, per_recipe // 2), max(1, per_recipe + per_recipe // 2)
+        cursor.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity, unit_id, prepmethod_id) VALUES (?, ?, ?, ?, ?)",
+                           ((recipe_id, ingredient_id, rng.choice([0.25, 0.5, 1, 1, 2, 3, 4]), rng.choice([None, None] + list(range(1, len(UNITS) + 1))), rng.choice([None, None, None] + list(range(1, len(PREPMETHODS) + 1))))
+                            for recipe_id in range(1, recipes + 1)
+                            for ingredient_id in rng.sample(range(1, ingredients + 1), min(ingredients, rng.randint(low, high)))))
+        cursor.executemany("INSERT INTO instructions (recipe_id, instruction) VALUES (?, ?)",
+                           ((recipe_id, step) for recipe_id in range(1, recipes + 1) for step in rng.sample(STEPS, rng.randint(3, 6))))
+        cursor.executemany("INSERT INTO menu (id, name, dish_type, cuisine, drumlin_rating, ian_rating, lina_rating, last_made) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           ((recipe_id, name, dish_type, cuisine,
+                             rng.choice([None, 1, 2, 3, 4, 5]), rng.choice([None, 1, 2, 3, 4, 5]), rng.choice([None, 1, 2, 3, 4, 5]),
+                             rng.choice([None, (today - timedelta(days=rng.randint(1, 720))).strftime('%Y-%m-%d')]))
+                            for recipe_id, (name, (_, cuisine, dish_type)) in enumerate(recipe_names, start=1)))
+        # A full meal plan: every weekday's next occurrence after today, like --addtomealplan
+        for number, weekday in enumerate(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]):
+            days_ahead = (number - today.weekday()) % 7 or 7
+            cursor.execute("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", ((today + timedelta(days=days_ahead)).strftime('%Y-%m-%d'), rng.randint(1, recipes), weekday))
+    counts = {table: cursor.execute("SELECT count(*) FROM {t}".format(t=table)).fetchone()[0]
+              for table in ["menu", "ingredients", "units", "prepmethod", "recipe_ingredients", "instructions", "mealplan"]}
+    connection.close()
+    resippy.connection, resippy.cursor = None, None
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a synthetic resippy database.")
+    parser.add_argument('output', help="Path of the database to create.")
+    parser.add_argument('--recipes', type=int, default=10000, help="Number of recipes (default: 10000).")
+    parser.add_argument('--ingredients', type=int, default=5000, help="Number of distinct ingredients (default: 5000).")
+    parser.add_argument('--per-recipe', type=int, default=20, help="Average number of ingredients per recipe (default: 20).")
+    parser.add_argument('--seed', type=int, default=1, help="Seed, so the same database can be built again (default: 1).")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        parser.error("{} already exists.".format(args.output))
+    start = time.perf_counter()
+    counts = generate(args.output, args.recipes, args.ingredients, args.per_recipe, args.seed)
+    print("Built {p} in {t:.1f} s: ".format(p=args.output, t=time.perf_counter() - start) + ", ".join("{n} {t}".format(n=n, t=t) for t, n in counts.items()))
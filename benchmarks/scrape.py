@@ -0,0 +1,116 @@
+# resippy grocery page extraction benchmark
+#
+# Compares the ways of reading the product categories out of a grocery store search page, per lookup:
+#   soup      - the old way: a full BeautifulSoup(..., 'html.parser') tree, then find_all on it
+#   strainer  - BeautifulSoup with a SoupStrainer, so only the product divs are built into the tree
+#   scanner   - resippy.scan_product_categories over 16 KB chunks, stopping after SCRAPE_SAMPLE_PRODUCTS products
+# and reports CPU time, peak memory (tracemalloc), and whether each way picks the same aisle as the full tree.
+# Pass saved search pages (e.g. curl 'https://www.foodbasics.ca/search?filter=onion' > onion.html) to measure real ones;
+# otherwise pages shaped like the store's (inline scripts, navigation, a grid of 48 product tiles) are generated.
+#
+# usage: python benchmarks/scrape.py [PAGE.html ...] [--runs N] [--json]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import resippy
+
+AISLES = ["Fruits & Vegetables", "Dairy & Eggs", "Meat & Poultry", "Pantry", "Frozen", "Bakery", "Snacks", "International Foods"]
+
+def synthetic_page(rng, products=48):
+    """Builds a page shaped like a store search page: a large head, navigation, then product tiles mostly from one aisle."""
+    main = rng.choice(AISLES)
+    parts = ["<!DOCTYPE html><html><head><title>Search</title>",
+             "<script>var config = " + json.dumps({"k{}".format(i): "v" * 40 for i in range(800)}) + ";</script>",
+             "<style>" + "".join(".c{i} {{ margin: {i}px; padding: 0 {i}px; }}\n".format(i=i) for i in range(1500)) + "</style></head><body>",
+             "<nav><ul>" + "".join('<li class="menu-item"><a href="/aisle/{i}" data-track="nav-{i}">Aisle {i}</a></li>'.format(i=i) for i in range(300)) + "</ul></nav>",
+             '<main><div class="products-search--grid searchOnlineResults">']
+    for number in range(products):
+        aisle = main if rng.random() < 0.7 else rng.choice(AISLES)
+        parts.append(
+            '<div class="default-product-tile tile-product item-addToCart" data-product-code="{n}" data-product-name="Product {n}" '
+            'data-product-brand="Brand" data-product-category-en="{a}" data-product-category-fr="Allée">'
+            '<div class="pt__visual"><a href="/product/{n}"><picture><source srcset="/img/{n}.webp"><img src="/img/{n}.jpg" alt="Product {n}"></picture></a></div>'
+            '<div class="pt__content"><div class="pt__content--top"><p class="head__brand">Brand</p><div class="head__title">Product {n} &amp; more</div>'
+            '<div class="head__unit-details">500 g</div></div><div class="pt__content--bottom"><div class="pricing__sale-price"><span class="price-update">$4.99</span></div>'
+            '<div class="pricing__secondary-price"><span>$1.00 /100g</span></div><button class="btn btn--add" data-track="add-{n}">Add to cart</button></div></div></div>'
+            .format(n=number, a=aisle.replace("&", "&amp;")))
+    parts.append("</div></main><footer>" + "".join("<p>Footer line {i}</p>".format(i=i) for i in range(200)) + "</footer></body></html>")
+    return "".join(parts).encode("utf-8")
+
+def soup(page):
+    from bs4 import BeautifulSoup
+    tree = BeautifulSoup(page, 'html.parser')
+    return [div['data-product-category-en'] for div in tree.find_all('div', attrs={'data-product-category-en': True})]
+
+def strainer(page):
+    from bs4 import BeautifulSoup, SoupStrainer
+    tree = BeautifulSoup(page, 'html.parser', parse_only=SoupStrainer('div', attrs={'data-product-category-en': True}))
+    return [div['data-product-category-en'] for div in tree.find_all('div', attrs={'data-product-category-en': True})]
+
+def scanner(page):
+    chunks = (page[start:start + resippy.SCRAPE_CHUNK_SIZE] for start in range(0, len(page), resippy.SCRAPE_CHUNK_SIZE))
+    return resippy.scan_product_categories(chunks)
+
+METHODS = {'soup': soup, 'strainer': strainer, 'scanner': scanner}
+
+def top_aisle(categories):
+    """The aisle find_grocery_location would pick from a method's output."""
+    counts = resippy.Counter(categories)
+    return counts.most_common(1)[0][0] if counts else "Unknown"
+
+def measure(method, pages, runs):
+    """Returns the mean CPU milliseconds and the mean peak KiB of memory allocated per lookup."""
+    start = time.process_time()
+    for _ in range(runs):
+        for page in pages:
+            method(page)
+    cpu_ms = (time.process_time() - start) / (runs * len(pages)) * 1000
+    peaks = []
+    for page in pages:
+        tracemalloc.start()
+        method(page)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return round(cpu_ms, 3), round(sum(peaks) / len(peaks) / 1024, 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ways of extracting product categories from grocery store search pages.")
+    parser.add_argument('pages', nargs='*', help="Saved search pages. Without any, 8 synthetic pages are generated.")
+    parser.add_argument('--runs', type=int, default=10, help="Times each page is extracted per method (default: 10).")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, 'rb') as file:
+                pages.append(file.read())
+    else:
+        rng = random.Random(1)
+        pages = [synthetic_page(rng) for _ in range(8)]
+    expected = [top_aisle(soup(page)) for page in pages]
+    results = {
+        'pages': len(pages),
+        'mean_page_kib': round(sum(len(page) for page in pages) / len(pages) / 1024, 1),
+        'methods': {},
+    }
+    for name, method in METHODS.items():
+        cpu_ms, peak_kib = measure(method, pages, args.runs)
+        agree = sum(top_aisle(method(page)) == aisle for page, aisle in zip(pages, expected))
+        results['methods'][name] = {'cpu_ms': cpu_ms, 'peak_kib': peak_kib, 'same_aisle': "{}/{}".format(agree, len(pages))}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{pages} pages, {mean_page_kib} KiB on average".format(**results))
+        print("{:<10} {:>14} {:>16} {:>11}".format('method', 'CPU (ms/page)', 'peak mem (KiB)', 'same aisle'))
+        for name, result in results['methods'].items():
+            print("{:<10} {:>14} {:>16} {:>11}".format(name, result['cpu_ms'], result['peak_kib'], result['same_aisle']))
@@ -0,0 +1,126 @@
+# resippy HTTP API load test
+#
+# Starts `resippy.py --serve` against a scratch database, then keeps CONNECTIONS keep-alive clients busy for SECONDS seconds
+# with a mix of GET requests (menu, recipes, meal plan, grocery list) and an occasional PATCH, which invalidates the cache.
+# Reports requests per second and latency percentiles.
+#
+# usage: python benchmarks/serve.py [--connections N] [--seconds N] [--recipes N] [--write-every N] [--json]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from stress import ROOT, seed_database
+
+RESIPPY = os.path.join(ROOT, 'resippy.py')
+
+async def client(port, deadline, recipes, write_every, latencies, statuses):
+    """One keep-alive client: sends requests back to back until the deadline."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    sent = 0
+    while time.perf_counter() < deadline:
+        sent += 1
+        recipe = "Recipe%20{}".format(random.randrange(recipes))
+        if write_every and sent % write_every == 0:
+            body = json.dumps({"ian_rating": random.randint(1, 5)}).encode()
+            request = "PATCH /menu/{r} HTTP/1.1\r\nHost: resippy\r\nContent-Length: {n}\r\n\r\n".format(r=recipe, n=len(body)).encode() + body
+        else:
+            target = random.choice(["/menu?limit=20&order=name", "/menu?filter=ian_rating%20%3E%3D%204", "/recipes/" + recipe, "/mealplan", "/groceries"])
+            request = "GET {t} HTTP/1.1\r\nHost: resippy\r\n\r\n".format(t=target).encode()
+        start = time.perf_counter()
+        writer.write(request)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+async def load(port, connections, seconds, recipes, write_every):
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*[client(port, deadline, recipes, write_every, latencies, statuses) for _ in range(connections)])
+    return latencies, statuses
+
+def free_port():
+    """Returns a local port that nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(port, timeout=10):
+    """Waits until the server accepts connections."""
+    async def attempt():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.close()
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            asyncio.run(attempt())
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the throughput of resippy.py --serve.")
+    parser.add_argument('--connections', type=int, default=32, help="Number of simultaneous keep-alive clients (default: 32).")
+    parser.add_argument('--seconds', type=float, default=10, help="How long to send requests for (default: 10).")
+    parser.add_argument('--recipes', type=int, default=300, help="Number of recipes in the scratch database (default: 300).")
+    parser.add_argument('--write-every', type=int, default=50, help="Send a PATCH instead of a GET every N requests per client, 0 for none (default: 50).")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database = os.path.join(scratch, 'resippy.db')
+        seed_database(database, args.recipes, scratch)
+        env = dict(os.environ, RESIPPY_DB=database)
+        port = free_port()
+        server = subprocess.Popen([sys.executable, RESIPPY, '--serve', str(port), '--host', '127.0.0.1'], env=env, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_server(port)
+            # Fill the meal plan, so the grocery list has something in it
+            subprocess.run([sys.executable, RESIPPY, '--plan-week', '--seed', '1'], env=env, stdout=subprocess.DEVNULL, check=True)
+            start = time.perf_counter()
+            latencies, statuses = asyncio.run(load(port, args.connections, args.seconds, args.recipes, args.write_every))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    results = {
+        'connections': args.connections,
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'median': round(statistics.median(latencies), 2),
+            'p95': round(latencies[int(len(latencies) * 0.95)], 2),
+            'p99': round(latencies[int(len(latencies) * 0.99)], 2),
+            'max': round(latencies[-1], 2),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{requests} requests over {connections} connections: {requests_per_second} requests/s".format(**results))
+        print("latency (ms): median {median}, p95 {p95}, p99 {p99}, max {max}".format(**results['latency_ms']))
+        print("statuses: " + ", ".join("{} x{}".format(status, count) for status, count in results['statuses'].items()))
@@ -0,0 +1,91 @@
+# resippy startup benchmark
+#
+# Measures the cold-start latency of resippy.py subcommands, python -X importtime style.
+# Each command is run in a fresh interpreter against a scratch database, so nothing is cached between runs.
+#
+# usage: python benchmarks/startup.py [--runs N] [--json]
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RESIPPY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resippy.py')
+
+# Subcommands to time. All of them are read-only, so the scratch database stays the same between runs.
+COMMANDS = {
+    'rating': ['--rating'],
+    'help': ['--help'],
+    'viewmenu': ['--viewmenu'],
+    'viewmenu_filtered': ['--viewmenu', '--filter', 'drumlin_rating > 3', '--order', 'name ASC'],
+    'printmealplan': ['--printmealplan'],
+    'groceries': ['--groceries'],
+    'random': ['--random'],
+    'aisle_cache': ['--aisle-cache'],
+}
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+def parse_importtime(stderr):
+    """Reads the output of python -X importtime.
+
+    Args:
+        stderr (str): Standard error of the benchmarked process.
+
+    Returns:
+        The total import time in microseconds (sum of the top-level imports), and a list of (cumulative time, module) tuples for the top-level imports.
+    """
+    top_level = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and match.group(3) == '':
+            top_level.append((int(match.group(2)), match.group(4)))
+    return sum(us for us, _ in top_level), top_level
+
+def time_command(arguments, runs, env, cwd):
+    """Runs one resippy.py command several times in fresh interpreters.
+
+    Returns:
+        dict: Wall-clock and import times in milliseconds, plus the slowest top-level imports of the last run.
+    """
+    wall = []
+    imports = []
+    slowest = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', RESIPPY] + arguments, env=env, cwd=cwd, capture_output=True, text=True)
+        wall.append((time.perf_counter() - start) * 1000)
+        total, top_level = parse_importtime(result.stderr)
+        imports.append(total / 1000)
+        slowest = sorted(top_level, reverse=True)[:3]
+    return {
+        'wall_ms_min': round(min(wall), 2),
+        'wall_ms_median': round(statistics.median(wall), 2),
+        'import_ms_median': round(statistics.median(imports), 2),
+        'slowest_imports': [{'module': module, 'ms': round(us / 1000, 2)} for us, module in slowest],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the cold start of each resippy.py subcommand.")
+    parser.add_argument('--runs', type=int, default=5, help="Number of runs per command.")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, RESIPPY_DB=os.path.join(scratch, 'resippy.db'))
+        # Create the schema once so every command below measures a warm-schema start
+        subprocess.run([sys.executable, RESIPPY, '--printmealplan'], env=env, cwd=scratch, capture_output=True)
+        results = {name: time_command(arguments, args.runs, env, scratch) for name, arguments in COMMANDS.items()}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{:<20} {:>10} {:>12} {:>11}  {}".format('command', 'min (ms)', 'median (ms)', 'imports', 'slowest imports'))
+        for name, result in results.items():
+            slowest = ", ".join("{module} {ms}".format(**i) for i in result["slowest_imports"])
+            print("{:<20} {:>10} {:>12} {:>11}  {}".format(name, result['wall_ms_min'], result['wall_ms_median'], result['import_ms_median'], slowest))
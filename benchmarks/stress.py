@@ -0,0 +1,177 @@
+# resippy concurrency stress test
+#
+# Simulates several roommates using one resippy.db at the same time: each worker process opens its own connection
+# and runs a random mix of reads (--viewmenu, --groceries, --search, --printmealplan) and writes (--update_menu,
+# --addtomealplan, --plan-week, --new with --addingredients) as fast as it can.
+# Reports throughput, latency per command, and every "database is locked" failure. Exits with status 1 if there were any.
+#
+# usage: python benchmarks/stress.py [--processes N] [--commands N] [--recipes N] [--busy-timeout SECONDS] [--json]
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Relative frequency of each kind of command
+MIX = {
+    'viewmenu': 4,
+    'groceries': 3,
+    'search': 2,
+    'printmealplan': 2,
+    'update_menu': 4,
+    'addtomealplan': 2,
+    'plan_week': 1,
+    'new_recipe': 2,
+}
+
+def load_resippy(database):
+    """Imports resippy.py against the given database (its path is read from RESIPPY_DB at import time)."""
+    os.environ['RESIPPY_DB'] = database
+    sys.path.insert(0, ROOT)
+    import resippy
+    return resippy
+
+def seed_database(database, recipes, scratch):
+    """Creates the scratch database: recipes with ingredients and instructions, and a .csv for new recipes to use."""
+    resippy = load_resippy(database)
+    resippy.open_database()
+    ingredients = ["Ingredient {}".format(i) for i in range(200)]
+    cuisines = ["Thai", "Mexican", "Italian", "Indian", "French"]
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name, cuisine, dish_type, ian_rating) VALUES (?, ?, ?, ?)",
+                                   [("Recipe {}".format(i), random.choice(cuisines), random.choice(["Soup", "Pasta", "Salad"]), random.randint(1, 5)) for i in range(recipes)])
+        recipe_ids = resippy.load_lookup('menu', 'name', 'id')
+        resippy.ingest_ingredients({recipe_id: [(name, random.randint(1, 4), "Cup", None) for name in random.sample(ingredients, 8)] for recipe_id in recipe_ids.values()},
+                                   {name: "Aisle {}".format(i % 12) for i, name in enumerate(ingredients)})
+        resippy.ingest_instructions({recipe_id: ["Cook it.", "Serve it."] for recipe_id in recipe_ids.values()})
+        # Plan the coming week, so --groceries has a list to show even before any roommate has planned a meal
+        days = [date.today() + timedelta(days=offset) for offset in range(1, 8)]
+        resippy.cursor.executemany("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?",
+                                   [(day.isoformat(), random.choice(list(recipe_ids.values())), WEEKDAYS[day.weekday()]) for day in days])
+    resippy.connection.close()
+    # Every ingredient is already in the database, so adding it never waits on the grocery store
+    csv_path = os.path.join(scratch, 'new_recipe.csv')
+    with open(csv_path, 'w') as file:
+        file.write("ingredient,quantity,units,prepmethod\n")
+        for name in ingredients[:6]:
+            file.write("{},1,cup,chopped\n".format(name.lower()))
+    return csv_path
+
+def commands_for(kind, worker, number, recipes, csv_path):
+    """Returns the command lines (as they would be typed after resippy.py) for one simulated action."""
+    recipe = "Recipe {}".format(random.randrange(recipes))
+    if kind == 'viewmenu':
+        return [['--viewmenu', '--filter', 'ian_rating >= 3', '--order', 'name', '--limit', '20']]
+    if kind == 'groceries':
+        return [['--groceries']]
+    if kind == 'search':
+        return [['--search', 'ingredient', '--limit', '5']]
+    if kind == 'printmealplan':
+        return [['--printmealplan']]
+    if kind == 'update_menu':
+        return [['--update_menu', recipe, '--ian_rating', str(random.randint(1, 5))]]
+    if kind == 'addtomealplan':
+        return [['--addtomealplan', random.choice(WEEKDAYS), recipe]]
+    if kind == 'plan_week':
+        return [['--plan-week', '--seed', str(number)]]
+    name = "Stress {} {}".format(worker, number)
+    return [['--new', name], ['--addingredients', name, csv_path]]
+
+def worker(worker_number, database, commands, recipes, csv_path, results):
+    """Runs one simulated roommate: its own process, connection, and random stream of commands."""
+    random.seed(worker_number)
+    resippy = load_resippy(database)
+    parser = resippy.create_parser()
+    kinds = list(MIX)
+    weights = [MIX[kind] for kind in kinds]
+    timings = []
+    failures = []
+    # Always replace existing meals, so the prompts never wait for a real person
+    sys.stdin = io.StringIO("Y\n" * (4 * commands))
+    for number in range(commands):
+        kind = random.choices(kinds, weights)[0]
+        start = time.perf_counter()
+        output = io.StringIO()
+        succeeded = True
+        try:
+            with contextlib.redirect_stdout(output):
+                for command in commands_for(kind, worker_number, number, recipes, csv_path):
+                    succeeded = resippy.run_command(parser.parse_args(command)) and succeeded
+        except Exception as e:
+            succeeded = False
+            output.write("{}: {}".format(type(e).__name__, e))
+        timings.append((kind, (time.perf_counter() - start) * 1000))
+        if not succeeded:
+            failures.append({'worker': worker_number, 'command': kind, 'locked': "locked" in output.getvalue(), 'output': output.getvalue().strip()[-300:]})
+    results.put({'timings': timings, 'failures': failures})
+
+def run(processes, commands, recipes, busy_timeout):
+    with tempfile.TemporaryDirectory() as scratch:
+        database = os.path.join(scratch, 'resippy.db')
+        os.environ['RESIPPY_BUSY_TIMEOUT'] = str(busy_timeout)
+        # The scratch grocery store URL is never contacted: every ingredient used is already in the database
+        os.environ['RESIPPY_GROCERY_URL'] = 'http://127.0.0.1:9/search'
+        context = multiprocessing.get_context('spawn')
+        seeder = context.Process(target=seed_database, args=(database, recipes, scratch))
+        seeder.start()
+        seeder.join()
+        csv_path = os.path.join(scratch, 'new_recipe.csv')
+        results = context.Queue()
+        workers = [context.Process(target=worker, args=(n, database, commands, recipes, csv_path, results)) for n in range(processes)]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        collected = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - start
+    by_kind = {}
+    for result in collected:
+        for kind, ms in result['timings']:
+            by_kind.setdefault(kind, []).append(ms)
+    failures = [failure for result in collected for failure in result['failures']]
+    total = sum(len(timings) for timings in by_kind.values())
+    return {
+        'processes': processes,
+        'commands': total,
+        'seconds': round(elapsed, 2),
+        'commands_per_second': round(total / elapsed, 1),
+        'locked': sum(failure['locked'] for failure in failures),
+        'failed': len(failures),
+        'latency_ms': {kind: {'count': len(ms), 'median': round(statistics.median(ms), 2), 'p95': round(sorted(ms)[int(len(ms) * 0.95)], 2), 'max': round(max(ms), 2)}
+                       for kind, ms in sorted(by_kind.items())},
+        'failures': failures[:10],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many simulated roommates against one resippy database at the same time.")
+    parser.add_argument('--processes', type=int, default=8, help="Number of simultaneous processes (default: 8).")
+    parser.add_argument('--commands', type=int, default=100, help="Number of actions per process (default: 100).")
+    parser.add_argument('--recipes', type=int, default=300, help="Number of recipes in the scratch database (default: 300).")
+    parser.add_argument('--busy-timeout', type=float, default=10, help="RESIPPY_BUSY_TIMEOUT for every process, in seconds (default: 10).")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results = run(args.processes, args.commands, args.recipes, args.busy_timeout)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{processes} processes ran {commands} commands in {seconds} s ({commands_per_second}/s): {failed} failed, {locked} with \"database is locked\".".format(**results))
+        print("{:<15} {:>7} {:>12} {:>10} {:>10}".format('command', 'count', 'median (ms)', 'p95 (ms)', 'max (ms)'))
+        for kind, latency in results['latency_ms'].items():
+            print("{:<15} {:>7} {:>12} {:>10} {:>10}".format(kind, latency['count'], latency['median'], latency['p95'], latency['max']))
+        for failure in results['failures']:
+            print("worker {worker} {command}: {output}".format(**failure))
+    sys.exit(1 if results['locked'] else 0)
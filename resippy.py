@@ -1,58 +1,453 @@
 # resippy
 
 import sqlite3
-import sqlparse
 import argparse
 import atexit
 from datetime import date, datetime, timedelta
 import re
-from tabulate import tabulate
-from sqlparse.tokens import Keyword
 import csv
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from array import array
+import heapq
+import math
+import random
+from functools import lru_cache
+import shlex
 import shutil
-from bs4 import BeautifulSoup
-import requests
+import sys
+import threading
+import time
 import os
-
-connection = sqlite3.connect('resippy.db')
-cursor = connection.cursor()
+# Heavier third-party modules (tabulate, requests) are imported inside the functions that use them,
+# so commands that don't need them (e.g. --rating) start quickly.
+
+# The connection is opened on first use by open_database()
+DATABASE_PATH = os.environ.get('RESIPPY_DB', 'resippy.db')
+connection = None
+cursor = None
+
+# Concurrent access: seconds to wait for another roommate's write to finish, then how many more times to try
+BUSY_TIMEOUT = float(os.environ.get('RESIPPY_BUSY_TIMEOUT', 10))
+WRITE_RETRIES = 5
+
+# Directory import (--import-dir): below this many recipes, parsing in-process is faster than starting a pool
+IMPORT_POOL_THRESHOLD = 32
+
+# Snapshots (--export, --import, --backup)
+# Tables in dependency order: a row only refers to rows of tables listed before it, so an import can remap ids as it streams.
+SNAPSHOT_TABLES = [
+    ('units', 'unit_id', ['unit_id', 'unit_name']),
+    ('prepmethod', 'prepmethod_id', ['prepmethod_id', 'prepmethod_name']),
+    ('ingredients', 'ingredient_id', ['ingredient_id', 'ingredient_name', 'grocery_location']),
+    ('menu', 'id', ['id', 'name', 'dish_type', 'cuisine', 'drumlin_rating', 'ian_rating', 'lina_rating', 'last_made']),
+    ('recipe_ingredients', 'matching_id', ['recipe_id', 'ingredient_id', 'quantity', 'unit_id', 'prepmethod_id']),
+    ('instructions', 'instruction_id', ['recipe_id', 'instruction']),
+    ('mealplan', 'day', ['day', 'date', 'recipe_id']),
+]
+SNAPSHOT_BATCH_SIZE = 500
+BACKUP_PAGES_PER_STEP = 256
+
+# Grocery location scraping
+GROCERY_SEARCH_URL = os.environ.get('RESIPPY_GROCERY_URL', "https://www.foodbasics.ca/search")
+SCRAPE_WORKERS = 8
+SCRAPE_TIMEOUT = (3.05, 10)
+SCRAPE_RETRIES = 3
+SCRAPE_BACKOFF = 0.5
+# The search page is scanned as it downloads, for product divs only, and scanning stops after SCRAPE_SAMPLE_PRODUCTS of them
+SCRAPE_SAMPLE_PRODUCTS = 24
+SCRAPE_CHUNK_SIZE = 16 * 1024
+PRODUCT_CATEGORY_PATTERN = re.compile(rb"""<div\b[^>]*?\sdata-product-category-en\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Menu viewing
+MENU_PAGE_SIZE = 20
+# --printrecipe loads and prints this many recipes at a time, so printing a large selection doesn't hold it all in memory
+PRINT_BATCH_SIZE = 100
+
+# Output formats (--format) of the read commands. "grid" is the console layout, the default on a terminal;
+# piped output defaults to tab-separated values, which are streamed without measuring or wrapping any cells.
+OUTPUT_FORMATS = ["grid", "csv", "tsv", "json", "jsonl"]
+PIPED_OUTPUT_FORMAT = "tsv"
+
+# Random suggestions (--random)
+RANDOM_RECENT_DAYS = 30
+RANDOM_MIN_RECENCY = 0.05
+
+# Week planning (--plan-week)
+PLAN_SKIP_RECENT_DAYS = 14
+PLAN_MAX_REPEATS = 2
+PLAN_OVERLAP_WEIGHT = 0.05
+PLAN_DIVERSITY_PENALTY = 0.3
+PLAN_JITTER = 0.15
+PLAN_POOL_SIZE = 150
+
+# Pantry matching (--cook-from)
+PantryIndex = namedtuple('PantryIndex', ['postings', 'recipe_ingredients', 'state'])
+_pantry_index = None
+
+# Fuzzy name matching: trigram index over recipe and ingredient names, for "did you mean" suggestions and --canonicalize
+NameIndex = namedtuple('NameIndex', ['names', 'sizes', 'postings', 'state'])
+FUZZY_TABLES = {'menu': ('id', 'name'), 'ingredients': ('ingredient_id', 'ingredient_name')}
+FUZZY_MIN_SIMILARITY = 0.3
+FUZZY_SUGGESTIONS = 3
+CANONICAL_MIN_SIMILARITY = 0.8
+_name_indexes = {}
+
+# Profiling (--profile)
+_profile = None
+_profile_lock = threading.Lock()
+PROFILE_TOP_STATEMENTS = 15
+
+# HTTP API (--serve)
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 8000
+SERVE_READ_CONNECTIONS = 4
+SERVE_MAX_BODY = 64 * 1024
+# GET routes whose answer depends on today's date as well as the data, so their cached responses are kept per day
+SERVE_DATED_ROUTES = {"groceries"}
+HTTP_STATUS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+_read_local = threading.local()
+
+# Aisle lookup cache
+AISLE_CACHE_TTL = 90 * 24 * 60 * 60
+AISLE_CACHE_NEGATIVE_TTL = 24 * 60 * 60
+AISLE_CACHE_MAX_ENTRIES = 5000
+
+# Aisle classifier: naive Bayes over the words and character trigrams of ingredient names, trained on the ingredients table
+# and saved next to the database. Guesses at least AISLE_CONFIDENCE sure are used instead of scraping; with RESIPPY_OFFLINE set, every guess is.
+AisleModel = namedtuple('AisleModel', ['version', 'aisles', 'totals', 'features'])
+AISLE_NGRAM = 3
+AISLE_SMOOTHING = 0.5
+AISLE_CONFIDENCE = 0.9
+AISLE_MIN_EXAMPLES = 50
+OFFLINE = os.environ.get('RESIPPY_OFFLINE', '') not in ('', '0')
+_aisle_model = None
 
 # Database Set-Up
+# Builds the full-text search document of the recipes whose id matches {match} (e.g. "= NEW.recipe_id").
+SEARCH_DOCUMENT_INSERT = """
+    INSERT INTO recipe_search (rowid, name, ingredients, instructions)
+    SELECT m.id, m.name,
+        (SELECT group_concat(i.ingredient_name || COALESCE(' ' || p.prepmethod_name, ''), ' ')
+         FROM recipe_ingredients ri
+         JOIN ingredients i ON i.ingredient_id = ri.ingredient_id
+         LEFT JOIN prepmethod p ON p.prepmethod_id = ri.prepmethod_id
+         WHERE ri.recipe_id = m.id),
+        (SELECT group_concat(instruction, ' ') FROM instructions WHERE recipe_id = m.id)
+    FROM menu m WHERE m.id {match}
+"""
+SEARCH_DOCUMENT_REFRESH = "DELETE FROM recipe_search WHERE rowid {match}; " + SEARCH_DOCUMENT_INSERT + ";"
+# Marks the grocery contribution of recipe {recipe} (e.g. "NEW.recipe_id") for recomputing, and the stored grocery list as stale if the recipe is planned.
+GROCERY_RECIPE_STALE = """
+    INSERT OR IGNORE INTO grocery_stale_recipes (recipe_id) VALUES ({recipe});
+    UPDATE grocery_state SET stale = 1 WHERE stale = 0 AND EXISTS (SELECT 1 FROM mealplan WHERE recipe_id = {recipe});
+"""
+GROCERY_LIST_STALE = "UPDATE grocery_state SET stale = 1 WHERE stale = 0;"
+# Records that recipe {recipe} changed, for apply_recipe_changes. ingredients is 1 if its ingredients changed (so its grocery contribution did too).
+RECIPE_CHANGED = "INSERT OR IGNORE INTO recipe_changes (recipe_id, ingredients) VALUES ({recipe}, 0);"
+RECIPE_INGREDIENTS_CHANGED = "INSERT OR REPLACE INTO recipe_changes (recipe_id, ingredients) VALUES ({recipe}, 1);"
+# Brings the search documents and grocery state of every changed recipe up to date, once per transaction instead of once per row
+APPLY_RECIPE_CHANGES = [
+    "DELETE FROM recipe_search WHERE rowid IN (SELECT recipe_id FROM recipe_changes)",
+    SEARCH_DOCUMENT_INSERT.format(match="IN (SELECT recipe_id FROM recipe_changes)"),
+    "INSERT OR IGNORE INTO grocery_stale_recipes (recipe_id) SELECT recipe_id FROM recipe_changes WHERE ingredients = 1",
+    "UPDATE grocery_state SET stale = 1 WHERE stale = 0 AND EXISTS (SELECT 1 FROM recipe_changes c JOIN mealplan m ON m.recipe_id = c.recipe_id WHERE c.ingredients = 1)",
+    "DELETE FROM recipe_changes",
+]
+# Whether ingredients row {row} ("NEW" or "OLD") has an aisle the aisle classifier trains on
+AISLE_LABELLED = "({row}.grocery_location IS NOT NULL AND {row}.grocery_location != 'Unknown')"
+AISLE_MODEL_STALE = "UPDATE aisle_model_state SET version = version + 1;"
+
+# Each entry is one schema version. Never edit an entry that has shipped: append a new one instead.
+# The database's PRAGMA user_version records how many entries have been applied.
+SCHEMA_MIGRATIONS = [
+    # 1: Original tables
+    [
+        'CREATE TABLE IF NOT EXISTS menu (id INTEGER PRIMARY KEY, name TEXT UNIQUE, dish_type TEXT, cuisine TEXT, drumlin_rating DECIMAL, ian_rating DECIMAL, lina_rating DECIMAL, last_made DATE)',
+        'CREATE TABLE IF NOT EXISTS ingredients (ingredient_id INTEGER PRIMARY KEY, ingredient_name TEXT UNIQUE, grocery_location TEXT)',
+        'CREATE TABLE IF NOT EXISTS units (unit_id INTEGER PRIMARY KEY, unit_name TEXT UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS prepmethod (prepmethod_id INTEGER PRIMARY KEY, prepmethod_name TEXT UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS recipe_ingredients (matching_id INTEGER PRIMARY KEY, recipe_id INTEGER, ingredient_id INTEGER, quantity DECIMAL, unit_id INTEGER, prepmethod_id INTEGER, FOREIGN KEY (recipe_id) REFERENCES menu(id), FOREIGN KEY (ingredient_id) REFERENCES ingredients(ingredient_id), FOREIGN KEY (unit_id) REFERENCES units(unit_id), FOREIGN KEY (prepmethod_id) REFERENCES prepmethod(prepmethod_id))',
+        'CREATE TABLE IF NOT EXISTS instructions (instruction_id INTEGER PRIMARY KEY, recipe_id INTEGER, instruction TEXT, FOREIGN KEY (recipe_id) REFERENCES menu(id))',
+        'CREATE TABLE IF NOT EXISTS mealplan (day TEXT PRIMARY KEY, date DATE, recipe_id INTEGER, FOREIGN KEY (recipe_id) REFERENCES menu(id), CHECK (CAST(day AS INTEGER) <= 7))',
+        "INSERT OR IGNORE INTO mealplan (day) VALUES ('Monday'), ('Tuesday'), ('Wednesday'), ('Thursday'), ('Friday'), ('Saturday'), ('Sunday')",
+    ],
+    # 2: Aisle lookup cache
+    [
+        'CREATE TABLE IF NOT EXISTS aisle_cache (search_term TEXT PRIMARY KEY, grocery_location TEXT, fetched_at REAL, ttl INTEGER, failed INTEGER DEFAULT 0)',
+    ],
+    # 3: Indexes for the hot lookups (recipe printing, grocery list, ingredient usage)
+    [
+        'CREATE INDEX IF NOT EXISTS recipe_ingredients_by_recipe ON recipe_ingredients (recipe_id, ingredient_id, unit_id, quantity, prepmethod_id)',
+        'CREATE INDEX IF NOT EXISTS recipe_ingredients_by_ingredient ON recipe_ingredients (ingredient_id, recipe_id)',
+        'CREATE INDEX IF NOT EXISTS instructions_by_recipe ON instructions (recipe_id)',
+        'CREATE INDEX IF NOT EXISTS mealplan_by_date ON mealplan (date, recipe_id)',
+        'CREATE INDEX IF NOT EXISTS aisle_cache_by_age ON aisle_cache (failed, fetched_at)',
+    ],
+    # 4: Keyset pagination of the menu by last-made date
+    [
+        'CREATE INDEX IF NOT EXISTS menu_by_last_made ON menu (last_made, id)',
+    ],
+    # 5: Full-text search over recipe names, ingredients, prepmethods, and instructions, kept in sync by triggers
+    [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS recipe_search USING fts5(name, ingredients, instructions, tokenize='porter unicode61')",
+        'CREATE TRIGGER IF NOT EXISTS menu_search_insert AFTER INSERT ON menu BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.id")),
+        'CREATE TRIGGER IF NOT EXISTS menu_search_update AFTER UPDATE OF name ON menu BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.id")),
+        'CREATE TRIGGER IF NOT EXISTS menu_search_delete AFTER DELETE ON menu BEGIN DELETE FROM recipe_search WHERE rowid = OLD.id; END',
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_search_insert AFTER INSERT ON recipe_ingredients BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_search_update AFTER UPDATE ON recipe_ingredients BEGIN {o} {r} END'.format(o=SEARCH_DOCUMENT_REFRESH.format(match="= OLD.recipe_id"), r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_search_delete AFTER DELETE ON recipe_ingredients BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= OLD.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_search_insert AFTER INSERT ON instructions BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_search_update AFTER UPDATE ON instructions BEGIN {o} {r} END'.format(o=SEARCH_DOCUMENT_REFRESH.format(match="= OLD.recipe_id"), r=SEARCH_DOCUMENT_REFRESH.format(match="= NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_search_delete AFTER DELETE ON instructions BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="= OLD.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS ingredients_search_update AFTER UPDATE OF ingredient_name ON ingredients BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="IN (SELECT recipe_id FROM recipe_ingredients WHERE ingredient_id = NEW.ingredient_id)")),
+        'CREATE TRIGGER IF NOT EXISTS prepmethod_search_update AFTER UPDATE OF prepmethod_name ON prepmethod BEGIN {r} END'.format(r=SEARCH_DOCUMENT_REFRESH.format(match="IN (SELECT recipe_id FROM recipe_ingredients WHERE prepmethod_id = NEW.prepmethod_id)")),
+        SEARCH_DOCUMENT_INSERT.format(match="IN (SELECT id FROM menu)"),
+    ],
+    # 6: Materialized grocery list. Each recipe's summed ingredients are kept in grocery_contributions and only recomputed when the recipe
+    # changes; the list itself is rebuilt from the contributions of the planned recipes when the meal plan, a planned recipe, or an ingredient changes.
+    [
+        'CREATE TABLE IF NOT EXISTS grocery_contributions (recipe_id INTEGER, ingredient_id INTEGER, unit_id INTEGER, quantity DECIMAL)',
+        'CREATE INDEX IF NOT EXISTS grocery_contributions_by_recipe ON grocery_contributions (recipe_id, ingredient_id, unit_id, quantity)',
+        'CREATE TABLE IF NOT EXISTS grocery_stale_recipes (recipe_id INTEGER PRIMARY KEY)',
+        'CREATE TABLE IF NOT EXISTS grocery_list (location TEXT, ingredient_name TEXT, unit_name TEXT, quantity DECIMAL)',
+        'CREATE TABLE IF NOT EXISTS grocery_saved (location TEXT, ingredient_name TEXT, unit_name TEXT, quantity DECIMAL)',
+        'CREATE TABLE IF NOT EXISTS grocery_state (id INTEGER PRIMARY KEY CHECK (id = 1), built_for DATE, stale INTEGER DEFAULT 1, saved_at TEXT)',
+        'INSERT OR IGNORE INTO grocery_state (id, stale) VALUES (1, 1)',
+        'CREATE TRIGGER IF NOT EXISTS mealplan_grocery_insert AFTER INSERT ON mealplan BEGIN {s} END'.format(s=GROCERY_LIST_STALE),
+        'CREATE TRIGGER IF NOT EXISTS mealplan_grocery_update AFTER UPDATE ON mealplan BEGIN {s} END'.format(s=GROCERY_LIST_STALE),
+        'CREATE TRIGGER IF NOT EXISTS mealplan_grocery_delete AFTER DELETE ON mealplan BEGIN {s} END'.format(s=GROCERY_LIST_STALE),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_grocery_insert AFTER INSERT ON recipe_ingredients BEGIN {s} END'.format(s=GROCERY_RECIPE_STALE.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_grocery_update AFTER UPDATE ON recipe_ingredients BEGIN {o} {s} END'.format(o=GROCERY_RECIPE_STALE.format(recipe="OLD.recipe_id"), s=GROCERY_RECIPE_STALE.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_grocery_delete AFTER DELETE ON recipe_ingredients BEGIN {s} END'.format(s=GROCERY_RECIPE_STALE.format(recipe="OLD.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS ingredients_grocery_update AFTER UPDATE OF ingredient_name, grocery_location ON ingredients BEGIN {s} END'.format(
+            s=GROCERY_LIST_STALE[:-1] + " AND EXISTS (SELECT 1 FROM recipe_ingredients ri JOIN mealplan m ON m.recipe_id = ri.recipe_id WHERE ri.ingredient_id = NEW.ingredient_id);"),
+        'INSERT OR IGNORE INTO grocery_stale_recipes (recipe_id) SELECT DISTINCT recipe_id FROM recipe_ingredients',
+    ],
+    # 7: Version of the aisle labels in the ingredients table, so a saved aisle classifier knows when to retrain
+    [
+        'CREATE TABLE IF NOT EXISTS aisle_model_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER DEFAULT 0)',
+        'INSERT OR IGNORE INTO aisle_model_state (id, version) VALUES (1, 0)',
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_insert AFTER INSERT ON ingredients BEGIN UPDATE aisle_model_state SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_update AFTER UPDATE OF ingredient_name, grocery_location ON ingredients BEGIN UPDATE aisle_model_state SET version = version + 1; END',
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_delete AFTER DELETE ON ingredients BEGIN UPDATE aisle_model_state SET version = version + 1; END',
+    ],
+    # 8: Row triggers only record which recipes changed; their search documents and grocery contributions are brought up to date
+    # once per transaction (apply_recipe_changes), so bulk writes no longer rebuild a recipe's search document for every row
+    [
+        'CREATE TABLE IF NOT EXISTS recipe_changes (recipe_id INTEGER PRIMARY KEY, ingredients INTEGER NOT NULL DEFAULT 0)',
+    ] + ['DROP TRIGGER IF EXISTS {t}'.format(t=trigger) for trigger in [
+        'menu_search_insert', 'menu_search_update', 'menu_search_delete',
+        'recipe_ingredients_search_insert', 'recipe_ingredients_search_update', 'recipe_ingredients_search_delete',
+        'instructions_search_insert', 'instructions_search_update', 'instructions_search_delete',
+        'ingredients_search_update', 'prepmethod_search_update',
+        'recipe_ingredients_grocery_insert', 'recipe_ingredients_grocery_update', 'recipe_ingredients_grocery_delete',
+    ]] + [
+        'CREATE TRIGGER IF NOT EXISTS menu_changes_insert AFTER INSERT ON menu BEGIN {c} END'.format(c=RECIPE_CHANGED.format(recipe="NEW.id")),
+        'CREATE TRIGGER IF NOT EXISTS menu_changes_update AFTER UPDATE OF name ON menu BEGIN {c} END'.format(c=RECIPE_CHANGED.format(recipe="NEW.id")),
+        'CREATE TRIGGER IF NOT EXISTS menu_changes_delete AFTER DELETE ON menu BEGIN {c} END'.format(c=RECIPE_CHANGED.format(recipe="OLD.id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_changes_insert AFTER INSERT ON recipe_ingredients BEGIN {c} END'.format(c=RECIPE_INGREDIENTS_CHANGED.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_changes_update AFTER UPDATE ON recipe_ingredients BEGIN {o} {c} END'.format(o=RECIPE_INGREDIENTS_CHANGED.format(recipe="OLD.recipe_id"), c=RECIPE_INGREDIENTS_CHANGED.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS recipe_ingredients_changes_delete AFTER DELETE ON recipe_ingredients BEGIN {c} END'.format(c=RECIPE_INGREDIENTS_CHANGED.format(recipe="OLD.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_changes_insert AFTER INSERT ON instructions BEGIN {c} END'.format(c=RECIPE_CHANGED.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_changes_update AFTER UPDATE ON instructions BEGIN {o} {c} END'.format(o=RECIPE_CHANGED.format(recipe="OLD.recipe_id"), c=RECIPE_CHANGED.format(recipe="NEW.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS instructions_changes_delete AFTER DELETE ON instructions BEGIN {c} END'.format(c=RECIPE_CHANGED.format(recipe="OLD.recipe_id")),
+        'CREATE TRIGGER IF NOT EXISTS ingredients_changes_update AFTER UPDATE OF ingredient_name ON ingredients BEGIN '
+        'INSERT OR IGNORE INTO recipe_changes (recipe_id, ingredients) SELECT recipe_id, 0 FROM recipe_ingredients WHERE ingredient_id = NEW.ingredient_id; END',
+        'CREATE TRIGGER IF NOT EXISTS prepmethod_changes_update AFTER UPDATE OF prepmethod_name ON prepmethod BEGIN '
+        'INSERT OR IGNORE INTO recipe_changes (recipe_id, ingredients) SELECT recipe_id, 0 FROM recipe_ingredients WHERE prepmethod_id = NEW.prepmethod_id; END',
+    ],
+    # 9: Only changes to labelled ingredients change what the aisle classifier trains on, so only they make it retrain
+    ['DROP TRIGGER IF EXISTS {t}'.format(t=trigger) for trigger in ['ingredients_aisle_insert', 'ingredients_aisle_update', 'ingredients_aisle_delete']] + [
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_insert AFTER INSERT ON ingredients WHEN {n} BEGIN {s} END'.format(n=AISLE_LABELLED.format(row="NEW"), s=AISLE_MODEL_STALE),
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_update AFTER UPDATE OF ingredient_name, grocery_location ON ingredients '
+        'WHEN ({o} OR {n}) AND (OLD.ingredient_name IS NOT NEW.ingredient_name OR OLD.grocery_location IS NOT NEW.grocery_location) BEGIN {s} END'.format(
+            o=AISLE_LABELLED.format(row="OLD"), n=AISLE_LABELLED.format(row="NEW"), s=AISLE_MODEL_STALE),
+        'CREATE TRIGGER IF NOT EXISTS ingredients_aisle_delete AFTER DELETE ON ingredients WHEN {o} BEGIN {s} END'.format(o=AISLE_LABELLED.format(row="OLD"), s=AISLE_MODEL_STALE),
+    ],
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
 def setup_database(cursor, connection):
     """
-    Sets up the sqlite3 database.
+    Sets up the sqlite3 database, applying any schema migrations it is missing.
+    Does nothing beyond reading PRAGMA user_version if the schema is already current.
 
     Arguments:
         connection(sqlite3.Connection object): Connection to the resippy database. 
         cursor(sqlite3.Cursor object): Cursor for the resippy database.
-    """
-    # Make tables if they do not already exist
-    cursor.execute('CREATE TABLE IF NOT EXISTS menu (id INTEGER PRIMARY KEY, name TEXT UNIQUE, dish_type TEXT, cuisine TEXT, drumlin_rating DECIMAL, ian_rating DECIMAL, lina_rating DECIMAL, last_made DATE)')
-    connection.commit()
 
-    cursor.execute('CREATE TABLE IF NOT EXISTS ingredients (ingredient_id INTEGER PRIMARY KEY, ingredient_name TEXT UNIQUE, grocery_location TEXT)')
-    connection.commit()
-    
-    cursor.execute('CREATE TABLE IF NOT EXISTS units (unit_id INTEGER PRIMARY KEY, unit_name TEXT UNIQUE)')
-    connection.commit()
+    Raises:
+        sqlite3.DatabaseError if the database was made by a newer version of resippy, or if a migration fails (that migration is rolled back).
+    """
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError("The database is at schema version {v}, but this version of resippy only knows up to {s}. Please update resippy.".format(v=version, s=SCHEMA_VERSION))
+    # Apply each missing migration in its own transaction, together with its version bump
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for statement in migration:
+                cursor.execute(statement)
+            cursor.execute('PRAGMA user_version = {n}'.format(n=number))
+            # Committed directly: before migration 8 there is no recipe_changes table for commit() to apply
+            sqlite3.Connection.commit(connection)
+        except sqlite3.DatabaseError:
+            connection.rollback()
+            raise
+
+class ResippyConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose commits can be deferred.
+    While defer_commits is True, commit() and "with connection:" blocks leave the transaction open, so a batch script can group many commands into one commit (see run_script).
+    "with connection:" blocks take the write lock up front (BEGIN IMMEDIATE), so a write never fails halfway because someone else wrote first.
+    Every commit first applies the recipe changes recorded by the row triggers (see apply_recipe_changes).
+    """
+    defer_commits = False
+    cursor_factory = sqlite3.Cursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_factory)
+
+    def __enter__(self):
+        if _profile is not None:
+            self.write_started = time.perf_counter()
+        if not self.in_transaction:
+            self.begin_immediate()
+        return self
+
+    def begin_immediate(self):
+        """
+        Starts a write transaction. Waits up to BUSY_TIMEOUT seconds for other writers, then retries WRITE_RETRIES times with a random backoff.
+
+        Raises:
+            sqlite3.OperationalError if the database is still locked after the last attempt.
+        """
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+    def begin_command(self):
+        """Starts one command of a batch script: a write transaction (if one isn't open already) and a savepoint to undo the command on its own."""
+        if not self.in_transaction:
+            self.begin_immediate()
+        self.execute("SAVEPOINT script_command")
+
+    def end_command(self, succeeded):
+        """Keeps (or undoes, if it failed) the command started by begin_command."""
+        if not succeeded:
+            self.execute("ROLLBACK TO script_command")
+        self.execute("RELEASE script_command")
+
+    def apply_recipe_changes(self):
+        """
+        Rebuilds the search documents of the recipes changed in the current transaction, and marks their grocery contributions
+        (and the grocery list, if they are planned) as stale. The row triggers only record which recipes changed, so a bulk write
+        that touches a recipe many times rebuilds it once.
+        Outside a transaction, applies the changes another writer committed without applying (e.g. the sqlite3 shell, or a resippy
+        that crashed), in a short write transaction of its own. Readers call this first, so they never see those recipes out of date.
+        """
+        if self.execute("SELECT 1 FROM recipe_changes LIMIT 1").fetchone() is None:
+            return
+        if self.in_transaction:
+            for statement in APPLY_RECIPE_CHANGES:
+                self.execute(statement)
+            return
+        self.begin_immediate()
+        try:
+            for statement in APPLY_RECIPE_CHANGES:
+                self.execute(statement)
+            super().commit()
+        except sqlite3.DatabaseError:
+            self.rollback()
+            raise
+
+    def commit(self):
+        if not self.defer_commits:
+            self.apply_recipe_changes()
+            super().commit()
+
+    def flush(self):
+        """Commits the current transaction, even while commits are deferred."""
+        self.apply_recipe_changes()
+        super().commit()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.defer_commits:
+                # The batch runner commits or rolls back each command itself
+                return False
+            if exc_type is None:
+                self.apply_recipe_changes()
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            if _profile is not None and getattr(self, 'write_started', None) is not None:
+                add_phase_time("database writes", time.perf_counter() - self.write_started)
+                self.write_started = None
+
+def open_database():
+    """
+    Opens the connection to the resippy database and brings its schema up to date, if that has not been done yet.
+    Sets the module-level connection and cursor used by every command.
 
-    cursor.execute('CREATE TABLE IF NOT EXISTS prepmethod (prepmethod_id INTEGER PRIMARY KEY, prepmethod_name TEXT UNIQUE)')
-    connection.commit()
+    Returns:
+        connection(sqlite3.Connection object): Connection to the resippy database.
+        cursor(sqlite3.Cursor object): Cursor for the resippy database.
+    """
+    global connection, cursor
+    if connection is None:
+        connection = sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT, factory=ResippyConnection)
+        if _profile is not None:
+            connection.set_trace_callback(trace_statement)
+        cursor = connection.cursor()
+        # Write-ahead logging lets roommates read while someone else writes. It is stored in the file, so this is a no-op after the first time.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        setup_database(cursor, connection)
+    return connection, cursor
+
+def prompt_user(question):
+    """
+    Asks the user a question with input(), without holding a write lock while waiting for the answer.
+    In a batch script or the shell, the work done so far is committed first, and the command carries on in a new transaction once the user has answered.
 
-    cursor.execute('CREATE TABLE IF NOT EXISTS recipe_ingredients (matching_id INTEGER PRIMARY KEY, recipe_id INTEGER, ingredient_id INTEGER, quantity DECIMAL, unit_id INTEGER, prepmethod_id INTEGER, FOREIGN KEY (recipe_id) REFERENCES menu(id), FOREIGN KEY (ingredient_id) REFERENCES ingredients(ingredient_id), FOREIGN KEY (unit_id) REFERENCES units(unit_id), FOREIGN KEY (prepmethod_id) REFERENCES prepmethod(prepmethod_id))')
-    connection.commit()
+    Args:
+        question (str): The question to print.
 
-    cursor.execute('CREATE TABLE IF NOT EXISTS instructions (instruction_id INTEGER PRIMARY KEY, recipe_id INTEGER, instruction TEXT, FOREIGN KEY (recipe_id) REFERENCES menu(id))')
-    connection.commit()
+    Returns:
+        str: The user's answer.
+    """
+    if connection is None or not connection.in_transaction:
+        return input(question)
+    connection.flush()
+    try:
+        return input(question)
+    finally:
+        if connection.defer_commits:
+            connection.begin_command()
 
-    cursor.execute('CREATE TABLE IF NOT EXISTS mealplan (day TEXT PRIMARY KEY, date DATE, recipe_id INTEGER, FOREIGN KEY (recipe_id) REFERENCES menu(id), CHECK (CAST(day AS INTEGER) <= 7))')
-    connection.commit()
+def database_state():
+    """
+    Returns a value that changes whenever the database changes, through this connection or any other.
+    Used to tell when in-memory indexes built from the database are out of date.
 
-    cursor.execute('''
-    INSERT OR IGNORE INTO mealplan (day) 
-    VALUES ('Monday'), ('Tuesday'), ('Wednesday'), ('Thursday'), ('Friday'), ('Saturday'), ('Sunday')
-    ''')
-    connection.commit()
+    Returns:
+        tuple: PRAGMA data_version (changes made by other connections) and this connection's total_changes.
+    """
+    cursor.execute("PRAGMA data_version")
+    return cursor.fetchone()[0], connection.total_changes
 
 # Menu Functions
 def new_recipe(args, **kwargs):
@@ -88,10 +483,10 @@ def new_recipe(args, **kwargs):
         query = "INSERT INTO menu ({0}) VALUES ({1})".format(columns, placeholders)
         # Add the new recipe to the database
         try:
-            cursor.execute(query, list(recipe_information.values()))
+            with connection:
+                cursor.execute(query, list(recipe_information.values()))
         except sqlite3.IntegrityError:
             return False, "{} is already in the homehold menu. If you would like to update this recipe, use --update_menu instead.".format(recipe_name)
-        connection.commit()
         return True, ''
     except KeyError:
         return False, 'Recipe name missing'
@@ -105,36 +500,160 @@ def view_menu(args, **kwargs):
     Prints out the menu onto the console for easy viewing.
 
     Args:
-        args(dict): Contains potential optional arguments --order, --limit, and/or --filter.
+        args(dict): Contains potential optional arguments --order, --limit, --filter, --page, --after, and/or --format.
     """
-    # Set Up Query
-    sql_query = "SELECT * FROM menu"
-    # Get Filter
-    if args['filter'] != None:
-        sql_query += " WHERE "
-        sql_query += args['filter']
-    if args['order'] != None:
-        sql_query += " ORDER BY "
-        sql_query += args['order']
-    if args['limit'] != None:
-        sql_query += " LIMIT "
-        sql_query += args['limit']
-
-    cursor.execute(sql_query)
-    menu = cursor.fetchall()
-
-    def safe_str(value):
-        return str(value) if value is not None else ''
-    
-    menu = [[safe_str(cell) for cell in row] for row in menu]
+    if args.get('page') != None or args.get('after') != None:
+        return view_menu_pages(args)
+    rows = query_menu(args)
+    headers = [description[0] for description in rows.description]
+    output = resolve_format(args.get('format'))
+    if output != "grid":
+        with profile_phase("rendering"):
+            write_rows(rows, headers, output)
+        return
+    menu = [[safe_str(cell) for cell in row] for row in rows]
     # Get Column Width
     console_width = shutil.get_terminal_size().columns
 
     # Print the headings
-    headers = [description[0] for description in cursor.description]
     num_columns = len(headers)
     max_col_width = (console_width - (num_columns+1)) // num_columns
-    print(tabulate(menu, headers=headers, tablefmt="grid", numalign='center', maxcolwidths=[max_col_width] * num_columns))
+    from tabulate import tabulate
+    with profile_phase("rendering"):
+        print(tabulate(menu, headers=headers, tablefmt="grid", numalign='center', maxcolwidths=[max_col_width] * num_columns))
+
+def query_menu(args, db=None):
+    """Runs the menu query for view_menu (and the HTTP API).
+
+    Args:
+        args(dict): Contains potential optional arguments --filter (a MenuFilter), --order, and/or --limit.
+        db (sqlite3.Cursor, optional): Cursor to read with. Defaults to the module-level cursor.
+
+    Returns:
+        sqlite3.Cursor: The executed query; iterate over it for the rows, and read the column names from its description.
+    """
+    db = db or cursor
+    sql_query = "SELECT * FROM menu"
+    parameters = []
+    if args.get('filter') != None:
+        sql_query += " WHERE " + args['filter'].sql
+        parameters += args['filter'].parameters
+    if args.get('order') != None:
+        sql_query += " ORDER BY " + args['order']
+    if args.get('limit') != None:
+        sql_query += " LIMIT ?"
+        parameters.append(int(args['limit']))
+    return db.execute(sql_query, parameters)
+
+def view_menu_pages(args, **kwargs):
+    """
+    Prints the menu one page at a time, using keyset pagination on the --order columns (with id as a tiebreaker).
+    Only one page is held in memory, and each page is printed as soon as it is fetched.
+    On an interactive terminal, asks before fetching the next page; otherwise prints one page and the --after value for the next one.
+    With a --format other than grid, the page is written in that format and the --after value goes to stderr.
+
+    Args:
+        args(dict): Contains --page (rows per page) and/or --after (id of the last recipe on the previous page), plus potential optional arguments --order, --limit, --filter, and/or --format.
+
+    Raises:
+        argparse.ArgumentTypeError if the --after recipe is not in the menu.
+    """
+    from tabulate import tabulate
+    page_size = int(args['page']) if args.get('page') != None else MENU_PAGE_SIZE
+    remaining = int(args['limit']) if args.get('limit') != None else None
+    # Order columns, with id last so every row has a unique position
+    order_columns = [(part.split()[0], part.split()[1].upper()) for part in args['order'].split(",")] if args.get('order') != None else []
+    if 'id' not in [column for column, _ in order_columns]:
+        order_columns.append(('id', 'ASC'))
+    order_query = ", ".join("{c} {d}".format(c=column, d=direction) for column, direction in order_columns)
+    order_select = ", ".join(column for column, _ in order_columns)
+    # Find where the previous page stopped
+    last_values = None
+    if args.get('after') != None:
+        cursor.execute("SELECT {c} FROM menu WHERE id=?".format(c=order_select), (int(args['after']),))
+        last_values = cursor.fetchone()
+        if last_values is None:
+            raise argparse.ArgumentTypeError("Error: There is no recipe with the id {} in the menu.".format(args['after']))
+    output = resolve_format(args.get('format'))
+    interactive = sys.stdin.isatty() and sys.stdout.isatty() and output == "grid"
+    console_width = shutil.get_terminal_size().columns
+    while remaining is None or remaining > 0:
+        conditions = []
+        parameters = []
+        if args.get('filter') != None:
+            conditions.append("(" + args['filter'].sql + ")")
+            parameters += args['filter'].parameters
+        if last_values is not None:
+            keyset_query, keyset_parameters = keyset_condition(order_columns, last_values)
+            conditions.append(keyset_query)
+            parameters += keyset_parameters
+        sql_query = "SELECT * FROM menu"
+        if conditions:
+            sql_query += " WHERE " + " AND ".join(conditions)
+        sql_query += " ORDER BY " + order_query + " LIMIT ?"
+        fetch = page_size if remaining is None else min(page_size, remaining)
+        # Fetch one row past the page, to know whether another page follows
+        cursor.execute(sql_query, parameters + [fetch + 1])
+        page = cursor.fetchall()
+        more = len(page) > fetch
+        page = page[:fetch]
+        headers = [description[0] for description in cursor.description]
+        if output != "grid":
+            with profile_phase("rendering"):
+                write_rows(page, headers, output)
+        elif len(page) == 0:
+            if last_values is None:
+                print("No recipes in the menu match.")
+        else:
+            num_columns = len(headers)
+            max_col_width = (console_width - (num_columns+1)) // num_columns
+            with profile_phase("rendering"):
+                print(tabulate([[safe_str(cell) for cell in row] for row in page], headers=headers, tablefmt="grid", numalign='center', maxcolwidths=[max_col_width] * num_columns))
+        if len(page) == 0:
+            break
+        if remaining is not None:
+            remaining -= len(page)
+        if not more or remaining == 0:
+            break
+        last_row = dict(zip(headers, page[-1]))
+        last_values = tuple(last_row[column] for column, _ in order_columns)
+        if not interactive:
+            print("More recipes follow. Add --after {} to see the next page.".format(last_row['id']), file=sys.stdout if output == "grid" else sys.stderr)
+            break
+        if prompt_user("Press Enter for the next page, or q to stop. ").strip().lower().startswith("q"):
+            break
+
+def keyset_condition(order_columns, last_values):
+    """
+    Builds the WHERE condition selecting the rows that come after a given row in an ORDER BY, for keyset pagination.
+    NULLs are treated the way SQLite sorts them (first for ASC, last for DESC).
+
+    Args:
+        order_columns (list): (column, "ASC" or "DESC") tuples, ending with a unique column.
+        last_values (tuple): Values of the order columns for the last row already shown.
+
+    Returns:
+        The condition as an SQL string, and the list of values to bind to it.
+    """
+    alternatives = []
+    parameters = []
+    for position, (column, direction) in enumerate(order_columns):
+        value = last_values[position]
+        # Rows that tie on every earlier column...
+        tie_query = ["{c} IS ?".format(c=earlier) for earlier, _ in order_columns[:position]]
+        tie_parameters = list(last_values[:position])
+        # ...and come strictly after the last row on this one
+        if direction == "ASC":
+            after_query = "{c} IS NOT NULL".format(c=column) if value is None else "{c} > ?".format(c=column)
+        else:
+            if value is None:
+                continue
+            after_query = "({c} < ? OR {c} IS NULL)".format(c=column)
+        alternatives.append("(" + " AND ".join(tie_query + [after_query]) + ")")
+        parameters += tie_parameters + ([] if value is None else [value])
+    if len(alternatives) == 0:
+        return "0", []
+    return "(" + " OR ".join(alternatives) + ")", parameters
 
 def update_menu(args, **kwargs):
     """Updates an entry in the menu.
@@ -157,7 +676,7 @@ def update_menu(args, **kwargs):
         if len(recipe_id) == 1:
             recipe_id = recipe_id[0][0]
         else:
-            return False, "{} was not found in the menu. If you would like to add it, please use --new.".format(recipe_name)
+            return False, "{r} was not found in the menu.{s} If you would like to add it, please use --new.".format(r=recipe_name, s=did_you_mean(recipe_name))
         # Find new updates from args
         potential_arguments = ["dish_type", "cuisine", "drumlin_rating", "lina_rating", "ian_rating", "last_made"]
         updates = {k:v for k, v in args.items() if v is not None and k in potential_arguments}
@@ -167,27 +686,17 @@ def update_menu(args, **kwargs):
             valid, e, updates['last_made'] = check_date(updates['last_made'])
             if not valid:
                 return valid, e
-            else:
-                updates['last_made'] = '"{update}"'.format(update=updates['last_made'])
-        updates_query = ""
-        if "cuisine" in updates:
-            updates["cuisine"] = '"{cuisine}"'.format(cuisine=updates['cuisine'])
-        if "dish_type" in updates:
-            updates["dish_type"] = '"{dish_type}"'.format(dish_type=updates['dish_type'])
-        for update in updates.keys():
-            updates_query += "{column}={new_value},".format(column=update, new_value=updates[update])
-        updates_query = updates_query[:-1]
-        condition_query = "id={recipe_id}".format(recipe_id=recipe_id)
-        query = "UPDATE menu SET {updates} WHERE {condition}".format(updates=updates_query, condition=condition_query)
+        updates_query = ", ".join("{column}=?".format(column=update) for update in updates.keys())
+        query = "UPDATE menu SET {updates} WHERE id=?".format(updates=updates_query)
     # Add the new recipe to the database
-        cursor.execute(query)
-        connection.commit()
+        with connection:
+            cursor.execute(query, list(updates.values()) + [recipe_id])
         return True, ''
     except sqlite3.DatabaseError:
         return False, 'The database "resippy" was not found.'
 
 def delete_recipe(args, **kwargs):
-    """Deletes a recipe from the menu.
+    """Deletes a recipe from the menu, along with its ingredients and instructions.
 
     Args:
         args (dict): Contains required argument --del_recipe and potential optional arguments --drumlin_rating, --lina_rating, --ian_rating, and --last_made.
@@ -203,12 +712,15 @@ def delete_recipe(args, **kwargs):
         recipe_id = recipe_id[0][0]
         id_query = "id=" + str(recipe_id)
     elif len(recipe_id) == 0:
-        return False, "{} was not found in the menu. Please try again.".format(args['del_recipe'])
+        return False, "{r} was not found in the menu.{s} Please try again.".format(r=args['del_recipe'], s=did_you_mean(args['del_recipe']))
    
-    # Delete Query
-    query = "DELETE FROM menu WHERE {id}".format(id=id_query)
-    cursor.execute(query)
-    connection.commit()
+    # Delete the recipe along with its ingredients and instructions, and take it off the meal plan
+    with connection:
+        cursor.execute("DELETE FROM recipe_ingredients WHERE recipe_id=?", (recipe_id,))
+        cursor.execute("DELETE FROM instructions WHERE recipe_id=?", (recipe_id,))
+        cursor.execute("UPDATE mealplan SET recipe_id=NULL, date=NULL WHERE recipe_id=?", (recipe_id,))
+        query = "DELETE FROM menu WHERE {id}".format(id=id_query)
+        cursor.execute(query)
     return True, ''
 
 def add_ingredients(args, recipe_id, **kwargs):
@@ -236,148 +748,160 @@ def add_ingredients(args, recipe_id, **kwargs):
         raise argparse.ArgumentTypeError("The proper arguments were not passed to --addingredients.")
     except AssertionError:
         raise argparse.ArgumentTypeError("Either the recipe name or the path to the .csv is missing. Please try again.\nPassed Arguments: {args}".format(args=args['addingredients']))
+    # Parse & validate the whole .csv before touching the database
+    valid, error, ingredient_rows = parse_ingredients_file(path)
+    if not valid:
+        return False, error
+    ingredient_rows = canonicalize_ingredient_rows([ingredient_rows], args.get('canonicalize'))[0]
+    # Look up the aisles for new ingredients before any write lock is taken
+    aisles = resolve_new_ingredients({row[0] for row in ingredient_rows})
     # Check that the recipe is not already in the database
-    check_existing_query = "SELECT * FROM recipe_ingredients WHERE recipe_id=?"
+    replace = False
+    check_existing_query = "SELECT 1 FROM recipe_ingredients WHERE recipe_id=? LIMIT 1"
     cursor.execute(check_existing_query, (recipe_id,))
-    if len(cursor.fetchall()) > 0:
-        readd = input("Ingredients for {r} are already in the database. Would you like to replace them? [Y/N] ".format(r=args['addingredients'][0]))
+    if cursor.fetchone() is not None:
+        readd = prompt_user("Ingredients for {r} are already in the database. Would you like to replace them? [Y/N] ".format(r=args['addingredients'][0]))
         if readd.upper() == "Y":
-            remove_recipe_query = "DELETE FROM recipe_ingredients WHERE recipe_id=?"
-            cursor.execute(remove_recipe_query, (recipe_id,))
-            connection.commit()
+            replace = True
         else:
             return False, "Ingredients for {} are already in the database. They have not been altered.".format(args['addingredients'][0])
-    # Open the .csv
+    # Write everything in a single transaction
     try:
-        with open(path, newline='') as csvfile:
-            recipe = csv.reader(csvfile)
-            headers = next(recipe)
-            for ingredient in recipe:
-                ing_id = None
-                prep_id = None
-                unit_id = None
-                ingredient_information = {'recipe_id': recipe_id}
-                # Get ingredient id
-                if ingredient[0] != "":
-                    ing_query = "SELECT ingredient_id FROM ingredients WHERE ingredient_name=?"
-                    while ing_id == None:
-                        try:
-                            cursor.execute(ing_query, (ingredient[0].lower().title(),))
-                            ingredient_information["ingredient_id"] = cursor.fetchall()[0][0]
-                            ing_id = True
-                        except IndexError:
-                            # Ingredient does not exist in table: create it
-                            # Find grocery location
-                            aisle = find_grocery_location(ingredient[0].lower())
-                            ing_make_query = "INSERT INTO ingredients (ingredient_name, grocery_location) VALUES (?,?)"
-                            cursor.execute(ing_make_query, (ingredient[0].lower().title(),aisle))
-                            connection.commit()
-                else:
-                    return False, "One or more of the ingredients is missing a name. Please check the .csv file and then try again."
-                # Ensure quantity is an integer
-                try:
-                    ingredient_information["quantity"] = float(ingredient[1])
-                except ValueError:
-                    return False, "One or more of the ingredients has a non-numerical quantity. Please check the .csv file and then try again."
-                # Get unit ID
-                if ingredient[2] != "":
-                    unit_query = "SELECT unit_id FROM units WHERE unit_name=?"
-                    while unit_id == None:
-                        try:
-                            cursor.execute(unit_query, (ingredient[2].lower().title(),))
-                            ingredient_information["unit_id"] = cursor.fetchall()[0][0]
-                            unit_id = True
-                        except IndexError:
-                            # Unit does not exist in table: create it
-                            unit_make_query = "INSERT INTO units (unit_name) VALUES (?)"
-                            cursor.execute(unit_make_query, (ingredient[2].lower().title(),))
-                            connection.commit()
-                # Get prepmethod ID
-                if ingredient[3] != "":
-                    prep_query = "SELECT prepmethod_id FROM prepmethod WHERE prepmethod_name=?"
-                    while prep_id == None:
-                        try:
-                            cursor.execute(prep_query, (ingredient[3].lower().title(),))
-                            ingredient_information['prepmethod_id'] = cursor.fetchall()[0][0]
-                            prep_id = True
-                        except IndexError:
-                            prep_make_query = "INSERT INTO prepmethod (prepmethod_name) VALUES (?)"
-                            cursor.execute(prep_make_query, (ingredient[3].lower().title(),))
-                            connection.commit()
-                # Make a line in the recipe_ingredients table
-                columns = ", ".join(ingredient_information.keys())
-                placeholders = ", ".join(['?'] * len(ingredient_information))
-                rec_ing_query = "INSERT INTO recipe_ingredients ({c}) VALUES ({v})".format(c=columns, v=placeholders)
-                cursor.execute(rec_ing_query, list(ingredient_information.values()))
-                connection.commit()
-    except FileNotFoundError:
-        return False, "Error: The file containing the recipe was not found. Please enter the path to the csv file containing the recipe."
-    except csv.Error:
-        return False, "Error: The file containing the recipe could not be read. Please fix the file and try again."
+        with connection:
+            if replace:
+                cursor.execute("DELETE FROM recipe_ingredients WHERE recipe_id=?", (recipe_id,))
+            ingest_ingredients({recipe_id: ingredient_rows}, aisles)
+    except sqlite3.DatabaseError as e:
+        return False, "The ingredients could not be added to the database, so none of them were saved. ({})".format(e)
     return True, ""
 
+def load_recipes(recipe_ids, db=None):
+    """Loads the ingredients and instructions for one or more recipes.
+    Uses one query per table (ingredients with their unit, name, and prepmethod resolved by LEFT JOINs, then instructions), no matter how many recipes are requested.
+
+    Args:
+        recipe_ids (iterable): ID numbers of the recipes to load.
+        db (sqlite3.Cursor, optional): Cursor to read with. Defaults to the module-level cursor.
+
+    Returns:
+        dict: Maps each recipe ID to a dictionary with the keys "ingredients" (list of (quantity, unit, ingredient, prepmethod) tuples) and "instructions" (list of strings), both in the order they were added.
+    """
+    db = db or cursor
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    recipes = {recipe_id: {"ingredients": [], "instructions": []} for recipe_id in recipe_ids}
+    ingredients_query = """
+    SELECT ri.recipe_id, ri.quantity, u.unit_name, i.ingredient_name, p.prepmethod_name
+    FROM recipe_ingredients ri
+    LEFT JOIN units u ON u.unit_id = ri.unit_id
+    LEFT JOIN ingredients i ON i.ingredient_id = ri.ingredient_id
+    LEFT JOIN prepmethod p ON p.prepmethod_id = ri.prepmethod_id
+    WHERE ri.recipe_id IN ({p})
+    ORDER BY ri.recipe_id, ri.matching_id
+    """
+    instructions_query = "SELECT recipe_id, instruction FROM instructions WHERE recipe_id IN ({p}) ORDER BY recipe_id, instruction_id"
+    # Stay well under SQLite's bound-variable limit
+    for start in range(0, len(recipe_ids), 500):
+        chunk = recipe_ids[start:start + 500]
+        placeholders = ", ".join(['?'] * len(chunk))
+        for recipe_id, quantity, unit_name, ingredient_name, prepmethod_name in db.execute(ingredients_query.format(p=placeholders), chunk):
+            recipes[recipe_id]["ingredients"].append((quantity, unit_name, ingredient_name, prepmethod_name))
+        for recipe_id, instruction in db.execute(instructions_query.format(p=placeholders), chunk):
+            recipes[recipe_id]["instructions"].append(instruction)
+    return recipes
+
+def format_ingredient(quantity, unit_name, ingredient_name, prepmethod_name):
+    """Formats one ingredient line of a recipe, e.g. "    • 2 Cups Flour, Sifted".
+
+    Returns:
+        str: The formatted ingredient.
+    """
+    formatted_ingredient = "    • " + str(quantity) + " "
+    if unit_name != None:
+        formatted_ingredient += unit_name + " "
+    formatted_ingredient += safe_str(ingredient_name)
+    if prepmethod_name != None:
+        formatted_ingredient += ", " + prepmethod_name
+    return formatted_ingredient
+
+def load_recipe_batches(to_print):
+    """Loads recipes PRINT_BATCH_SIZE at a time, as they are needed.
+
+    Args:
+        to_print (iterable): (recipe ID, name) pairs, e.g. a cursor.
+
+    Returns:
+        generator: (name, recipe) pairs in the order given, where recipe is as returned by load_recipes.
+    """
+    to_print = iter(to_print)
+    while True:
+        batch = list(islice(to_print, PRINT_BATCH_SIZE))
+        if len(batch) == 0:
+            return
+        recipes = load_recipes(recipe_id for recipe_id, _ in batch)
+        for recipe_id, name in batch:
+            yield name, recipes[recipe_id]
+
 def print_recipe(args, **kwargs):
-    """Prints the recipe onto the console. For now, only prints ingredients.
+    """Prints one or more recipes onto the console, loading them PRINT_BATCH_SIZE at a time as they are printed.
 
     Args:
-        args (dict): Contains --printrecipe, which contains the recipe name.
+        args (dict): Contains --printrecipe, which contains the recipe names. If no names are given, every recipe matching --filter is printed.
+            With --format csv or tsv, each ingredient and instruction is one row; with json or jsonl, each recipe is one object.
+    
+    Raises:
+        argparse.ArgumentTypeError if a named recipe is not in the menu or has no ingredients, or if neither names nor a filter were given.
     """
-    # Check that the recipe exists in the menu
-    sql_query = "SELECT id FROM menu WHERE name=?"
-    cursor.execute(sql_query, (args['printrecipe'].lower().title(),))
-    try:
-        id = cursor.fetchall()[0][0]
-    except IndexError:
-        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu. Please use --new to add it to the menu before adding its ingredients.".format(r=args['printrecipe']))
-    # Collect ingredients
-    find_ingredients_query = "SELECT * FROM recipe_ingredients WHERE recipe_id=?"
-    cursor.execute(find_ingredients_query, (id,))
-    ingredients = cursor.fetchall()
-    if len(ingredients) > 0:
-        ingredients_print_list = []
-        for ingredient in ingredients:
-            formatted_ingredient = "    • "
-            # Add quantity
-            formatted_ingredient += str(ingredient[3]) + " "
-            # Add units, if applicable
-            if ingredient[4] != None:
-                find_unit_name_query = "SELECT unit_name FROM units WHERE unit_id=?"
-                cursor.execute(find_unit_name_query, (ingredient[4],))
-                unit_name = cursor.fetchall()[0][0]
-                formatted_ingredient += unit_name + " "
-            # Add ingredient name
-            find_ing_name_query = "SELECT ingredient_name FROM ingredients WHERE ingredient_id=?"
-            cursor.execute(find_ing_name_query, (ingredient[2],))
-            ing_name = cursor.fetchall()[0][0]
-            formatted_ingredient += ing_name
-            # Add ingredient prepmethod, if applicable
-            if ingredient[5] != None:
-                find_prep_name_query = "SELECT prepmethod_name FROM prepmethod WHERE prepmethod_id=?"
-                cursor.execute(find_prep_name_query, (ingredient[5],))
-                prep_name = cursor.fetchall()[0][0]
-                formatted_ingredient += ", " + prep_name
-            # Add to list
-            ingredients_print_list.append(formatted_ingredient)
+    names = args['printrecipe'] or []
+    if len(names) > 0:
+        # Check that the recipes exist in the menu
+        title_names = [name.lower().title() for name in names]
+        cursor.execute("SELECT name, id FROM menu WHERE name IN ({p})".format(p=", ".join(['?'] * len(title_names))), title_names)
+        ids = dict(cursor.fetchall())
+        for name, title_name in zip(names, title_names):
+            if title_name not in ids:
+                raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu.{s} Please use --new to add it to the menu before adding its ingredients.".format(r=name, s=did_you_mean(name)))
+        # Every named recipe must have ingredients, which is checked before anything is printed
+        cursor.execute("SELECT id FROM menu m WHERE id IN ({p}) AND NOT EXISTS (SELECT 1 FROM recipe_ingredients ri WHERE ri.recipe_id = m.id)".format(
+            p=", ".join(['?'] * len(ids))), list(ids.values()))
+        empty = {row[0] for row in cursor.fetchall()}
+        for name, title_name in zip(names, title_names):
+            if ids[title_name] in empty:
+                raise argparse.ArgumentTypeError("The recipe for {} has not been added to the database. Please do so before trying again.".format(name))
+        to_print = [(ids[title_name], name) for name, title_name in zip(names, title_names)]
+    elif args.get('filter') != None:
+        # Read on a cursor of its own, since load_recipes uses the module-level one while these rows are still being read
+        to_print = connection.cursor()
+        to_print.execute("SELECT id, name FROM menu WHERE (" + args['filter'].sql + ") AND EXISTS (SELECT 1 FROM recipe_ingredients ri WHERE ri.recipe_id = menu.id) ORDER BY name",
+                         args['filter'].parameters)
     else:
-        raise argparse.ArgumentTypeError("The recipe for {} has not been added to the database. Please do so before trying again.".format(args['printrecipe']))
-    # Collect instructions 
-    find_instructions_query = "SELECT * FROM instructions WHERE recipe_id=?"
-    cursor.execute(find_instructions_query, (id,))
-    instructions = cursor.fetchall()
-    instruction_list = []
-    if len(instructions) > 0:
-        for instruction in instructions:
-            formatted_instruction = str(instruction[2])
-            instruction_list.append(formatted_instruction)
-    # Print off recipe
-    print("RECIPE: {r}".format(r=args['printrecipe']))
-    print("INGREDIENTS:")
-    for ing in ingredients_print_list:
-        print(ing)
-    if len(instruction_list) > 0:
-        print("INSTRUCTIONS:")
-        for instruction in instruction_list:
-            print(instruction)
+        raise argparse.ArgumentTypeError("Please include the names of the recipes to print, or a --filter to select them.")
+    recipes = load_recipe_batches(to_print)
+    output = resolve_format(args.get('format'))
+    if output in ("csv", "tsv"):
+        rows = chain.from_iterable(chain(((name, quantity, unit, ingredient, prepmethod, None) for quantity, unit, ingredient, prepmethod in recipe["ingredients"]),
+                                         ((name, None, None, None, None, instruction) for instruction in recipe["instructions"]))
+                                   for name, recipe in recipes)
+        write_rows(rows, ["name", "quantity", "unit", "ingredient", "prepmethod", "instruction"], output)
+        return
+    if output in ("json", "jsonl"):
+        rows = ((name, [{"quantity": quantity, "unit": unit, "ingredient": ingredient, "prepmethod": prepmethod} for quantity, unit, ingredient, prepmethod in recipe["ingredients"]], recipe["instructions"])
+                for name, recipe in recipes)
+        write_rows(rows, ["name", "ingredients", "instructions"], output)
+        return
+    printed = False
+    for name, recipe in recipes:
+        if printed:
+            print()
+        # Print off recipe
+        print("RECIPE: {r}".format(r=name))
+        print("INGREDIENTS:")
+        for ingredient in recipe["ingredients"]:
+            print(format_ingredient(*ingredient))
+        if len(recipe["instructions"]) > 0:
+            print("INSTRUCTIONS:")
+            for instruction in recipe["instructions"]:
+                print(instruction)
+        printed = True
     
 def add_instructions(args, recipe_id, **kwargs):
     """
@@ -401,34 +925,28 @@ def add_instructions(args, recipe_id, **kwargs):
         raise argparse.ArgumentTypeError("The proper arguments were not passed to --addinstructions.")
     except AssertionError:
         raise argparse.ArgumentTypeError("Either the recipe name or the path to the .txt is missing. Please try again.\nPassed Arguments: {args}".format(args=args['addinstructions']))
+    # Read the whole .txt before touching the database
+    valid, error, instructions = parse_instructions_file(path)
+    if not valid:
+        return False, error
     # Check that the recipe is not already in the database
-    check_existing_query = "SELECT * FROM instructions WHERE recipe_id=?"
+    replace = False
+    check_existing_query = "SELECT 1 FROM instructions WHERE recipe_id=? LIMIT 1"
     cursor.execute(check_existing_query, (recipe_id,))
-    if len(cursor.fetchall()) > 0:
-        readd = input("Instructions for {r} are already in the database. Would you like to replace them? [Y/N] ".format(r=args['addinstructions'][0]))
+    if cursor.fetchone() is not None:
+        readd = prompt_user("Instructions for {r} are already in the database. Would you like to replace them? [Y/N] ".format(r=args['addinstructions'][0]))
         if readd.upper() == "Y":
-            remove_recipe_query = "DELETE FROM instructions WHERE recipe_id=?"
-            cursor.execute(remove_recipe_query, (recipe_id,))
-            connection.commit()
+            replace = True
         else:
             return False, "The instructions for {} are already in the database. They have not been altered.".format(args['addinstructions'][0])
-    # read recipe into table
+    # Write every line in a single transaction
     try:
-        complete = False
-        with open(path) as instruction_list:
-            while not complete:
-                values = [recipe_id]
-                instruction = instruction_list.readline()
-                if instruction != "":
-                    instruction = instruction.strip("\n")
-                    values.append(instruction)
-                    instruction_query = 'INSERT INTO instructions (recipe_id, instruction) VALUES (?, ?)'
-                    cursor.execute(instruction_query, values)
-                    connection.commit()
-                else: 
-                    complete = True
-    except FileNotFoundError:
-        return False, "Error: The file containing the instructions was not found. Please enter the path to the .txt file containing the instructions."
+        with connection:
+            if replace:
+                cursor.execute("DELETE FROM instructions WHERE recipe_id=?", (recipe_id,))
+            ingest_instructions({recipe_id: instructions})
+    except sqlite3.DatabaseError as e:
+        return False, "The instructions could not be added to the database, so none of them were saved. ({})".format(e)
     return True, ""
 
 def add_mealplan(weekday, recipe_id, **kwargs):
@@ -491,7 +1009,7 @@ def add_mealplan(weekday, recipe_id, **kwargs):
             if existing_date >= current_day:
                 choice_correct = False
                 while not choice_correct:
-                    choice = input("The mealplan already contains the recipe {r} for {wd}, {m} {d}. Would you like to replace it? [Y/N] ".format(r=existing_recipe_name, wd=weekday, m=existing_month, d=existing_day))
+                    choice = prompt_user("The mealplan already contains the recipe {r} for {wd}, {m} {d}. Would you like to replace it? [Y/N] ".format(r=existing_recipe_name, wd=weekday, m=existing_month, d=existing_day))
                     if choice.lower()[0] == "n":
                         return False, "The mealplan has not been updated."
                     elif choice.lower()[0] == "y":
@@ -516,44 +1034,200 @@ def add_mealplan(weekday, recipe_id, **kwargs):
     mealplan_input_values = [formatted_date, recipe_id, weekday]
 
     # Input into mealplan
-    cursor.execute("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", mealplan_input_values)
-    connection.commit()
+    with connection:
+        cursor.execute("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", mealplan_input_values)
     return True, ""
 
-def print_mealplan(**kwargs):
-    """Prints the meal plan to the console.
+def plan_score(plan):
+    """Scores a week plan for generate_week_plan: recipe scores, plus ingredient reuse, minus repeated cuisines and dish types.
+
+    Args:
+        plan (list): Candidate tuples (see generate_week_plan).
 
     Returns:
-        _type_: _description_
+        float: The score (higher is better).
     """
-    
-    sql_query = "SELECT * FROM mealplan"
-    cursor.execute(sql_query)
-    mealplan = cursor.fetchall()
-    mealplan_with_recipes = []
-    # Get Recipes
-    for day in mealplan:
-        recipe_id = day[2]
-        if recipe_id != None:
-            cursor.execute("SELECT name FROM menu WHERE id=?", (recipe_id,))
-            recipe_name = cursor.fetchall()
-            recipe_name = str(recipe_name[0][0])
-            day_mealplan = [day[0], safe_str(day[1]), recipe_name]
-            mealplan_with_recipes.append(day_mealplan)
-        elif day[1] != None:
-            # Since we're here ,we might as well fix the mealplan and remove the date if a recipe is not attached to it
-            cursor.execute("UPDATE mealplan SET date=NULL WHERE day=?", (day[0],))
-            connection.commit()
-            # If there's no recipe, don't print it in the mealplan.
+    score = sum(candidate[2] for candidate in plan)
+    used = set()
+    total = 0
+    for candidate in plan:
+        used |= candidate[5]
+        total += len(candidate[5])
+    # Every ingredient shared between meals is one less line on the grocery list
+    score += PLAN_OVERLAP_WEIGHT * (total - len(used))
+    for position in (3, 4):
+        counts = Counter(candidate[position] for candidate in plan if candidate[position])
+        score -= PLAN_DIVERSITY_PENALTY * sum(count - 1 for count in counts.values())
+    return score
+
+def plan_is_diverse(plan):
+    """Checks that no cuisine or dish type appears more than PLAN_MAX_REPEATS times in a plan."""
+    for position in (3, 4):
+        counts = Counter(candidate[position] for candidate in plan if candidate[position])
+        if counts and max(counts.values()) > PLAN_MAX_REPEATS:
+            return False
+    return True
+
+def generate_week_plan(candidates, days=7, time_budget=0.8):
+    """Picks distinct recipes for a week with a greedy pass followed by local search.
+    The greedy pass adds the recipe with the best marginal score (computed incrementally) each day; the local search then swaps
+    meals for better-scoring candidates until no swap helps or the time budget runs out.
+
+    Args:
+        candidates (list): (recipe ID, name, base score, cuisine, dish type, frozenset of ingredient IDs) tuples, already filtered by the hard constraints.
+        days (int): Number of meals to plan.
+        time_budget (float): Seconds to spend on the local search.
+
+    Returns:
+        list: The chosen candidate tuples (fewer than days if there are not enough candidates).
+    """
+    deadline = time.perf_counter() + time_budget
+    plan = []
+    used = set()
+    cuisines = Counter()
+    dish_types = Counter()
+    chosen = set()
+    # Greedy: best marginal gain, respecting the repeat limits
+    for _ in range(min(days, len(candidates))):
+        best = None
+        best_gain = None
+        for candidate in candidates:
+            if candidate[0] in chosen:
+                continue
+            cuisine, dish_type = candidate[3], candidate[4]
+            if (cuisine and cuisines[cuisine] >= PLAN_MAX_REPEATS) or (dish_type and dish_types[dish_type] >= PLAN_MAX_REPEATS):
+                continue
+            gain = candidate[2] + PLAN_OVERLAP_WEIGHT * len(candidate[5] & used)
+            if cuisine and cuisines[cuisine]:
+                gain -= PLAN_DIVERSITY_PENALTY
+            if dish_type and dish_types[dish_type]:
+                gain -= PLAN_DIVERSITY_PENALTY
+            if best_gain is None or gain > best_gain:
+                best, best_gain = candidate, gain
+        if best is None:
+            break
+        plan.append(best)
+        chosen.add(best[0])
+        used |= best[5]
+        if best[3]:
+            cuisines[best[3]] += 1
+        if best[4]:
+            dish_types[best[4]] += 1
+    # Local search over the most promising candidates: the best by score, and those sharing the most ingredients with the plan
+    pool = heapq.nlargest(PLAN_POOL_SIZE, candidates, key=lambda candidate: candidate[2] + PLAN_OVERLAP_WEIGHT * len(candidate[5] & used))
+    best_score = plan_score(plan)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for slot in range(len(plan)):
+            for candidate in pool:
+                if candidate[0] in chosen:
+                    continue
+                trial = plan[:slot] + [candidate] + plan[slot + 1:]
+                trial_score = plan_score(trial)
+                if trial_score > best_score + 1e-9 and plan_is_diverse(trial):
+                    chosen.discard(plan[slot][0])
+                    chosen.add(candidate[0])
+                    plan, best_score, improved = trial, trial_score, True
+            if time.perf_counter() >= deadline:
+                break
+    return plan
+
+def plan_week(args, **kwargs):
+    """Fills all seven days of the meal plan automatically.
+    Recipes are never repeated, must meet each roommate's --min-rating if that roommate rated them, and must not have been made in the last --skip-recent days.
+    Among those, the plan favours well-rated recipes, different cuisines and dish types, and recipes that share ingredients (a shorter grocery list).
+
+    Args:
+        args (dict): Contains --plan-week and potential optional arguments --min-rating, --skip-recent, --filter, and --seed.
+
+    Returns:
+        True and an empty string if the meal plan was filled.
+        False and an error string if there are no suitable recipes or the user chose not to replace the current plan.
+    """
+    generator = random.Random(args.get('seed'))
+    today = date.today()
+    # A bare rating applies to every roommate; NAME=RATING overrides it for one roommate
+    min_ratings = {}
+    for column, rating in args.get('min_rating') or []:
+        for rated_column in ([column] if column else RATING_COLUMNS):
+            if column or rated_column not in min_ratings:
+                min_ratings[rated_column] = rating
+    skip_recent = args.get('skip_recent') if args.get('skip_recent') != None else PLAN_SKIP_RECENT_DAYS
+    recent_cutoff = (today - timedelta(days=skip_recent)).strftime('%Y-%m-%d')
+    # Precompute the feature vector of every eligible recipe
+    index = build_pantry_index()
+    sql_query = "SELECT id, name, cuisine, dish_type, drumlin_rating, ian_rating, lina_rating, last_made FROM menu WHERE (last_made IS NULL OR last_made <= ?)"
+    parameters = [recent_cutoff]
+    for column, rating in min_ratings.items():
+        sql_query += " AND ({c} IS NULL OR {c} >= ?)".format(c=column)
+        parameters.append(rating)
+    if args.get('filter') != None:
+        sql_query += " AND (" + args['filter'].sql + ")"
+        parameters += list(args['filter'].parameters)
+    candidates = []
+    for recipe_id, name, cuisine, dish_type, drumlin, ian, lina, last_made in cursor.execute(sql_query, parameters):
+        rated = [float(rating) for rating in (drumlin, ian, lina) if rating is not None]
+        base = (sum(rated) / len(rated) if rated else 3.0) / 5.0 + PLAN_JITTER * generator.random()
+        candidates.append((recipe_id, name, base, (cuisine or '').strip().lower(), (dish_type or '').strip().lower(), frozenset(index.recipe_ingredients.get(recipe_id, ()))))
+    if len(candidates) == 0:
+        return False, "No recipes in the menu meet the constraints. Try a lower --min-rating or --skip-recent."
+    plan = generate_week_plan(candidates)
+    # Assign the meals to the next seven days, in order, starting tomorrow
+    weekday_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    days = [today + timedelta(days=offset) for offset in range(1, 8)]
+    assignments = [(day.strftime('%Y-%m-%d'), candidate[0], weekday_names[day.weekday()], candidate[1]) for day, candidate in zip(days, plan)]
+    # Ask before replacing upcoming meals (before any write, so no lock is held while waiting)
+    cursor.execute("SELECT COUNT(*) FROM mealplan WHERE recipe_id IS NOT NULL AND date >= ?", (today.strftime('%Y-%m-%d'),))
+    if cursor.fetchone()[0] > 0:
+        choice = prompt_user("The meal plan already has upcoming meals. Would you like to replace the whole week? [Y/N] ")
+        if not choice.strip().lower().startswith("y"):
+            return False, "The mealplan has not been updated."
+    with connection:
+        cursor.execute("UPDATE mealplan SET date=NULL, recipe_id=NULL")
+        cursor.executemany("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", [assignment[:3] for assignment in assignments])
+    for formatted_date, recipe_id, weekday, name in assignments:
+        print("{w} ({d}): {r}".format(w=weekday, d=formatted_date, r=name))
+    if len(plan) < 7:
+        print("Only {n} recipes meet the constraints, so {m} days were left empty.".format(n=len(plan), m=7 - len(plan)))
+    return True, ""
+
+def query_mealplan(db=None):
+    """Reads the days of the meal plan that have a recipe, in date order.
+
+    Args:
+        db (sqlite3.Cursor, optional): Cursor to read with. Defaults to the module-level cursor.
+
+    Returns:
+        sqlite3.Cursor: (weekday, date, recipe name) rows.
+    """
+    db = db or cursor
+    return db.execute("SELECT m.day, m.date, r.name FROM mealplan m JOIN menu r ON r.id = m.recipe_id ORDER BY m.date")
+
+def print_mealplan(output=None, **kwargs):
+    """Prints the meal plan to the console.
+
+    Args:
+        output (str, optional): The --format to print in. Defaults to resolve_format(None).
+    """
+    # Since we're here, we might as well fix the mealplan and remove the date of days that have no recipe attached
+    cursor.execute("SELECT day FROM mealplan WHERE recipe_id IS NULL AND date IS NOT NULL")
+    undated = cursor.fetchall()
+    if undated:
+        with connection:
+            cursor.executemany("UPDATE mealplan SET date=NULL WHERE day=?", undated)
+    output = resolve_format(output)
+    if output != "grid":
+        with profile_phase("rendering"):
+            write_rows(query_mealplan(), ["day", "date", "recipe"], output)
+        return
+    mealplan_with_recipes = [[day, safe_str(date), name] for day, date, name in query_mealplan()]
 
     # If meal plan is empty:
     if len(mealplan_with_recipes) == 0:
         print("The meal plan is empty. Please add recipes before printing it :)")
         return
 
-    # Sort output
-    mealplan_with_recipes.sort(key=lambda x: datetime.strptime(x[1], "%Y-%m-%d"))
-
     # Get Column Width
     console_width = shutil.get_terminal_size().columns
 
@@ -561,123 +1235,597 @@ def print_mealplan(**kwargs):
     headers = ["Weekday", "Date", "Recipe"]
     num_columns = len(headers)
     max_col_width = (console_width - (num_columns+1)) // num_columns
-    print(tabulate(mealplan_with_recipes, headers=headers, tablefmt="grid", numalign='center', maxcolwidths=[max_col_width] * num_columns))
+    from tabulate import tabulate
+    with profile_phase("rendering"):
+        print(tabulate(mealplan_with_recipes, headers=headers, tablefmt="grid", numalign='center', maxcolwidths=[max_col_width] * num_columns))
+
+def refresh_grocery_list(current_day):
+    """Brings the stored grocery list up to date, if the triggers marked it stale or it was built on another day.
+    Only the planned recipes whose ingredients changed since their contribution was last summed are recomputed;
+    the list is then rebuilt from the (at most seven) planned recipes' contributions.
+
+    Args:
+        current_day (str): Today's date, formatted as YYYY-MM-DD.
+
+    Returns:
+        bool: True if the list was rebuilt, False if it was already up to date.
+    """
+    # Apply recipe changes not applied yet (earlier commands of a batch script, or another writer's), so stale is up to date
+    connection.apply_recipe_changes()
+    if cursor.execute("SELECT built_for, stale FROM grocery_state").fetchone() == (current_day, 0):
+        return False
+    with connection:
+        # Someone else may have refreshed it while we waited for the write lock
+        if cursor.execute("SELECT built_for, stale FROM grocery_state").fetchone() == (current_day, 0):
+            return False
+        stale_planned = "SELECT s.recipe_id FROM grocery_stale_recipes s JOIN mealplan m ON m.recipe_id = s.recipe_id"
+        cursor.execute("DELETE FROM grocery_contributions WHERE recipe_id IN ({s})".format(s=stale_planned))
+        cursor.execute("""
+        INSERT INTO grocery_contributions (recipe_id, ingredient_id, unit_id, quantity)
+        SELECT recipe_id, ingredient_id, unit_id, SUM(quantity) FROM recipe_ingredients
+        WHERE recipe_id IN ({s})
+        GROUP BY recipe_id, ingredient_id, unit_id
+        """.format(s=stale_planned))
+        cursor.execute("DELETE FROM grocery_stale_recipes WHERE recipe_id IN (SELECT recipe_id FROM mealplan)")
+        cursor.execute("DELETE FROM grocery_list")
+        cursor.execute("""
+        INSERT INTO grocery_list (location, ingredient_name, unit_name, quantity)
+        SELECT COALESCE(i.grocery_location, 'Unknown'), i.ingredient_name, COALESCE(u.unit_name, 'Units'), SUM(c.quantity)
+        FROM mealplan m
+        JOIN grocery_contributions c ON c.recipe_id = m.recipe_id
+        JOIN ingredients i ON i.ingredient_id = c.ingredient_id
+        LEFT JOIN units u ON u.unit_id = c.unit_id
+        WHERE m.date > ?
+        GROUP BY c.ingredient_id, c.unit_id
+        """, (current_day,))
+        cursor.execute("UPDATE grocery_state SET built_for=?, stale=0", (current_day,))
+    return True
+
+def query_grocery_list(current_day, db=None):
+    """Reads the grocery list: every ingredient of the meals after current_day, summed per unit.
+    Reads the stored list if it is up to date, and otherwise sums it from the meal plan (e.g. on the read-only connections of the HTTP API).
+
+    Args:
+        current_day (str): Today's date, formatted as YYYY-MM-DD.
+        db (sqlite3.Cursor, optional): Cursor to read with. Defaults to the module-level cursor.
+
+    Returns:
+        sqlite3.Cursor: (location, ingredient, unit, quantity) rows, ordered by location, then ingredient.
+    """
+    db = db or cursor
+    # A read-only connection can't apply pending recipe changes, so any pending ingredient change means the stored list may be stale
+    freshness_query = "SELECT built_for, stale OR EXISTS (SELECT 1 FROM recipe_changes WHERE ingredients = 1) FROM grocery_state"
+    if db.execute(freshness_query).fetchone() == (current_day, 0):
+        return db.execute("SELECT location, ingredient_name, unit_name, quantity FROM grocery_list ORDER BY location, ingredient_name, unit_name")
+    # Sum every ingredient per unit across the upcoming meals, grouped by aisle
+    grocery_query = """
+    SELECT COALESCE(i.grocery_location, 'Unknown') AS location, i.ingredient_name, COALESCE(u.unit_name, 'Units') AS unit_name, SUM(ri.quantity)
+    FROM mealplan m
+    JOIN recipe_ingredients ri ON ri.recipe_id = m.recipe_id
+    JOIN ingredients i ON i.ingredient_id = ri.ingredient_id
+    LEFT JOIN units u ON u.unit_id = ri.unit_id
+    WHERE m.date > ?
+    GROUP BY i.ingredient_id, ri.unit_id
+    ORDER BY location, i.ingredient_name, unit_name
+    """
+    return db.execute(grocery_query, (current_day,))
+
+def query_grocery_diff():
+    """Compares the stored grocery list with the last one saved with --save.
+
+    Returns:
+        sqlite3.Cursor: (change, location, ingredient, unit, saved quantity, quantity, saved location) rows, where change is "added", "removed", or "changed",
+            ordered by location, then ingredient.
+    """
+    diff_query = """
+    SELECT CASE WHEN o.quantity IS NULL THEN 'added' ELSE 'changed' END, n.location, n.ingredient_name, n.unit_name, o.quantity, n.quantity, o.location
+    FROM grocery_list n
+    LEFT JOIN grocery_saved o ON o.ingredient_name = n.ingredient_name AND o.unit_name = n.unit_name
+    WHERE o.quantity IS NULL OR abs(o.quantity - n.quantity) > 1e-9 OR o.location != n.location
+    UNION ALL
+    SELECT 'removed', o.location, o.ingredient_name, o.unit_name, o.quantity, NULL, o.location
+    FROM grocery_saved o
+    WHERE NOT EXISTS (SELECT 1 FROM grocery_list n WHERE n.ingredient_name = o.ingredient_name AND n.unit_name = o.unit_name)
+    ORDER BY 2, 3, 4
+    """
+    return cursor.execute(diff_query)
+
+def print_grocery_diff(output):
+    """Prints what changed in the grocery list since it was last saved.
+
+    Args:
+        output (str): The --format to print in.
+
+    Returns:
+        True and an empty string if the changes were printed.
+        False and an error message if no list has been saved yet.
+    """
+    saved_at = cursor.execute("SELECT saved_at FROM grocery_state").fetchone()[0]
+    if saved_at is None:
+        return False, "No grocery list has been saved yet. Use --groceries --save to save one to compare with."
+    rows = query_grocery_diff()
+    if output != "grid":
+        with profile_phase("rendering"):
+            write_rows(rows, ["change", "location", "ingredient", "unit", "saved_quantity", "quantity", "saved_location"], output)
+        return True, ""
+    print("CHANGES SINCE THE LIST SAVED ON {d}".format(d=saved_at))
+    print("-------------")
+    printed = False
+    symbols = {"added": "+", "removed": "-", "changed": "~"}
+    for location, location_rows in groupby(rows, key=itemgetter(1)):
+        print(location.upper())
+        print('----------------------')
+        for change, location, ingredient, units, saved_quantity, quantity, saved_location in location_rows:
+            if change == "changed" and abs(saved_quantity - quantity) > 1e-9:
+                line = "{c} {i}: {o} -> {n} {u}".format(c=symbols[change], i=ingredient, o=saved_quantity, n=quantity, u=units)
+            else:
+                line = "{c} {i}: {q} {u}".format(c=symbols[change], i=ingredient, q=saved_quantity if change == "removed" else quantity, u=units)
+            if change == "changed" and saved_location != location:
+                line += " (moved from {l})".format(l=saved_location)
+            print(line)
+        print(" ")
+        printed = True
+    if not printed:
+        print("Nothing has changed.")
+    return True, ""
+
+def save_grocery_list():
+    """Remembers the stored grocery list as the last saved one, for --diff."""
+    with connection:
+        cursor.execute("DELETE FROM grocery_saved")
+        cursor.execute("INSERT INTO grocery_saved (location, ingredient_name, unit_name, quantity) SELECT location, ingredient_name, unit_name, quantity FROM grocery_list")
+        cursor.execute("UPDATE grocery_state SET saved_at=?", (datetime.now().strftime('%Y-%m-%d %H:%M'),))
 
-def create_grocery_list(save=False,**kwargs):
+def create_grocery_list(save=False, output=None, diff=False, **kwargs):
     """Creates a grocery list for whatever is in the current meal plan. Only includes days that have not happened yet.
+    The list is kept in the grocery_list table and only rebuilt when the meal plan or a planned recipe changed (see refresh_grocery_list),
+    then streamed to the console (and the saved file, if saving) as rows arrive.
+
+    Args:
+        save (bool): Also write the list to groceries/groceries_YYYY-MM-DD.txt (or .csv, .tsv, .json, .jsonl with an explicit --format), unless that file already holds the current list.
+        output (str, optional): The --format to print in. Defaults to resolve_format(None).
+        diff (bool): Print what changed since the list was last saved, instead of the list.
 
     Returns:
         True and an empty list if the grocery list is printed.
         False and an error message if there is nothing in the meal plan.
     """
-    grocery_list = {}
     current_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d')
-    # Find meals from mealplan
-    mp_query = "SELECT recipe_id FROM mealplan WHERE date>?"
-    cursor.execute(mp_query, (current_day,))
-    meals = cursor.fetchall()
-    if len(meals) == 0:
-        return(False, "Your meal plan is empty. Please fill it before trying to create a grocery list.")
-    # For each recipe:
-    for meal in meals:
-        # Gather ingredients
-        find_ingredients_query = "SELECT * FROM recipe_ingredients WHERE recipe_id=?"
-        cursor.execute(find_ingredients_query, meal)
-        recipe_ingredients = cursor.fetchall()
-        for ingredient in recipe_ingredients:
-            # Find ingredient name
-            ingredient_id = ingredient[2]
-            find_ing_name_query = "SELECT * FROM ingredients WHERE ingredient_id=?"
-            cursor.execute(find_ing_name_query, (ingredient_id,))
-            ingredient_details = cursor.fetchall()
-            ingredient_name = ingredient_details[0][1]
-            ingredient_location = ingredient_details[0][2]
-            if ingredient_name not in grocery_list:
-                grocery_list[ingredient_name] = {}
-                grocery_list[ingredient_name]["location"] = ingredient_location
-            # Find units
-            unit_id = ingredient[4]
-            if unit_id != None:
-                find_units_query = "SELECT unit_name FROM units WHERE unit_id=?"
-                cursor.execute(find_units_query, (unit_id,))
-                unit_name = cursor.fetchall()[0][0]
-            else:
-                unit_name = "Units"
-            # Find quantity
-            quantity = ingredient[3]
-            # Add to list
-            quant_added = False
-            for existing_quantity in grocery_list[ingredient_name].keys():
-                if existing_quantity == unit_name:
-                    grocery_list[ingredient_name][existing_quantity] = grocery_list[ingredient_name][existing_quantity] + quantity
-                    quant_added = True
-            if not quant_added:
-                grocery_list[ingredient_name][unit_name] = quantity
-    # Print out grocery list
-    if len(grocery_list) != 0:
-        output = []
-        def add_output(text):
-            print(text)
-            output.append(text)
-        add_output("GROCERY LIST")
-        add_output("-------------")
-        # Organize by location
-        location_list = [grocery_list[ingredient]["location"] for ingredient in grocery_list.keys()]
-        location_list = list(set(location_list))
-        for location in location_list:
-            add_output(location.upper())
-            add_output('----------------------')
-            for ingredient in grocery_list.keys():
-                if grocery_list[ingredient]["location"] == location:
-                    unit_str = ""
-                    amounts = grocery_list[ingredient]
-                    for units in amounts.keys():
-                        if units != "location":
-                            unit_str += str(amounts[units]) + " " + units + ", "
-                    unit_str = unit_str[:-2]
-                    add_output(ingredient + ": " + unit_str)
-            add_output(" ")    
-        if save:
-            if not os.path.isdir('groceries'):
-                os.mkdir('groceries')
-            os.chdir('groceries')
-            with open('groceries_{day}.txt'.format(day=current_day), 'w') as file:
-                for line in output:
-                    file.write(line + "\n")
-            os.chdir('..')
+    refresh_grocery_list(current_day)
+    # The saved file stays plain text unless a --format is asked for, even when the console output is piped (and so tsv)
+    saved_output = output or "grid"
+    output = resolve_format(output)
+    path = os.path.join('groceries', 'groceries_{day}.{ext}'.format(day=current_day, ext="txt" if saved_output == "grid" else saved_output))
+    unchanged = (save and os.path.exists(path) and cursor.execute("SELECT saved_at FROM grocery_state").fetchone()[0] is not None
+                 and query_grocery_diff().fetchone() is None)
+    if diff:
+        shown, error = print_grocery_diff(output)
+        if not shown:
+            return False, error
+        rows, first_row = [], None
+    else:
+        rows = query_grocery_list(current_day)
+        first_row = rows.fetchone()
+        if first_row is None:
+            cursor.execute("SELECT 1 FROM mealplan WHERE date>? LIMIT 1", (current_day,))
+            if cursor.fetchone() is None:
+                return(False, "Your meal plan is empty. Please fill it before trying to create a grocery list.")
+            return True, ""
+    file = None
+    if save and not unchanged:
+        os.makedirs('groceries', exist_ok=True)
+        file = open(path, 'w', newline='')
+        if diff:
+            # The list itself wasn't printed: write it to the file only
+            rows = query_grocery_list(current_day)
+            first_row = rows.fetchone()
+    try:
+        # Each format, with the files to write it to
+        targets = {}
+        if not diff:
+            targets.setdefault(output, []).append(sys.stdout)
+        if file is not None:
+            targets.setdefault(saved_output, []).append(file)
+        if first_row is not None:
+            rows = chain([first_row], rows)
+            if len(targets) > 1:
+                rows = list(rows)
+            with profile_phase("rendering"):
+                for target_output, files in targets.items():
+                    write_grocery_list(rows, target_output, files)
+    finally:
+        if file is not None:
+            file.close()
+    if file is not None:
+        save_grocery_list()
+    elif unchanged:
+        print("The grocery list hasn't changed since it was saved to {p}.".format(p=path), file=sys.stdout if output == "grid" else sys.stderr)
     return True, ""
 
-def random_recipe (args, **kwargs):
-    """Picks and prints a random recipe from the menu.
+def write_grocery_list(rows, output, files):
+    """Writes the grocery list in one format to one or more files, as rows arrive.
+
+    Args:
+        rows (iterable): (location, ingredient, unit, quantity) rows, ordered by location, then ingredient.
+        output (str): The format: "grid" for the plain-text list grouped by aisle, or any other --format.
+        files (list): Open text files (e.g. sys.stdout) to write to.
+    """
+    if output != "grid":
+        write_rows(rows, ["location", "ingredient", "unit", "quantity"], output, files)
+        return
+    def add_output(text):
+        for file in files:
+            file.write(text + "\n")
+    add_output("GROCERY LIST")
+    add_output("-------------")
+    # Rows arrive ordered by location, then ingredient, so each group is contiguous
+    for location, location_rows in groupby(rows, key=itemgetter(0)):
+        add_output(location.upper())
+        add_output('----------------------')
+        for ingredient, amounts in groupby(location_rows, key=itemgetter(1)):
+            unit_str = ", ".join(str(quantity) + " " + units for _, _, units, quantity in amounts)
+            add_output(ingredient + ": " + unit_str)
+        add_output(" ")
+
+def recipe_weight(ratings, last_made, today):
+    """Weight of a recipe for --random: higher for better-rated recipes, lower for recipes made recently.
 
     Args:
-        args (dictionary): Optional filter arguments. 
+        ratings (list): The roommates' ratings (None if not rated).
+        last_made (str): The date the recipe was last made (YYYY-MM-DD), or None.
+        today (date): Today's date.
 
     Returns:
-        _type_: _description_
+        float: The weight (always greater than 0).
+    """
+    rated = [float(rating) for rating in ratings if rating is not None]
+    # Unrated recipes count as "Mid"
+    average = sum(rated) / len(rated) if rated else 3.0
+    weight = (average / 5.0) ** 2
+    if last_made:
+        try:
+            days = (today - date.fromisoformat(last_made)).days
+        except ValueError:
+            days = RANDOM_RECENT_DAYS
+        weight *= max(RANDOM_MIN_RECENCY, min(days, RANDOM_RECENT_DAYS) / RANDOM_RECENT_DAYS)
+    return weight
+
+def sample_recipes(k, menu_filter=None, seed=None):
+    """Draws k distinct recipes from the menu without sorting it, weighted by recipe_weight.
+    Uses weighted reservoir sampling (Efraimidis-Spirakis): one pass over the (filtered) menu, keeping the k largest u ** (1 / weight) keys in a heap.
+    The keys are compared as log(u) / weight, since u ** (1 / weight) underflows to 0 for the smallest weights.
+
+    Args:
+        k (int): Number of recipes to draw.
+        menu_filter (MenuFilter, optional): Only draw recipes matching this filter (output from check_filter).
+        seed (int, optional): Seed for reproducible draws.
+
+    Returns:
+        list: Up to k menu rows, most likely first.
     """
+    generator = random.Random(seed)
+    today = date.today()
     sql_query = "SELECT * FROM menu"
+    parameters = ()
+    if menu_filter != None:
+        sql_query += " WHERE " + menu_filter.sql
+        parameters = menu_filter.parameters
+    # Iterating in id order keeps seeded draws reproducible
+    sql_query += " ORDER BY id"
+    reservoir = []
+    for row in cursor.execute(sql_query, parameters):
+        # 1 - random() is never 0, so its log is always defined
+        key = math.log(1.0 - generator.random()) / recipe_weight(row[4:7], row[7], today)
+        if len(reservoir) < k:
+            heapq.heappush(reservoir, (key, row))
+        elif key > reservoir[0][0]:
+            heapq.heapreplace(reservoir, (key, row))
+    return [row for key, row in sorted(reservoir, reverse=True)]
 
-    if args['filter'] != None:
-        sql_query += " WHERE "
-        sql_query += args['filter']
+def random_recipe (args, **kwargs):
+    """Picks and prints random recipes from the menu, favouring well-rated recipes that haven't been made recently.
 
-    sql_query += " ORDER BY RANDOM() LIMIT 1"
+    Args:
+        args (dictionary): Contains --random (number of recipes to suggest) and optional --filter, --seed, and --format arguments.
 
-    try:
-        cursor.execute(sql_query)
-        recipe = cursor.fetchall()
-        print("RECIPE: " + recipe[0][1])
-        print("DISH TYPE: " + str(recipe[0][2]))
-        print("CUISINE: " + str(recipe[0][3]))
-        print("DRUMLIN RATING: " + str(recipe[0][4]))
-        print("IAN RATING: " + str(recipe[0][5]))
-        print("LINA RATING: " + str(recipe[0][6]))
-        print("LAST MADE: " + str(recipe[0][7]))
-    except:
-        raise sqlite3.DatabaseError
+    Returns:
+        True and an empty string if recipes were printed.
+        False and an error string if no recipes match.
+    """
+    recipes = sample_recipes(int(args['random']), args.get('filter'), args.get('seed'))
+    if len(recipes) == 0:
+        return False, "No recipes in the menu match."
+    output = resolve_format(args.get('format'))
+    if output != "grid":
+        write_rows(recipes, menu_columns(), output)
+        return True, ""
+    for number, recipe in enumerate(recipes):
+        if number > 0:
+            print()
+        print("RECIPE: " + recipe[1])
+        print("DISH TYPE: " + str(recipe[2]))
+        print("CUISINE: " + str(recipe[3]))
+        print("DRUMLIN RATING: " + str(recipe[4]))
+        print("IAN RATING: " + str(recipe[5]))
+        print("LINA RATING: " + str(recipe[6]))
+        print("LAST MADE: " + str(recipe[7]))
+    return True, ""
+
+def search_recipes(args, **kwargs):
+    """Searches recipe names, ingredients, prepmethods, and instructions, and prints the best matches with a snippet of where they matched.
+
+    Args:
+        args (dict): Contains --search, which contains the search terms, and potential optional argument --limit.
+            Words are all required (e.g. chickpea curry); put words in double quotes to search for a phrase (e.g. "air fryer").
+            Matching ignores case and simple word endings (chickpeas matches chickpea).
+
+    Returns:
+        True and an empty string if the search ran (even if nothing matched).
+        False and an error string if the search terms are empty.
+    """
+    # Quote every term, so punctuation in the search can't be read as FTS5 syntax
+    terms = ['"' + (phrase or word).replace('"', '') + '"' for phrase, word in re.findall(r'"([^"]+)"|(\w+)', args['search'])]
+    if len(terms) == 0:
+        return False, "Please include at least one word to search for."
+    limit = int(args['limit']) if args.get('limit') != None else 10
+    # Apply recipe changes not applied yet (earlier commands of a batch script, or another writer's), so no document is out of date
+    connection.apply_recipe_changes()
+    search_query = """
+    SELECT name, snippet(recipe_search, -1, '[', ']', '...', 12), bm25(recipe_search, 10.0, 5.0, 1.0) AS score
+    FROM recipe_search
+    WHERE recipe_search MATCH ?
+    ORDER BY score
+    LIMIT ?
+    """
+    cursor.execute(search_query, (" ".join(terms), limit))
+    results = [[name, snippet] for name, snippet, score in cursor.fetchall()]
+    if len(results) == 0:
+        print("No recipes matched {}.".format(args['search']))
+        return True, ""
+    from tabulate import tabulate
+    console_width = shutil.get_terminal_size().columns
+    with profile_phase("rendering"):
+        print(tabulate(results, headers=["Recipe", "Match"], tablefmt="grid", maxcolwidths=[console_width // 4, console_width - console_width // 4 - 7]))
+    return True, ""
+
+def build_pantry_index():
+    """
+    Builds the inverted ingredient index used by --cook-from, in one pass over recipe_ingredients.
+    The index is kept in memory and rebuilt only when the database has changed since it was built.
+
+    Returns:
+        PantryIndex: postings (ingredient ID -> sorted array of recipe IDs), recipe_ingredients (recipe ID -> tuple of distinct ingredient IDs), and the database state it was built from.
+    """
+    global _pantry_index
+    state = database_state()
+    if _pantry_index is not None and _pantry_index.state == state:
+        return _pantry_index
+    postings = {}
+    recipe_ingredients = {}
+    # Rows come back ordered by the (ingredient_id, recipe_id) index, so every posting list is already sorted
+    cursor.execute("SELECT DISTINCT ingredient_id, recipe_id FROM recipe_ingredients WHERE ingredient_id IS NOT NULL ORDER BY ingredient_id, recipe_id")
+    for ingredient_id, recipe_id in cursor:
+        posting = postings.get(ingredient_id)
+        if posting is None:
+            posting = postings[ingredient_id] = array('l')
+        posting.append(recipe_id)
+        recipe_ingredients.setdefault(recipe_id, []).append(ingredient_id)
+    _pantry_index = PantryIndex(postings, {recipe_id: tuple(ids) for recipe_id, ids in recipe_ingredients.items()}, state)
+    return _pantry_index
+
+def cook_from(args, **kwargs):
+    """Ranks the recipes in the menu by how many of their ingredients are on hand, and prints the best matches with what is missing.
+    Recipes are ranked by the fraction of their ingredients available, then by the number available.
+
+    Args:
+        args (dict): Contains --cook-from, which contains the ingredients on hand, and potential optional arguments --filter and --limit.
+            Ingredient names are matched ignoring case, punctuation, and simple plurals.
+
+    Returns:
+        True and an empty string if the ranking was printed.
+        False and an error string if none of the ingredients are used in any recipe.
+    """
+    index = build_pantry_index()
+    # Match what's on hand to ingredient IDs (several rows may share a normalized name, e.g. Tomato and Tomatoes)
+    cursor.execute("SELECT ingredient_id, ingredient_name FROM ingredients")
+    ingredient_names = {}
+    by_term = {}
+    for ingredient_id, name in cursor.fetchall():
+        ingredient_names[ingredient_id] = name
+        by_term.setdefault(normalize_search_term(name), []).append(ingredient_id)
+    pantry = set()
+    unknown = []
+    for item in args['cook_from']:
+        ids = [ingredient_id for ingredient_id in by_term.get(normalize_search_term(item), []) if ingredient_id in index.postings]
+        if ids:
+            pantry.update(ids)
+        else:
+            unknown.append(item)
+    if unknown:
+        print("Not used in any recipe: {}".format(", ".join(unknown)))
+    if len(pantry) == 0:
+        return False, "None of those ingredients are used in the menu's recipes."
+    # Coverage: one pass over the posting lists of what's on hand
+    coverage = Counter()
+    for ingredient_id in pantry:
+        coverage.update(index.postings[ingredient_id])
+    if args.get('filter') != None:
+        cursor.execute("SELECT id FROM menu WHERE " + args['filter'].sql, args['filter'].parameters)
+        allowed = {row[0] for row in cursor.fetchall()}
+        coverage = Counter({recipe_id: have for recipe_id, have in coverage.items() if recipe_id in allowed})
+    limit = int(args['limit']) if args.get('limit') != None else 10
+    ranked = heapq.nsmallest(limit, coverage.items(), key=lambda item: (-item[1] / len(index.recipe_ingredients[item[0]]), -item[1], item[0]))
+    if len(ranked) == 0:
+        print("No recipes in the menu match.")
+        return True, ""
+    cursor.execute("SELECT id, name FROM menu WHERE id IN ({p})".format(p=", ".join(['?'] * len(ranked))), [recipe_id for recipe_id, _ in ranked])
+    recipe_names = dict(cursor.fetchall())
+    results = []
+    for recipe_id, have in ranked:
+        needed = index.recipe_ingredients[recipe_id]
+        missing = sorted(ingredient_names.get(ingredient_id, '') for ingredient_id in needed if ingredient_id not in pantry)
+        results.append([recipe_names.get(recipe_id, ''), "{h}/{t}".format(h=have, t=len(needed)), "{:.0%}".format(have / len(needed)), ", ".join(missing)])
+    from tabulate import tabulate
+    console_width = shutil.get_terminal_size().columns
+    with profile_phase("rendering"):
+        print(tabulate(results, headers=["Recipe", "Have", "Coverage", "Missing"], tablefmt="grid", maxcolwidths=[console_width // 4, None, None, console_width // 2]))
+    return True, ""
 
 # Helper Functions
+def name_trigrams(name):
+    """Returns the trigrams of a name's normalized words, each word padded like "  word " so that starts of words weigh more.
+    Names are normalized first, so "Tomatoes" and "tomato" have the same trigrams.
+
+    Args:
+        name (str): A recipe or ingredient name.
+
+    Returns:
+        set: The trigrams.
+    """
+    trigrams = set()
+    for word in normalize_search_term(name).split():
+        trigrams.update(word_trigrams(word))
+    return trigrams
+
+@lru_cache(maxsize=4096)
+def word_trigrams(word):
+    """Returns the trigrams of one normalized word, padded like "  word ". Cached, since names share most of their words."""
+    padded = "  " + word + " "
+    return tuple(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def build_name_index(table):
+    """
+    Builds the trigram index of the recipe names ('menu') or ingredient names ('ingredients'), in one pass over the table.
+    Each trigram's posting is a bitmap (a Python int) with bit i set if the i-th name has the trigram, so a query can count
+    shared trigrams for every name at once with a few big-integer operations instead of visiting each name.
+    The index is kept in memory and rebuilt only when the database has changed since it was built.
+
+    Args:
+        table (str): 'menu' or 'ingredients'.
+
+    Returns:
+        NameIndex: names and sizes (number of trigrams) by bit position, postings (trigram -> bitmap), and the database state it was built from.
+    """
+    state = database_state()
+    index = _name_indexes.get(table)
+    if index is not None and index.state == state:
+        return index
+    id_column, name_column = FUZZY_TABLES[table]
+    names = []
+    sizes = []
+    bitmaps = {}
+    for (name,) in cursor.execute("SELECT {n} FROM {t} WHERE {n} IS NOT NULL ORDER BY {i}".format(i=id_column, n=name_column, t=table)):
+        trigrams = name_trigrams(name)
+        byte, bit = divmod(len(names), 8)
+        names.append(name)
+        sizes.append(len(trigrams))
+        for trigram in trigrams:
+            bitmap = bitmaps.get(trigram)
+            if bitmap is None:
+                bitmap = bitmaps[trigram] = bytearray()
+            if len(bitmap) <= byte:
+                bitmap.extend(bytes(byte + 1 - len(bitmap)))
+            bitmap[byte] |= 1 << bit
+    postings = {trigram: int.from_bytes(bitmap, 'little') for trigram, bitmap in bitmaps.items()}
+    index = NameIndex(names, sizes, postings, state)
+    _name_indexes[table] = index
+    return index
+
+def fuzzy_matches(table, name, limit=FUZZY_SUGGESTIONS, min_similarity=FUZZY_MIN_SIMILARITY):
+    """Finds the names closest to name, ranked by trigram similarity (shared trigrams over all trigrams of either name).
+    Ties go to the name added first.
+
+    Args:
+        table (str): 'menu' or 'ingredients'.
+        name (str): The name to match.
+        limit (int): Number of matches to return.
+        min_similarity (float): Lowest similarity (0 to 1) worth returning.
+
+    Returns:
+        list: Up to limit (name, similarity) tuples, closest first.
+    """
+    index = build_name_index(table)
+    trigrams = name_trigrams(name)
+    if len(trigrams) == 0:
+        return []
+    # Add up the postings as binary numbers, one bitmap per binary digit: bit i of counts[d] is digit d of
+    # the number of trigrams the i-th name shares with name
+    counts = []
+    for trigram in trigrams:
+        carry = index.postings.get(trigram, 0)
+        digit = 0
+        while carry:
+            if digit == len(counts):
+                counts.append(carry)
+                break
+            counts[digit], carry = counts[digit] ^ carry, counts[digit] & carry
+            digit += 1
+    # Visit names from the most shared trigrams down. A name sharing count trigrams is at most count / len(trigrams) similar,
+    # so once that can't beat the worst of the best so far, no name left can either.
+    best = []
+    for count in range(len(trigrams), 0, -1):
+        if count / len(trigrams) < min_similarity or len(best) == limit and best[0][0] >= count / len(trigrams):
+            break
+        if count >> len(counts):
+            continue
+        sharing = -1
+        for digit, bitmap in enumerate(counts):
+            sharing &= bitmap if count >> digit & 1 else ~bitmap
+        if sharing <= 0:
+            continue
+        bits = bin(sharing)[:1:-1]
+        position = bits.find('1')
+        while position != -1:
+            similarity = count / (len(trigrams) + index.sizes[position] - count)
+            if similarity >= min_similarity:
+                if len(best) < limit:
+                    heapq.heappush(best, (similarity, -position))
+                elif (similarity, -position) > best[0]:
+                    heapq.heapreplace(best, (similarity, -position))
+            position = bits.find('1', position + 1)
+    return [(index.names[-position], similarity) for similarity, position in sorted(best, reverse=True)]
+
+def did_you_mean(name):
+    """Suggests the recipes on the menu closest to a name that isn't on it.
+
+    Args:
+        name (str): The recipe name that wasn't found.
+
+    Returns:
+        str: e.g. " Did you mean Pad Thai or Pad See Ew?", or an empty string if no recipe is close.
+    """
+    matches = [match for match, _ in fuzzy_matches('menu', name)]
+    if len(matches) == 0:
+        return ""
+    return " Did you mean {m}?".format(m=matches[0] if len(matches) == 1 else ", ".join(matches[:-1]) + " or " + matches[-1])
+
+def canonicalize_ingredient_rows(recipes, canonicalize=False):
+    """Looks for new ingredients whose names nearly match an existing ingredient (e.g. Tomatoes and Tomato).
+    With canonicalize, the rows are pointed at the existing ingredient instead; otherwise the likely duplicates are only pointed out.
+
+    Args:
+        recipes (list): Lists of (ingredient, quantity, unit, prepmethod) tuples from parse_ingredients_file.
+        canonicalize (bool): Whether to replace the near-duplicate names.
+
+    Returns:
+        list: The lists of rows, with near-duplicate names replaced if canonicalize is set.
+    """
+    ingredient_names = {row[0] for rows in recipes for row in rows}
+    existing = load_lookup('ingredients', 'ingredient_name', 'ingredient_id', ingredient_names)
+    matches = {}
+    for name in sorted(ingredient_names - existing.keys()):
+        best = fuzzy_matches('ingredients', name, limit=1, min_similarity=CANONICAL_MIN_SIMILARITY)
+        if len(best) > 0:
+            matches[name] = best[0][0]
+    for name, match in matches.items():
+        if canonicalize:
+            print("Using the existing ingredient {m} for {n}.".format(m=match, n=name))
+        else:
+            print("{n} looks like the existing ingredient {m}. Add --canonicalize to use {m} instead.".format(n=name, m=match))
+    if not canonicalize or len(matches) == 0:
+        return recipes
+    return [[(matches.get(row[0], row[0]),) + tuple(row[1:]) for row in rows] for rows in recipes]
+
 def check_date(input_date):
     """Ensures that a last_made argument date is in the correct format. Also reformats it.
 
@@ -722,136 +1870,297 @@ def check_rating(rating):
         raise argparse.ArgumentTypeError("Invalid rating {r}. Ratings must be numbers between 1 and 5.".format(r=rating))
     return rating
 
-def check_filter(filter):
-    """Checks whether the filter input by the user is in the right format.
+def check_min_rating(threshold):
+    """
+    Checks a --min-rating threshold: a rating for every roommate, or NAME=RATING for one roommate.
 
     Args:
-        filter(string): Filter provided by the user; should be formatted as an SQL query.
-    
+        threshold(string): The threshold provided by the user, e.g. "3.5" or "lina=4".
+
     Raises:
-        ValueError if there is no WHERE query within the SQL query.
-        ArgumentTypeError if the variable is not in the menu, or if the comparison value is not in the correct format for that variable.
-    
+        argparse.ArgumentTypeError if the roommate is unknown or the rating is invalid.
+
     Returns:
-        sql_query(string): Filter formatted as an SQL query.
+        (column, rating): The rating column the threshold applies to (None for every roommate) and the rating as a float.
     """
-    # Create & parse SQL query
-    query = "SELECT * FROM menu WHERE "
-    query += filter
-    sql_query = sqlparse.parse(query)[0]
-    where_query = None
-
-    # Get the WHERE part of the query
-    for token in sql_query.tokens:
-        if isinstance(token, sqlparse.sql.Where):
-            where_query = token
+    if "=" not in threshold:
+        return None, check_rating(threshold)
+    roommate, rating = threshold.split("=", 1)
+    column = roommate.strip().lower() + "_rating"
+    if column not in RATING_COLUMNS:
+        raise argparse.ArgumentTypeError("Invalid roommate {r}. Choose from: {c}.".format(r=roommate.strip(), c=", ".join(c[:-len("_rating")] for c in RATING_COLUMNS)))
+    return column, check_rating(rating)
+
+# Menu filter & order language
+# Filters are compiled to parameterized SQL instead of being spliced into queries. Grammar:
+#   filter     := term (OR term)*
+#   term       := factor (AND factor)*
+#   factor     := NOT factor | "(" filter ")" | comparison
+#   comparison := column (= | == | != | <> | < | <= | > | >=) value
+#               | column IS [NOT] NULL
+#               | column [NOT] LIKE value
+#               | column [NOT] IN "(" value ("," value)* ")"
+#               | column [NOT] BETWEEN value AND value
+#   value      := number | 'text' | "text" | DD/MM/YYYY | YYYY-MM-DD | word
+# Orders are one or more "column [ASC|DESC]", separated by commas.
+MenuFilter = namedtuple('MenuFilter', ['sql', 'parameters', 'source'])
+FILTER_TOKENS = re.compile(r"""\s*(?:
+    (?P<date>\d{1,2}/\d{1,2}/\d{4}|\d{4}-\d{2}-\d{2})
+    |(?P<number>-?\d+(?:\.\d+)?)
+    |(?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+    |(?P<operator><=|>=|<>|!=|==|=|<|>)
+    |(?P<punctuation>[(),])
+    |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+FILTER_KEYWORDS = {"AND", "OR", "NOT", "IS", "NULL", "LIKE", "IN", "BETWEEN"}
+RATING_COLUMNS = ['drumlin_rating', 'lina_rating', 'ian_rating']
+_menu_columns = {}
+
+def menu_columns(db=None):
+    """Returns the column names of the menu table, read once per schema version.
 
-    if where_query is None:
-        raise ValueError("No WHERE clause found in the SQL query.")
-    
-    # Get comparisons from the WHERE part of the query
-    comparisons = []
-    for token in where_query.tokens:
-        if isinstance(token, sqlparse.sql.Comparison):
-            comparisons.append(token)
-    
-    # Find valid variable names
-    cursor.execute("SELECT name FROM pragma_table_info('menu')")
-    retrieved_columns = cursor.fetchall()
-    valid_columns = []
-    for col in retrieved_columns:
-        valid_columns.append(col[0])
-    
-    # Iterate over comparisons to validate them
-    for comparison in comparisons:
-        if comparison.left.normalized not in valid_columns:
-            raise argparse.ArgumentTypeError("Invalid filter: the variable {v} was not found in the menu.".format(v=comparison.left.normalized))
-        if comparison.left.normalized in ['drumlin_rating', 'lina_rating', 'ian_rating']:
-            try:
-                float(comparison.right.normalized)
-            except ValueError:
-                raise argparse.ArgumentTypeError("Invalid rating {r}. Ratings must be numbers between 1 and 5.".format(r=comparison.right.normalized))
-            check_rating(comparison.right.normalized)
-        elif comparison.left.normalized == "last_made":
-            date_correct, message, formatted_date = check_date(comparison.right.normalized)
-            if not date_correct:
-                raise argparse.ArgumentTypeError(message)
-    
-    sql_query = sql_query.value
-    sql_query = sql_query.split("WHERE")
-    sql_query = sql_query[1].strip()
+    Args:
+        db (sqlite3.Cursor, optional): Cursor to read with. Defaults to the module-level cursor.
 
-    return sql_query
+    Returns:
+        tuple: The column names, in table order.
+    """
+    db = db or cursor
+    schema_version = db.execute("PRAGMA schema_version").fetchone()[0]
+    columns = _menu_columns.get(schema_version)
+    if columns is None:
+        columns = tuple(col[0] for col in db.execute("SELECT name FROM pragma_table_info('menu')").fetchall())
+        _menu_columns.clear()
+        _menu_columns[schema_version] = columns
+    return columns
+
+def tokenize_filter(text):
+    """Splits a filter into (kind, text) tokens.
 
-def check_order(order):
-    """_summary_
+    Raises:
+        argparse.ArgumentTypeError if the filter contains characters that are not part of the filter language.
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = FILTER_TOKENS.match(text, position)
+        if match is None or match.end() == position:
+            raise argparse.ArgumentTypeError("Invalid filter: could not understand \"{t}\".".format(t=text[position:].strip()))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word" and value.upper() in FILTER_KEYWORDS:
+            kind, value = "keyword", value.upper()
+        elif kind == "string":
+            value = value[1:-1].replace(value[0] * 2, value[0])
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+def filter_value(column, token):
+    """Converts a filter value into the value bound for a column, checking ratings and dates.
 
     Args:
-        order (str): A string that should contain a variable and then either ASC or DESC.
+        column (str): The menu column being compared.
+        token (tuple): The (kind, text) token of the value.
+
+    Raises:
+        argparse.ArgumentTypeError if the value is not valid for the column.
 
     Returns:
-        sql_query: Order statement organized as an SQL query.
+        The value to bind.
     """
-    # Ensure order has two parts
-    if len(order.split()) != 2:
-        raise argparse.ArgumentTypeError("--order argument must be two words (one column, one of ASC or DESC)")
-    # Create & parse SQL query
-    query = "SELECT * FROM menu ORDER BY "
-    query += order
-    sql_query = sqlparse.parse(query)[0]
-    order_query = ""
-
-    # Get the ORDER BY part of the query
-    order_by_tokens = []
-    order_by_found = False
-
-    # Iterate through tokens to find ORDER BY and collect subsequent tokens
-    for token in sql_query.tokens:
-        if token.ttype is Keyword and token.value.upper() == "ORDER BY":
-            order_by_found = True
-            continue
-        if order_by_found:
-            # Stop collecting if we hit another keyword like LIMIT or OFFSET
-            if token.ttype is Keyword:
-                break
-            if not token.is_whitespace:
-                order_by_tokens.append(token.value)
-    
-    # Check validity of order_by statements
-    # Find valid variable names
-    cursor.execute("SELECT name FROM pragma_table_info('menu')")
-    retrieved_columns = cursor.fetchall()
-    valid_columns = []
-    for col in retrieved_columns:
-        valid_columns.append(col[0])    
-    for token in order_by_tokens:
-        tokens = token.split(",")
-        for order in tokens:
-            parts_of_query = order.split()
-            col_name = parts_of_query[0]
-            direction = parts_of_query[1]
-            # Check variable
-            if col_name not in valid_columns:
-                raise argparse.ArgumentTypeError("Invalid ORDER BY statement: the column {c} does not exist in the menu table.".format(c=col_name))
-            # Check direction
-            if direction not in ["ASC", "DESC"]:
-                raise argparse.ArgumentTypeError("Invalid ORDER BY statement: direction must be one of ASC or DESC.")
-            # Format for query
-            order_query += col_name 
-            order_query += " "
-            order_query += direction
-            order_query += ", "
-        
-    order_query = order_query[:-2]
-    return order_query
+    kind, value = token
+    if kind not in ("number", "string", "date", "word"):
+        raise argparse.ArgumentTypeError("Invalid filter: expected a value after {c}.".format(c=column))
+    if column in RATING_COLUMNS:
+        return check_rating(value)
+    if column == "last_made":
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").strftime('%Y-%m-%d')
+        except ValueError:
+            date_correct, message, formatted_date = check_date(value)
+            if not date_correct:
+                raise argparse.ArgumentTypeError(message)
+            return formatted_date
+    if column == "id":
+        try:
+            return int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError("Invalid filter: id must be a whole number.")
+    if kind == "number":
+        return float(value) if "." in value else int(value)
+    return value
 
-def check_limit(limit):
-    """_summary_
+@lru_cache(maxsize=256)
+def compile_filter(text, columns):
+    """Compiles a filter into a parameterized SQL condition. Results are cached by source text.
 
     Args:
-        limit (_type_): _description_
+        text (str): The filter, e.g. "drumlin_rating >= 4 AND cuisine = 'Thai'".
+        columns (tuple): Valid menu columns (output from menu_columns).
 
-    Returns:
+    Raises:
+        argparse.ArgumentTypeError if the filter does not follow the grammar, names a column that is not in the menu, or has an invalid value.
+
+    Returns:
+        MenuFilter: The SQL condition, the values to bind to it, and the source text.
+    """
+    tokens = tokenize_filter(text)
+    parameters = []
+    position = 0
+
+    def peek(*expected):
+        if position < len(tokens) and (not expected or tokens[position][1] in expected):
+            return tokens[position]
+        return None
+
+    def take(*expected):
+        nonlocal position
+        token = peek(*expected)
+        if token is None:
+            if position == len(tokens):
+                raise argparse.ArgumentTypeError("Invalid filter: the filter ended early. Expected {e}.".format(e=" or ".join(expected) or "a value"))
+            raise argparse.ArgumentTypeError("Invalid filter: expected {e} but found {f}.".format(e=" or ".join(expected), f=tokens[position][1]))
+        position += 1
+        return token
+
+    def parse_or():
+        parts = [parse_and()]
+        while peek("OR"):
+            take("OR")
+            parts.append(parse_and())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def parse_and():
+        parts = [parse_not()]
+        while peek("AND"):
+            take("AND")
+            parts.append(parse_not())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def parse_not():
+        if peek("NOT"):
+            take("NOT")
+            return "NOT " + parse_not()
+        if peek("("):
+            take("(")
+            inner = parse_or()
+            take(")")
+            return "(" + inner + ")"
+        return parse_comparison()
+
+    def parse_comparison():
+        kind, column = take()
+        if kind != "word":
+            raise argparse.ArgumentTypeError("Invalid filter: expected a menu column but found {f}.".format(f=column))
+        if column not in columns:
+            raise argparse.ArgumentTypeError("Invalid filter: the variable {v} was not found in the menu.".format(v=column))
+        if peek("IS"):
+            take("IS")
+            negate = " NOT" if peek("NOT") else ""
+            if negate:
+                take("NOT")
+            take("NULL")
+            return "{c} IS{n} NULL".format(c=column, n=negate)
+        negate = "NOT " if peek("NOT") else ""
+        if negate:
+            take("NOT")
+        if peek("LIKE"):
+            take("LIKE")
+            kind, value = take()
+            if kind not in ("string", "word", "number"):
+                raise argparse.ArgumentTypeError("Invalid filter: LIKE needs a text pattern.")
+            parameters.append(value)
+            return "{c} {n}LIKE ?".format(c=column, n=negate)
+        if peek("IN"):
+            take("IN")
+            take("(")
+            values = [filter_value(column, take())]
+            while peek(","):
+                take(",")
+                values.append(filter_value(column, take()))
+            take(")")
+            parameters.extend(values)
+            return "{c} {n}IN ({p})".format(c=column, n=negate, p=", ".join(["?"] * len(values)))
+        if peek("BETWEEN"):
+            take("BETWEEN")
+            low = filter_value(column, take())
+            take("AND")
+            high = filter_value(column, take())
+            parameters.extend([low, high])
+            return "{c} {n}BETWEEN ? AND ?".format(c=column, n=negate)
+        if negate:
+            raise argparse.ArgumentTypeError("Invalid filter: NOT after a column must be followed by LIKE, IN, or BETWEEN.")
+        kind, operator = take()
+        if kind != "operator":
+            raise argparse.ArgumentTypeError("Invalid filter: expected a comparison after {c} but found {f}.".format(c=column, f=operator))
+        parameters.append(filter_value(column, take()))
+        return "{c} {o} ?".format(c=column, o="!=" if operator == "<>" else operator)
+
+    if len(tokens) == 0:
+        raise argparse.ArgumentTypeError("Invalid filter: the filter is empty.")
+    sql = parse_or()
+    if position != len(tokens):
+        raise argparse.ArgumentTypeError("Invalid filter: could not understand \"{t}\".".format(t=tokens[position][1]))
+    return MenuFilter(sql, tuple(parameters), text)
+
+def check_filter(filter, db=None):
+    """Checks whether the filter input by the user is in the right format, and compiles it.
+
+    Args:
+        filter(string): Filter provided by the user, e.g. "drumlin_rating >= 4 AND cuisine = 'Thai'" (see the grammar above).
+        db (sqlite3.Cursor, optional): Cursor to read the menu columns with. Defaults to the module-level cursor.
+    
+    Raises:
+        ArgumentTypeError if the filter cannot be parsed, if the variable is not in the menu, or if the comparison value is not in the correct format for that variable.
+    
+    Returns:
+        MenuFilter: The filter as a parameterized SQL condition and its values.
+    """
+    if db is None:
+        open_database()
+    return compile_filter(filter.strip(), menu_columns(db))
+
+def check_order(order, db=None):
+    """Checks whether the order input by the user is in the right format.
+
+    Args:
+        order (str): One or more comma-separated "column [ASC|DESC]" pairs (e.g. "last_made DESC, name ASC").
+        db (sqlite3.Cursor, optional): Cursor to read the menu columns with. Defaults to the module-level cursor.
+
+    Raises:
+        ArgumentTypeError if a column is not in the menu or a direction is not ASC or DESC.
+
+    Returns:
+        sql_query: Order statement organized as an SQL query.
+    """
+    if db is None:
+        open_database()
+    valid_columns = menu_columns(db)
+    order_query = []
+    for part in order.split(","):
+        parts_of_query = part.split()
+        if not 1 <= len(parts_of_query) <= 2:
+            raise argparse.ArgumentTypeError("--order argument must be one column, optionally followed by ASC or DESC (separate several with commas).")
+        col_name = parts_of_query[0]
+        direction = parts_of_query[1].upper() if len(parts_of_query) == 2 else "ASC"
+        # Check variable
+        if col_name not in valid_columns:
+            raise argparse.ArgumentTypeError("Invalid ORDER BY statement: the column {c} does not exist in the menu table.".format(c=col_name))
+        # Check direction
+        if direction not in ["ASC", "DESC"]:
+            raise argparse.ArgumentTypeError("Invalid ORDER BY statement: direction must be one of ASC or DESC.")
+        order_query.append(col_name + " " + direction)
+    return ", ".join(order_query)
+
+def check_limit(limit):
+    """_summary_
+
+    Args:
+        limit (_type_): _description_
+
+    Returns:
         _type_: _description_
     """
     try:
@@ -876,35 +2185,40 @@ def check_ingredients_input(ingredients_args):
     path = ingredients_args[1]
 
     # Check that the recipe exists in the menu
-    sql_query = "SELECT id FROM menu WHERE name="
-    sql_query += "'" + name + "'"
-
-    cursor.execute(sql_query)
+    cursor.execute("SELECT id FROM menu WHERE name=?", (name,))
     try:
         id = cursor.fetchall()[0][0]
     except IndexError:
-        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu. Please use --new to add it to the menu before adding its ingredients.".format(r=name))
+        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu.{s} Please use --new to add it to the menu before adding its ingredients.".format(r=name, s=did_you_mean(name)))
 
     # Now check CSV
-    req_headers = ['ingredient', 'quantity', 'units', 'prepmethod']
-    found_headers = []
     try:
         with open(path, newline='') as csvfile:
             csv_reader = csv.reader(csvfile)
             headers = next(csv_reader)
-            if len(headers) != 4:
-                raise argparse.ArgumentTypeError("Error: The ingredients file does not have the correct amount of headers. Please ensure the csv file contains the headers 'ingredient', 'quantity', 'units', and 'prepmethod'.")
-            for i in range(0,4):
-                h = headers[i]
-                if h in req_headers:
-                    found_headers.append(h)
-                else:
-                    raise argparse.ArgumentTypeError("Error: One or more of the headers in the ingredients file is incorrect. Please ensure the csv file contains the headers 'ingredient', 'quantity', 'units', and 'prepmethod'.")
+            error = check_ingredients_headers(headers)
+            if error:
+                raise argparse.ArgumentTypeError(error)
     except FileNotFoundError:
         raise argparse.ArgumentTypeError("Error: The file containing the ingredients was not found. Please enter the path to the csv file containing the recipe.")
 
     return id, path
 
+def check_ingredients_headers(headers):
+    """Checks the header row of an ingredients .csv: exactly the columns 'ingredient', 'quantity', 'units', and 'prepmethod', in any order.
+
+    Args:
+        headers (list): The first row of the .csv file.
+
+    Returns:
+        str: The error, or an empty string if the headers are correct.
+    """
+    if len(headers) != 4:
+        return "Error: The ingredients file does not have the correct amount of headers. Please ensure the csv file contains the headers 'ingredient', 'quantity', 'units', and 'prepmethod'."
+    if sorted(headers) != ['ingredient', 'prepmethod', 'quantity', 'units']:
+        return "Error: One or more of the headers in the ingredients file is incorrect. Please ensure the csv file contains the headers 'ingredient', 'quantity', 'units', and 'prepmethod'."
+    return ""
+
 def check_instructions_input(instruction_args):
     """Checks whether a recipe name exists in the menu, and whether the .txt file opens and is not empty.
 
@@ -919,14 +2233,11 @@ def check_instructions_input(instruction_args):
     path = instruction_args[1]
     
     # Check that the recipe exists in the menu
-    sql_query = "SELECT id FROM menu WHERE name="
-    sql_query += "'" + name.lower().title() + "'"
-
-    cursor.execute(sql_query)
+    cursor.execute("SELECT id FROM menu WHERE name=?", (name.lower().title(),))
     try:
         id = cursor.fetchall()[0][0]
     except IndexError:
-        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu. Please use --new to add it to the menu before adding its instructions.".format(r=name))
+        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu.{s} Please use --new to add it to the menu before adding its instructions.".format(r=name, s=did_you_mean(name)))
 
     # Now check CSV
     try:
@@ -958,14 +2269,11 @@ def check_mealplan_input(mealplan_args):
         raise argparse.ArgumentTypeError("Error: The week day is not a day of the week. Please try again.")
 
     # Check Recipe Exists
-    sql_query = "SELECT id FROM menu WHERE name="
-    sql_query += "'" + name + "'"
-
     try:
-        cursor.execute(sql_query)
+        cursor.execute("SELECT id FROM menu WHERE name=?", (name,))
         id = cursor.fetchall()[0][0]
     except IndexError:
-        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu. Please use --new to add it to the menu before adding it to the meal plan.".format(r=name))
+        raise argparse.ArgumentTypeError("Error: The recipe {r} does not exist in the menu.{s} Please use --new to add it to the menu before adding it to the meal plan.".format(r=name, s=did_you_mean(name)))
 
     return weekday, id
 
@@ -979,7 +2287,494 @@ def safe_str(value):
         A string (either the value or an empty string)
     """
     return str(value) if value is not None else ''
-    
+
+def resolve_format(requested):
+    """Picks the output format of a read command.
+
+    Args:
+        requested (str): The --format argument, or None.
+
+    Returns:
+        str: The requested format, or "grid" on a terminal and PIPED_OUTPUT_FORMAT otherwise.
+    """
+    if requested != None:
+        return requested
+    return "grid" if sys.stdout.isatty() else PIPED_OUTPUT_FORMAT
+
+def write_rows(rows, headers, output, files=None):
+    """Writes rows as csv, tsv, json (one array), or jsonl (one object per line), one row at a time as they are read.
+
+    Args:
+        rows (iterable): Tuples of values, e.g. a cursor. Values that are lists or dictionaries are only kept as such in json and jsonl.
+        headers (list): Column names (the keys of the json objects).
+        output (str): One of "csv", "tsv", "json", or "jsonl".
+        files (list, optional): Files to write to. Defaults to the console.
+
+    Returns:
+        int: The number of rows written.
+    """
+    files = files or [sys.stdout]
+    count = 0
+    if output in ("csv", "tsv"):
+        writers = [csv.writer(file, delimiter="\t" if output == "tsv" else ",", lineterminator="\n") for file in files]
+        for writer in writers:
+            writer.writerow(headers)
+        for row in rows:
+            for writer in writers:
+                writer.writerow(row)
+            count += 1
+        return count
+    import json
+    for row in rows:
+        line = json.dumps(dict(zip(headers, row)), ensure_ascii=False, default=str)
+        for file in files:
+            if output == "jsonl":
+                file.write(line + "\n")
+            else:
+                file.write(("[" if count == 0 else ",\n ") + line)
+        count += 1
+    if output == "json":
+        for file in files:
+            file.write(("[" if count == 0 else "") + "]\n")
+    return count
+
+def parse_ingredients_file(path):
+    """Reads and validates an ingredients .csv without touching the database.
+
+    Args:
+        path (str): Path to the .csv file with the columns 'ingredient', 'quantity', 'units', and 'prepmethod'.
+
+    Returns:
+        True, an empty string, and a list of (ingredient, quantity, unit, prepmethod) tuples if the headers and every row are valid.
+        False, an error message, and an empty list if the headers or any row are invalid.
+    """
+    ingredient_rows = []
+    try:
+        with open(path, newline='') as csvfile:
+            recipe = csv.reader(csvfile)
+            headers = next(recipe)
+            # Without the right header row, the columns can't be told apart (and a missing one would swallow the first ingredient)
+            error = check_ingredients_headers(headers)
+            if error:
+                return False, error, []
+            column = {h: i for i, h in enumerate(headers)}
+            for ingredient in recipe:
+                if len(ingredient) == 0:
+                    continue
+                try:
+                    name = ingredient[column['ingredient']].strip()
+                    quantity = ingredient[column['quantity']]
+                    unit = ingredient[column['units']].strip()
+                    prepmethod = ingredient[column['prepmethod']].strip()
+                except IndexError:
+                    return False, "One or more of the rows in the .csv file is missing a column. Please check the .csv file and then try again.", []
+                if name == "":
+                    return False, "One or more of the ingredients is missing a name. Please check the .csv file and then try again.", []
+                # Ensure quantity is a number
+                try:
+                    quantity = float(quantity)
+                except ValueError:
+                    return False, "One or more of the ingredients has a non-numerical quantity. Please check the .csv file and then try again.", []
+                ingredient_rows.append((name.lower().title(), quantity, unit.lower().title() or None, prepmethod.lower().title() or None))
+    except FileNotFoundError:
+        return False, "Error: The file containing the recipe was not found. Please enter the path to the csv file containing the recipe.", []
+    except (csv.Error, StopIteration, UnicodeDecodeError):
+        return False, "Error: The file containing the recipe could not be read. Please fix the file and try again.", []
+    return True, "", ingredient_rows
+
+def parse_instructions_file(path):
+    """Reads an instructions .txt without touching the database.
+
+    Args:
+        path (str): Path to the .txt file. Each instruction should be on a new line.
+
+    Returns:
+        True, an empty string, and the list of instructions if the file was read.
+        False, an error message, and an empty list if the file could not be read.
+    """
+    try:
+        with open(path) as instruction_list:
+            instructions = [instruction.rstrip("\n") for instruction in instruction_list]
+    except FileNotFoundError:
+        return False, "Error: The file containing the instructions was not found. Please enter the path to the .txt file containing the instructions.", []
+    except UnicodeDecodeError:
+        return False, "Error: The file containing the instructions could not be read. Please fix the file and try again.", []
+    return True, "", instructions
+
+def load_lookup(table, name_column, id_column, names=None):
+    """Loads a lookup table (ingredients, units, or prepmethod) into a dictionary.
+
+    Args:
+        table (str): Name of the lookup table.
+        name_column (str): Column holding the name.
+        id_column (str): Column holding the ID number.
+        names (iterable, optional): Only load these names. Loads the whole table if None.
+
+    Returns:
+        dict: Maps each name to its ID number.
+    """
+    query = "SELECT {n}, {i} FROM {t}".format(n=name_column, i=id_column, t=table)
+    if names is None:
+        cursor.execute(query)
+        return dict(cursor.fetchall())
+    names = list(names)
+    lookup = {}
+    # Stay well under SQLite's bound-variable limit
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        cursor.execute(query + " WHERE {n} IN ({p})".format(n=name_column, p=", ".join(['?'] * len(chunk))), chunk)
+        lookup.update(cursor.fetchall())
+    return lookup
+
+def resolve_new_ingredients(ingredient_names):
+    """Finds the grocery location of every ingredient that is not in the ingredients table yet.
+
+    Args:
+        ingredient_names (iterable): Ingredient names, in title case.
+
+    Returns:
+        dict: Maps each new ingredient name to its aisle. Ingredients that could not be found are "Unknown" and can be retried later with --resolve-aisles.
+    """
+    ingredient_names = set(ingredient_names)
+    existing = load_lookup('ingredients', 'ingredient_name', 'ingredient_id', ingredient_names)
+    new_ingredients = sorted(ingredient_names - existing.keys())
+    aisles = find_grocery_locations(name.lower() for name in new_ingredients)
+    return {name: aisles[name.lower()] for name in new_ingredients}
+
+def ingest_ingredients(recipes, aisles=None):
+    """Bulk-writes parsed ingredient rows for one or more recipes.
+    Does not commit: the caller is expected to wrap this in a transaction (e.g. "with connection:").
+
+    Args:
+        recipes (dict): Maps recipe IDs to lists of (ingredient, quantity, unit, prepmethod) tuples from parse_ingredients_file.
+        aisles (dict, optional): Pre-resolved aisles for new ingredients (output from resolve_new_ingredients). Missing ones are stored as "Unknown" so no scraping happens inside the transaction.
+    """
+    if aisles is None:
+        aisles = {}
+    all_rows = [row for rows in recipes.values() for row in rows]
+    # Resolve IDs from in-memory maps, loaded once
+    ingredient_names = {row[0] for row in all_rows}
+    unit_names = {row[2] for row in all_rows if row[2] is not None}
+    prep_names = {row[3] for row in all_rows if row[3] is not None}
+    ingredient_ids = load_lookup('ingredients', 'ingredient_name', 'ingredient_id', ingredient_names)
+    unit_ids = load_lookup('units', 'unit_name', 'unit_id', unit_names)
+    prep_ids = load_lookup('prepmethod', 'prepmethod_name', 'prepmethod_id', prep_names)
+    # Create any missing lookup rows
+    new_ingredients = sorted(ingredient_names - ingredient_ids.keys())
+    if new_ingredients:
+        new_rows = [(name, aisles.get(name, "Unknown")) for name in new_ingredients]
+        cursor.executemany("INSERT INTO ingredients (ingredient_name, grocery_location) VALUES (?,?)", new_rows)
+        ingredient_ids.update(load_lookup('ingredients', 'ingredient_name', 'ingredient_id', new_ingredients))
+    new_units = sorted(unit_names - unit_ids.keys())
+    if new_units:
+        cursor.executemany("INSERT INTO units (unit_name) VALUES (?)", [(name,) for name in new_units])
+        unit_ids.update(load_lookup('units', 'unit_name', 'unit_id', new_units))
+    new_preps = sorted(prep_names - prep_ids.keys())
+    if new_preps:
+        cursor.executemany("INSERT INTO prepmethod (prepmethod_name) VALUES (?)", [(name,) for name in new_preps])
+        prep_ids.update(load_lookup('prepmethod', 'prepmethod_name', 'prepmethod_id', new_preps))
+    # Make the lines in the recipe_ingredients table
+    rec_ing_rows = [
+        (recipe_id, ingredient_ids[name], quantity, unit_ids.get(unit), prep_ids.get(prep))
+        for recipe_id, rows in recipes.items()
+        for name, quantity, unit, prep in rows
+    ]
+    cursor.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity, unit_id, prepmethod_id) VALUES (?, ?, ?, ?, ?)", rec_ing_rows)
+
+def ingest_instructions(recipes):
+    """Bulk-writes instructions for one or more recipes.
+    Does not commit: the caller is expected to wrap this in a transaction (e.g. "with connection:").
+
+    Args:
+        recipes (dict): Maps recipe IDs to lists of instructions from parse_instructions_file.
+    """
+    rows = [(recipe_id, instruction) for recipe_id, instructions in recipes.items() for instruction in instructions]
+    cursor.executemany('INSERT INTO instructions (recipe_id, instruction) VALUES (?, ?)', rows)
+
+def parse_recipe_files(paths):
+    """Parses and validates one recipe's files for --import-dir. Runs in a worker process, so it never touches the database.
+
+    Args:
+        paths (tuple): The recipe name, the path to its .csv, and the path to its .txt (or None).
+
+    Returns:
+        tuple: The recipe name, whether both files are valid, the error (or an empty string), the ingredient rows, and the instructions.
+    """
+    name, csv_path, txt_path = paths
+    valid, error, ingredient_rows = parse_ingredients_file(csv_path)
+    if valid and len(ingredient_rows) == 0:
+        valid, error = False, "The ingredients file has no ingredients."
+    instructions = []
+    if valid and txt_path is not None:
+        valid, error, instructions = parse_instructions_file(txt_path)
+    return name, valid, error, ingredient_rows, instructions
+
+def import_directory(args, **kwargs):
+    """Imports every recipe in a directory: each name.csv (ingredients) with its optional name.txt (instructions).
+    Files are parsed and validated in a process pool, new ingredients' aisles are looked up concurrently, and then everything
+    is written by this process in a single transaction. Recipes that already have ingredients in the database are skipped.
+
+    Args:
+        args (dict): Contains --import-dir, which contains the path to the directory.
+
+    Returns:
+        True and an empty string if the import finished (even if some recipes were skipped).
+        False and an error string if the directory could not be read or the database write failed (nothing is imported).
+    """
+    start = time.perf_counter()
+    directory = args['import_dir']
+    try:
+        file_names = os.listdir(directory)
+    except OSError as e:
+        return False, "The directory {d} could not be read ({e}).".format(d=directory, e=e.strerror)
+    stems = {os.path.splitext(file_name)[0] for file_name in file_names if file_name.lower().endswith('.csv')}
+    lower_names = {file_name.lower(): file_name for file_name in file_names}
+    jobs = []
+    for stem in sorted(stems):
+        txt_name = lower_names.get(stem.lower() + '.txt')
+        recipe_name = re.sub(r"[_\-]+", " ", stem).strip().lower().title()
+        jobs.append((recipe_name, os.path.join(directory, stem + '.csv'), os.path.join(directory, txt_name) if txt_name else None))
+    if len(jobs) == 0:
+        return False, "No .csv files were found in {d}.".format(d=directory)
+    # Parse & validate
+    if len(jobs) < IMPORT_POOL_THRESHOLD:
+        parsed = [parse_recipe_files(job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor() as pool:
+            parsed = list(pool.map(parse_recipe_files, jobs, chunksize=max(1, len(jobs) // (4 * (os.cpu_count() or 1)))))
+    invalid = [(name, error) for name, valid, error, rows, instructions in parsed if not valid]
+    parsed = [(name, rows, instructions) for name, valid, error, rows, instructions in parsed if valid]
+    # Skip recipes whose ingredients are already in the database
+    existing = load_lookup('menu', 'name', 'id', [name for name, rows, instructions in parsed])
+    already_added = set()
+    if existing:
+        ids = list(existing.values())
+        for start_at in range(0, len(ids), 500):
+            chunk = ids[start_at:start_at + 500]
+            cursor.execute("SELECT DISTINCT recipe_id FROM recipe_ingredients WHERE recipe_id IN ({p})".format(p=", ".join(['?'] * len(chunk))), chunk)
+            already_added.update(row[0] for row in cursor.fetchall())
+    skipped = [name for name, rows, instructions in parsed if existing.get(name) in already_added]
+    to_import = [(name, rows, instructions) for name, rows, instructions in parsed if existing.get(name) not in already_added]
+    canonical_rows = canonicalize_ingredient_rows([rows for name, rows, instructions in to_import], args.get('canonicalize'))
+    to_import = [(name, rows, instructions) for (name, _, instructions), rows in zip(to_import, canonical_rows)]
+    # Look up the aisles for new ingredients before any write lock is taken
+    aisles = resolve_new_ingredients({row[0] for name, rows, instructions in to_import for row in rows})
+    try:
+        with connection:
+            cursor.executemany("INSERT OR IGNORE INTO menu (name) VALUES (?)", [(name,) for name, rows, instructions in to_import])
+            recipe_ids = load_lookup('menu', 'name', 'id', [name for name, rows, instructions in to_import])
+            # Instructions are replaced, since recipes without ingredients may still have old ones
+            cursor.executemany("DELETE FROM instructions WHERE recipe_id=?", [(recipe_ids[name],) for name, rows, instructions in to_import if instructions])
+            ingest_ingredients({recipe_ids[name]: rows for name, rows, instructions in to_import}, aisles)
+            ingest_instructions({recipe_ids[name]: instructions for name, rows, instructions in to_import if instructions})
+    except sqlite3.DatabaseError as e:
+        return False, "The recipes could not be written to the database, so none of them were imported. ({})".format(e)
+    # Summary report
+    print("Imported {n} recipes ({i} ingredients, {s} instructions) from {d} in {t:.2f} s.".format(
+        n=len(to_import), i=sum(len(rows) for name, rows, instructions in to_import), s=sum(len(instructions) for name, rows, instructions in to_import), d=directory, t=time.perf_counter() - start))
+    unknown_aisles = sum(aisle == "Unknown" for aisle in aisles.values())
+    if unknown_aisles:
+        print("{n} new ingredients have an unknown grocery location. Run --resolve-aisles later to retry them.".format(n=unknown_aisles))
+    if skipped:
+        print("Skipped {n} recipes that already have ingredients: {r}".format(n=len(skipped), r=", ".join(skipped)))
+    for name, error in invalid:
+        print("Not imported: {r}: {e}".format(r=name, e=error))
+    return True, ""
+
+def export_database(path, **kwargs):
+    """Writes a snapshot of the whole database to a gzip-compressed JSON Lines file.
+    The first line describes the snapshot; every other line is one row, e.g. {"table": "menu", "row": {"id": 1, "name": "Tacos", ...}}.
+    Rows are streamed from the cursor, so memory use does not grow with the size of the database.
+
+    Args:
+        path (str): Path of the snapshot file (e.g. resippy.jsonl.gz).
+
+    Returns:
+        True and a summary string if the snapshot was written, False and an error string otherwise.
+    """
+    import gzip
+    import json
+    counts = Counter()
+    # Read every table in one transaction, so the snapshot is consistent even if someone writes meanwhile
+    own_transaction = not connection.in_transaction
+    try:
+        if own_transaction:
+            connection.execute("BEGIN")
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            file.write(json.dumps({'format': 'resippy', 'schema_version': SCHEMA_VERSION, 'exported_at': datetime.now().isoformat(timespec='seconds')}) + "\n")
+            for table, key, columns in SNAPSHOT_TABLES:
+                rows = connection.execute("SELECT {c} FROM {t} ORDER BY {k}".format(c=", ".join(columns), t=table, k=key))
+                for row in rows:
+                    file.write(json.dumps({'table': table, 'row': dict(zip(columns, row))}) + "\n")
+                    counts[table] += 1
+    except OSError as e:
+        return False, "The snapshot could not be written to {p} ({e}).".format(p=path, e=e.strerror)
+    finally:
+        if own_transaction and connection.in_transaction:
+            connection.execute("ROLLBACK")
+    return True, "Exported {n} recipes ({r} rows) to {p}.".format(n=counts['menu'], r=sum(counts.values()), p=path)
+
+def import_database(path, **kwargs):
+    """Loads a snapshot written by export_database into the database, in a single transaction.
+    Ids are remapped as the rows stream in: units, prepmethods and ingredients are matched by name, and recipes that are already
+    on the menu (by name) are kept as they are, without their ingredients or instructions from the snapshot. The meal plan is replaced by the snapshot's.
+
+    Args:
+        path (str): Path of the snapshot file.
+
+    Returns:
+        True and a summary string if the snapshot was imported, False and an error string otherwise (nothing is imported).
+    """
+    import gzip
+    import json
+    # Old id -> new id, for each table that other rows refer to
+    id_maps = {'units': {}, 'prepmethod': {}, 'ingredients': {}, 'menu': {}}
+    skipped_recipes = set()
+    counts = Counter()
+    batch = []
+    batch_table = None
+
+    def flush():
+        if not batch:
+            return
+        if batch_table in ('units', 'prepmethod', 'ingredients', 'menu'):
+            table, key, columns = next(entry for entry in SNAPSHOT_TABLES if entry[0] == batch_table)
+            name_column = columns[1]
+            existing = load_lookup(table, name_column, key, [row[name_column] for row in batch])
+            new_rows = [row for row in batch if row[name_column] not in existing]
+            cursor.executemany("INSERT INTO {t} ({c}) VALUES ({p})".format(t=table, c=", ".join(columns[1:]), p=", ".join(['?'] * (len(columns) - 1))),
+                               [[row.get(column) for column in columns[1:]] for row in new_rows])
+            new_ids = load_lookup(table, name_column, key, [row[name_column] for row in new_rows])
+            for row in batch:
+                if row[name_column] in existing:
+                    id_maps[table][row[key]] = existing[row[name_column]]
+                    if table == 'menu':
+                        skipped_recipes.add(row[key])
+                else:
+                    id_maps[table][row[key]] = new_ids[row[name_column]]
+            counts[table] += len(new_rows)
+        elif batch_table == 'recipe_ingredients':
+            rows = [(id_maps['menu'][row['recipe_id']], id_maps['ingredients'][row['ingredient_id']], row['quantity'],
+                     id_maps['units'].get(row['unit_id']), id_maps['prepmethod'].get(row['prepmethod_id']))
+                    for row in batch if row['recipe_id'] not in skipped_recipes]
+            cursor.executemany("INSERT INTO recipe_ingredients (recipe_id, ingredient_id, quantity, unit_id, prepmethod_id) VALUES (?, ?, ?, ?, ?)", rows)
+            counts[batch_table] += len(rows)
+        elif batch_table == 'instructions':
+            rows = [(id_maps['menu'][row['recipe_id']], row['instruction']) for row in batch if row['recipe_id'] not in skipped_recipes]
+            cursor.executemany("INSERT INTO instructions (recipe_id, instruction) VALUES (?, ?)", rows)
+            counts[batch_table] += len(rows)
+        elif batch_table == 'mealplan':
+            rows = [(row['date'], id_maps['menu'].get(row['recipe_id']), row['day']) for row in batch]
+            cursor.executemany("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", rows)
+            counts[batch_table] += len(rows)
+        batch.clear()
+
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            header = json.loads(next(file, 'null'))
+            if not isinstance(header, dict) or header.get('format') != 'resippy':
+                return False, "{p} is not a resippy snapshot.".format(p=path)
+            if header.get('schema_version', 0) > SCHEMA_VERSION:
+                return False, "{p} was exported by a newer version of resippy.".format(p=path)
+            known_tables = [entry[0] for entry in SNAPSHOT_TABLES]
+            with connection:
+                for line_number, line in enumerate(file, start=2):
+                    entry = json.loads(line)
+                    table = entry.get('table')
+                    if table not in known_tables:
+                        raise ValueError("line {n} has an unknown table ({t}).".format(n=line_number, t=table))
+                    if table != batch_table or len(batch) >= SNAPSHOT_BATCH_SIZE:
+                        flush()
+                        batch_table = table
+                    batch.append(entry['row'])
+                flush()
+    except (OSError, EOFError) as e:
+        return False, "{p} could not be read ({e}).".format(p=path, e=e)
+    except (ValueError, KeyError, TypeError) as e:
+        return False, "{p} is not a valid snapshot: {e} Nothing was imported.".format(p=path, e=e)
+    except sqlite3.DatabaseError as e:
+        return False, "The snapshot could not be written to the database, so nothing was imported. ({})".format(e)
+    message = "Imported {n} recipes ({r} ingredients, {i} instructions) from {p}.".format(n=counts['menu'], r=counts['recipe_ingredients'], i=counts['instructions'], p=path)
+    if skipped_recipes:
+        message += " {n} recipes were already on the menu and were left as they are.".format(n=len(skipped_recipes))
+    return True, message
+
+def backup_database(path, **kwargs):
+    """Copies the database to another file while it is in use.
+    The copy is made BACKUP_PAGES_PER_STEP pages at a time, so other roommates can keep reading (and writing) between steps.
+
+    Args:
+        path (str): Path of the backup file. An existing file is overwritten.
+
+    Returns:
+        True and a summary string if the backup was made, False and an error string otherwise.
+    """
+    def progress(status, remaining, total):
+        print("\rBacked up {d} of {t} pages".format(d=total - remaining, t=total), end="", flush=True)
+
+    try:
+        target = sqlite3.connect(path)
+    except sqlite3.Error as e:
+        return False, "{p} could not be opened ({e}).".format(p=path, e=e)
+    try:
+        connection.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress if sys.stdout.isatty() else None)
+    except sqlite3.Error as e:
+        return False, "The backup to {p} failed ({e}).".format(p=path, e=e)
+    finally:
+        target.close()
+        if sys.stdout.isatty():
+            print()
+    return True, "The database has been backed up to {p}.".format(p=path)
+
+def get_http_session():
+    """Returns the shared, connection-pooled HTTP session used for scraping, creating it on first use.
+
+    Returns:
+        requests.Session: Session with timeouts handled by the caller and retry/backoff on connection errors and 429/5xx responses.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(total=SCRAPE_RETRIES, backoff_factor=SCRAPE_BACKOFF, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SCRAPE_WORKERS, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+    return _http_session
+
+def scan_product_categories(chunks, encoding="utf-8", limit=SCRAPE_SAMPLE_PRODUCTS):
+    """Counts the data-product-category-en attributes of the product divs in a search page, chunk by chunk as it arrives.
+    Only the complete tags in each chunk are scanned (the rest is kept for the next one), no tree is built, and scanning stops after limit products.
+
+    Args:
+        chunks (iterable): The page, as bytes.
+        encoding (str): Encoding of the page.
+        limit (int): Number of products to sample.
+
+    Returns:
+        Counter: Maps each category to the number of sampled products in it.
+    """
+    import html
+    categories = Counter()
+    sampled = 0
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        end = buffer.rfind(b">") + 1
+        for match in PRODUCT_CATEGORY_PATTERN.finditer(buffer, 0, end):
+            value = next(group for group in match.groups() if group is not None)
+            categories[html.unescape(value.decode(encoding, "replace"))] += 1
+            sampled += 1
+            if sampled >= limit:
+                return categories
+        buffer = buffer[end:]
+    return categories
+
 def find_grocery_location(ingredient):
     """Uses web scraping to find the aisle categorization Food Basics uses for that ingredient.
 
@@ -987,32 +2782,731 @@ def find_grocery_location(ingredient):
         ingredient (string): The ingredient.
 
     Returns:
-        str: The aisle.
+        str: The aisle, or "Unknown" if it could not be found.
+    """
+    try:
+        with get_http_session().get(GROCERY_SEARCH_URL, params={'filter': ingredient}, timeout=SCRAPE_TIMEOUT, stream=True) as search_results:
+            search_results.raise_for_status()
+            chunks = search_results.iter_content(chunk_size=SCRAPE_CHUNK_SIZE)
+            # requests assumes ISO-8859-1 for text/html without a charset, but the store's pages are UTF-8
+            encoding = search_results.encoding if 'charset' in search_results.headers.get('Content-Type', '').lower() else "utf-8"
+            likely_locations = scan_product_categories(chunks, encoding)
+            # Stop the download here. A page that was read to the end has already given its connection back to the pool;
+            # one that had more products than the sample closes its connection, and the next lookup opens a new one
+            search_results.close()
+        if len(likely_locations) == 0:
+            return "Unknown"
+        return likely_locations.most_common(1)[0][0]
+    except Exception:
+        return "Unknown"
+
+def normalize_search_term(ingredient):
+    """Normalizes an ingredient name into the key used by the aisle cache, so spelling variants share an entry.
+    Lower-cases, drops punctuation, collapses whitespace, and reduces simple plurals (e.g. "Tomatoes" -> "tomato").
+
+    Args:
+        ingredient (str): The ingredient.
+
+    Returns:
+        str: The normalized search term.
+    """
+    words = re.sub(r"[^a-z0-9 ]+", " ", ingredient.lower()).split()
+    normalized = []
+    for word in words:
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("oes"):
+            word = word[:-2]
+        elif len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+            word = word[:-1]
+        normalized.append(word)
+    return " ".join(normalized)
+
+def lookup_aisle_cache(search_terms, include_failures=True):
+    """Looks up unexpired entries in the aisle cache.
+
+    Args:
+        search_terms (iterable): Normalized search terms (output from normalize_search_term).
+        include_failures (bool): Whether unexpired failed lookups (negative entries) count as hits.
+
+    Returns:
+        dict: Maps each cached search term to its aisle ("Unknown" for negative entries).
+    """
+    search_terms = list(search_terms)
+    hits = {}
+    now = time.time()
+    for start in range(0, len(search_terms), 500):
+        chunk = search_terms[start:start + 500]
+        cursor.execute("SELECT search_term, grocery_location, failed FROM aisle_cache WHERE fetched_at + ttl > ? AND search_term IN ({p})".format(p=", ".join(['?'] * len(chunk))), [now] + chunk)
+        for term, location, failed in cursor.fetchall():
+            if failed and not include_failures:
+                continue
+            hits[term] = location
+    return hits
+
+def store_aisle_cache(results):
+    """Stores scraped aisles in the aisle cache, then evicts the oldest entries if the cache is over AISLE_CACHE_MAX_ENTRIES.
+    Failed lookups are stored with the shorter AISLE_CACHE_NEGATIVE_TTL so they are retried sooner.
+
+    Args:
+        results (dict): Maps normalized search terms to aisles ("Unknown" for failed lookups).
+    """
+    if len(results) == 0:
+        return
+    now = time.time()
+    rows = [
+        (term, location, now, AISLE_CACHE_NEGATIVE_TTL if location == "Unknown" else AISLE_CACHE_TTL, int(location == "Unknown"))
+        for term, location in results.items()
+    ]
+    with connection:
+        cursor.executemany("INSERT OR REPLACE INTO aisle_cache (search_term, grocery_location, fetched_at, ttl, failed) VALUES (?, ?, ?, ?, ?)", rows)
+        cursor.execute("SELECT COUNT(*) FROM aisle_cache")
+        overflow = cursor.fetchone()[0] - AISLE_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            cursor.execute("DELETE FROM aisle_cache WHERE search_term IN (SELECT search_term FROM aisle_cache ORDER BY failed DESC, fetched_at ASC LIMIT ?)", (overflow,))
+
+def aisle_features(ingredient):
+    """Splits an ingredient name into the features the aisle classifier uses: its normalized words, and the character trigrams of each word.
+
+    Args:
+        ingredient (str): The ingredient.
+
+    Returns:
+        list: The features, e.g. ["#tomato", "^to", "tom", "oma", "mat", "ato", "to$"] for "Tomatoes".
+    """
+    features = []
+    for word in normalize_search_term(ingredient).split():
+        features.append("#" + word)
+        padded = "^" + word + "$"
+        features.extend(padded[i:i + AISLE_NGRAM] for i in range(max(1, len(padded) - AISLE_NGRAM + 1)))
+    return features
+
+def train_aisle_model(examples, version=None):
+    """Counts the features of every labelled ingredient per aisle.
+
+    Args:
+        examples (iterable): (ingredient name, aisle) pairs.
+        version (int, optional): The aisle_model_state version the examples were read at.
+
+    Returns:
+        AisleModel: version, aisles (aisle -> number of examples), totals (aisle -> number of features), and features (feature -> {aisle: count}).
     """
-    search_url = "https://www.foodbasics.ca/search?filter="
-    if " " in ingredient:
-        ingredient = ingredient.replace(" ", "+")
-    search_url += ingredient
+    aisles = Counter()
+    totals = Counter()
+    features = {}
+    for name, aisle in examples:
+        aisles[aisle] += 1
+        for feature in aisle_features(name):
+            counts = features.setdefault(feature, {})
+            counts[aisle] = counts.get(aisle, 0) + 1
+            totals[aisle] += 1
+    return AisleModel(version, dict(aisles), dict(totals), features)
+
+def aisle_model_path():
+    """Returns the path of the saved aisle classifier: next to the database, e.g. resippy.db.aisles.json."""
+    return DATABASE_PATH + ".aisles.json"
+
+def load_aisle_model():
+    """Returns the aisle classifier for the current ingredients table.
+    Uses the one in memory or the saved one if the aisle labels haven't changed since it was trained, and otherwise retrains and saves it.
+
+    Returns:
+        AisleModel: The classifier.
+    """
+    global _aisle_model
+    import json
+    version = cursor.execute("SELECT version FROM aisle_model_state").fetchone()[0]
+    if _aisle_model is not None and _aisle_model.version == version:
+        return _aisle_model
+    path = aisle_model_path()
+    try:
+        with open(path) as file:
+            saved = AisleModel(**json.load(file))
+        if saved.version == version:
+            _aisle_model = saved
+            return _aisle_model
+    except (OSError, ValueError, TypeError):
+        pass
+    cursor.execute("SELECT ingredient_name, grocery_location FROM ingredients WHERE grocery_location IS NOT NULL AND grocery_location != 'Unknown'")
+    _aisle_model = train_aisle_model(cursor.fetchall(), version)
+    # Write a new file and swap it in, so another process never reads half a model
     try:
-        search_results = requests.get(search_url)
-        search_results.raise_for_status()
-        soup = BeautifulSoup(search_results.content, 'html.parser')
-        products = soup.find_all('div', attrs={'data-product-category-en': True})
-        product_locations = [div['data-product-category-en'] for div in products]
-        if product_locations:
-            likely_locations = {}
-            for location in product_locations:
-                if location not in likely_locations.keys():
-                    likely_locations[location] = 1
+        with open(path + ".tmp", "w") as file:
+            json.dump(_aisle_model._asdict(), file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    return _aisle_model
+
+def predict_aisle(model, ingredient):
+    """Guesses the aisle of an ingredient with the aisle classifier.
+    Only the aisles that have seen one of the ingredient's features are scored feature by feature; the rest share the smoothed baseline.
+
+    Args:
+        model (AisleModel): Output from load_aisle_model.
+        ingredient (str): The ingredient.
+
+    Returns:
+        The most likely aisle and its probability, or (None, 0.0) if the classifier has fewer than AISLE_MIN_EXAMPLES examples.
+    """
+    examples = sum(model.aisles.values())
+    if examples < AISLE_MIN_EXAMPLES:
+        return None, 0.0
+    features = aisle_features(ingredient)
+    vocabulary = len(model.features)
+    scores = {}
+    for aisle, count in model.aisles.items():
+        scores[aisle] = math.log(count / examples) + len(features) * (math.log(AISLE_SMOOTHING) - math.log(model.totals.get(aisle, 0) + AISLE_SMOOTHING * vocabulary))
+    for feature in features:
+        for aisle, count in model.features.get(feature, {}).items():
+            scores[aisle] += math.log(count + AISLE_SMOOTHING) - math.log(AISLE_SMOOTHING)
+    best = max(scores, key=scores.get)
+    total = sum(math.exp(score - scores[best]) for score in scores.values())
+    return best, 1.0 / total
+
+def train_aisles(**kwargs):
+    """Retrains and saves the aisle classifier, and measures how well it does on a fifth of the labelled ingredients held out from training.
+
+    Returns:
+        True and a summary string.
+        False and an error string if there are too few labelled ingredients.
+    """
+    global _aisle_model
+    _aisle_model = None
+    if os.path.exists(aisle_model_path()):
+        os.remove(aisle_model_path())
+    model = load_aisle_model()
+    examples = sorted(cursor.execute("SELECT ingredient_name, grocery_location FROM ingredients WHERE grocery_location IS NOT NULL AND grocery_location != 'Unknown'").fetchall())
+    if len(examples) < AISLE_MIN_EXAMPLES:
+        return False, "Only {n} ingredients have a known grocery location; the aisle classifier needs at least {m}.".format(n=len(examples), m=AISLE_MIN_EXAMPLES)
+    held_out = examples[::5]
+    trial = train_aisle_model(example for number, example in enumerate(examples) if number % 5 != 0)
+    start = time.perf_counter()
+    guesses = [(predict_aisle(trial, name), aisle) for name, aisle in held_out]
+    microseconds = (time.perf_counter() - start) / len(held_out) * 1e6
+    right = sum(guess == aisle for (guess, _), aisle in guesses)
+    confident = [(guess, aisle) for (guess, confidence), aisle in guesses if confidence >= AISLE_CONFIDENCE]
+    confident_right = sum(guess == aisle for guess, aisle in confident)
+    return True, ("Trained the aisle classifier on {n} ingredients in {a} aisles and saved it to {p}.\n"
+                  "On {h} held-out ingredients it guessed right {r:.0%} of the time ({us:.0f} µs per guess). "
+                  "{c:.0%} of its guesses were confident enough to skip scraping, and {cr:.0%} of those were right.").format(
+        n=len(examples), a=len(model.aisles), p=aisle_model_path(), h=len(held_out), r=right / len(held_out), us=microseconds,
+        c=len(confident) / len(held_out), cr=confident_right / len(confident) if confident else 0)
+
+def find_grocery_locations(ingredients, use_negative_cache=True, use_classifier=True):
+    """Finds the aisles for several ingredients at once.
+    Answers from the aisle cache where possible, then from the aisle classifier where it is confident (or always, offline),
+    and scrapes the rest through a bounded thread pool over the shared HTTP session.
+
+    Args:
+        ingredients (iterable): The ingredients.
+        use_negative_cache (bool): Whether recent failed lookups are trusted (True) or retried (False).
+        use_classifier (bool): Whether the aisle classifier's guesses may be used instead of scraping.
+
+    Returns:
+        dict: Maps each ingredient to its aisle ("Unknown" if it could not be found).
+    """
+    ingredients = list(dict.fromkeys(ingredients))
+    if len(ingredients) == 0:
+        return {}
+    terms = {ingredient: normalize_search_term(ingredient) for ingredient in ingredients}
+    aisles = lookup_aisle_cache(set(terms.values()), include_failures=use_negative_cache)
+    to_fetch = sorted(set(terms.values()) - aisles.keys())
+    if len(to_fetch) > 0 and (use_classifier or OFFLINE):
+        model = load_aisle_model()
+        for term in to_fetch:
+            aisle, confidence = predict_aisle(model, term)
+            if aisle is not None and (confidence >= AISLE_CONFIDENCE or OFFLINE):
+                aisles[term] = aisle
+        to_fetch = [term for term in to_fetch if term not in aisles]
+    if OFFLINE:
+        aisles.update((term, "Unknown") for term in to_fetch)
+        to_fetch = []
+    with profile_phase("scraping"):
+        if len(to_fetch) == 1:
+            fetched = {to_fetch[0]: find_grocery_location(to_fetch[0])}
+        elif len(to_fetch) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(SCRAPE_WORKERS, len(to_fetch))) as pool:
+                fetched = dict(zip(to_fetch, pool.map(find_grocery_location, to_fetch)))
+        else:
+            fetched = {}
+    store_aisle_cache(fetched)
+    aisles.update(fetched)
+    return {ingredient: aisles[terms[ingredient]] for ingredient in ingredients}
+
+def resolve_unknown_aisles(**kwargs):
+    """Retries the aisle lookup for every ingredient whose grocery location is still "Unknown".
+
+    Returns:
+        True and a summary string once the lookups are done.
+    """
+    cursor.execute("SELECT ingredient_id, ingredient_name FROM ingredients WHERE grocery_location IS NULL OR grocery_location='Unknown'")
+    unknown = cursor.fetchall()
+    if len(unknown) == 0:
+        return True, "Every ingredient already has a grocery location."
+    aisles = find_grocery_locations((name.lower() for _, name in unknown), use_negative_cache=False)
+    updates = [(aisles[name.lower()], ingredient_id) for ingredient_id, name in unknown if aisles[name.lower()] != "Unknown"]
+    with connection:
+        cursor.executemany("UPDATE ingredients SET grocery_location=? WHERE ingredient_id=?", updates)
+    return True, "Found the grocery location for {f} of {t} ingredients.".format(f=len(updates), t=len(unknown))
+
+def print_aisle_cache(**kwargs):
+    """Prints the contents of the aisle cache to the console, along with a summary line."""
+    now = time.time()
+    cursor.execute("SELECT search_term, grocery_location, fetched_at, fetched_at + ttl, failed FROM aisle_cache ORDER BY search_term")
+    entries = []
+    expired = 0
+    failures = 0
+    for term, location, fetched_at, expires_at, failed in cursor.fetchall():
+        status = "Expired" if expires_at <= now else ("Failed" if failed else "OK")
+        expired += status == "Expired"
+        failures += bool(failed)
+        entries.append([term, location, datetime.fromtimestamp(fetched_at).strftime('%Y-%m-%d %H:%M'), datetime.fromtimestamp(expires_at).strftime('%Y-%m-%d %H:%M'), status])
+    if len(entries) == 0:
+        print("The aisle cache is empty.")
+        return
+    console_width = shutil.get_terminal_size().columns
+    headers = ["Search Term", "Aisle", "Fetched", "Expires", "Status"]
+    num_columns = len(headers)
+    max_col_width = (console_width - (num_columns+1)) // num_columns
+    from tabulate import tabulate
+    with profile_phase("rendering"):
+        print(tabulate(entries, headers=headers, tablefmt="grid", maxcolwidths=[max_col_width] * num_columns))
+    print("{n} entries ({f} failed lookups, {e} expired). Maximum size: {m}.".format(n=len(entries), f=failures, e=expired, m=AISLE_CACHE_MAX_ENTRIES))
+
+def warm_aisle_cache(terms=None, **kwargs):
+    """Fills the aisle cache ahead of an import.
+    Known grocery locations from the ingredients table are copied in without any network calls, then the given terms (or every expired entry) are looked up.
+
+    Args:
+        terms (list, optional): Ingredient names to look up. If empty, expired entries are refreshed instead.
+
+    Returns:
+        True and a summary string.
+    """
+    cursor.execute("SELECT ingredient_name, grocery_location FROM ingredients WHERE grocery_location IS NOT NULL AND grocery_location != 'Unknown'")
+    known = {normalize_search_term(name): location for name, location in cursor.fetchall()}
+    missing = set(known) - lookup_aisle_cache(known.keys()).keys()
+    store_aisle_cache({term: known[term] for term in missing})
+    if not terms:
+        cursor.execute("SELECT search_term FROM aisle_cache WHERE fetched_at + ttl <= ?", (time.time(),))
+        terms = [row[0] for row in cursor.fetchall()]
+    aisles = find_grocery_locations(terms, use_classifier=False)
+    found = sum(location != "Unknown" for location in aisles.values())
+    return True, "Seeded {s} entries from the ingredients table and looked up {t} terms ({f} found).".format(s=len(missing), t=len(aisles), f=found)
+
+def purge_aisle_cache(which="expired", **kwargs):
+    """Removes entries from the aisle cache.
+
+    Args:
+        which (str): "expired" for expired entries only, "failed" for failed lookups, or "all" to empty the cache.
+
+    Returns:
+        True and a summary string.
+    """
+    with connection:
+        if which == "all":
+            cursor.execute("DELETE FROM aisle_cache")
+        elif which == "failed":
+            cursor.execute("DELETE FROM aisle_cache WHERE failed=1")
+        else:
+            cursor.execute("DELETE FROM aisle_cache WHERE fetched_at + ttl <= ?", (time.time(),))
+        removed = cursor.rowcount
+    return True, "Removed {n} entries from the aisle cache.".format(n=removed)
+
+# Profiling
+# --profile times every SQL statement (grouped by its normalized text) and the main phases of a command, and prints a summary to stderr.
+# Statements are counted by the connection's trace callback, which also sees trigger bodies and the implicit BEGIN/COMMITs,
+# and timed by ProfilingCursor, which covers both executing a statement and fetching its rows.
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bNULL\b")
+SQL_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+
+def normalize_sql(sql):
+    """Normalizes an SQL statement for grouping: literals become ?, lists of ? become "?, ...", and whitespace is collapsed."""
+    sql = SQL_LITERALS.sub("?", sql)
+    sql = SQL_PLACEHOLDER_LISTS.sub("?, ...", sql)
+    return " ".join(sql.split())
+
+def start_profiling(slow_ms=None, validation_seconds=0.0):
+    """Turns on profiling for the rest of the run.
+
+    Args:
+        slow_ms (float, optional): Statements that take longer than this many milliseconds are logged with their query plan.
+        validation_seconds (float): Time already spent parsing and validating the arguments.
+    """
+    global _profile, cursor
+    _profile = {
+        "start": time.perf_counter() - validation_seconds,
+        "phases": Counter({"argument validation": validation_seconds}),
+        "calls": Counter(),
+        "timings": {},
+        "slow_ms": slow_ms,
+        "slow": [],
+    }
+    ResippyConnection.cursor_factory = ProfilingCursor
+    # The arguments may already have opened the database (e.g. to check --filter)
+    if connection is not None:
+        connection.set_trace_callback(trace_statement)
+        cursor = connection.cursor()
+
+def trace_statement(sql):
+    """Trace callback: counts every statement SQLite runs."""
+    with _profile_lock:
+        _profile["calls"][normalize_sql(sql)] += 1
+
+def add_phase_time(phase, seconds):
+    """Adds time to one of the phases in the --profile summary."""
+    with _profile_lock:
+        _profile["phases"][phase] += seconds
+
+@contextmanager
+def profile_phase(phase):
+    """Times the body of a with statement as part of a --profile phase. Does nothing unless profiling."""
+    if _profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(phase, time.perf_counter() - start)
+
+class ProfilingCursor(sqlite3.Cursor):
+    """
+    Cursor that times every statement for --profile: executing it and fetching its rows.
+    Statements slower than the --slow-query threshold are logged, once each time they run.
+    """
+    statement = None
+
+    def timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.add_time(time.perf_counter() - start)
+
+    def add_time(self, seconds):
+        if self.statement is None:
+            return
+        self.statement["ms"] += seconds * 1000
+        with _profile_lock:
+            timing = _profile["timings"].setdefault(self.statement["key"], {"ms": 0.0, "max_ms": 0.0, "executions": 0})
+            timing["ms"] += seconds * 1000
+            timing["max_ms"] = max(timing["max_ms"], self.statement["ms"])
+            if _profile["slow_ms"] is not None and self.statement["ms"] > _profile["slow_ms"] and not self.statement["logged"]:
+                self.statement["logged"] = True
+                _profile["slow"].append(self.statement)
+
+    def start(self, sql, parameters):
+        self.statement = {"key": normalize_sql(sql), "sql": sql, "parameters": parameters, "ms": 0.0, "logged": False}
+        with _profile_lock:
+            _profile["timings"].setdefault(self.statement["key"], {"ms": 0.0, "max_ms": 0.0, "executions": 0})["executions"] += 1
+
+    def execute(self, sql, parameters=()):
+        self.start(sql, parameters)
+        return self.timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Keep the first set of parameters for the query plan, without reading the rest of a generator
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        self.start(sql, first)
+        return self.timed(super().executemany, sql, chain([first], seq_of_parameters) if first is not None else [])
+
+    def fetchone(self):
+        return self.timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self.timed(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self.timed(super().fetchall)
+
+    def __next__(self):
+        return self.timed(super().__next__)
+
+def profile_report(output="table"):
+    """Prints the --profile summary to stderr.
+
+    Args:
+        output (str): "table" for readable tables, or "json".
+    """
+    total_ms = (time.perf_counter() - _profile["start"]) * 1000
+    phases = {phase: seconds * 1000 for phase, seconds in _profile["phases"].items()}
+    phases["other"] = max(0.0, total_ms - sum(phases.values()))
+    statements = []
+    for key in set(_profile["calls"]) | set(_profile["timings"]):
+        timing = _profile["timings"].get(key, {"ms": 0.0, "max_ms": 0.0, "executions": 0})
+        statements.append({"sql": key, "calls": max(_profile["calls"][key], timing["executions"]), "total_ms": round(timing["ms"], 3), "max_ms": round(timing["max_ms"], 3)})
+    statements.sort(key=lambda statement: (-statement["total_ms"], -statement["calls"]))
+    slow = []
+    if _profile["slow"]:
+        plan_cursor = connection.cursor(sqlite3.Cursor)
+        for statement in _profile["slow"]:
+            try:
+                plan = [row[3] for row in plan_cursor.execute("EXPLAIN QUERY PLAN " + statement["sql"], statement["parameters"] or ())]
+            except (sqlite3.Error, ValueError) as e:
+                plan = ["(no query plan: {})".format(e)]
+            slow.append({"sql": " ".join(statement["sql"].split()), "ms": round(statement["ms"], 3), "plan": plan})
+    if output == "json":
+        import json
+        report = {
+            "total_ms": round(total_ms, 3),
+            "phases": {phase: round(ms, 3) for phase, ms in phases.items()},
+            "statements": statements,
+            "slow_queries": slow,
+        }
+        print(json.dumps(report, indent=2), file=sys.stderr)
+        return
+    from tabulate import tabulate
+    print("\nPROFILE: {t:.1f} ms in total, {n} SQL statements".format(t=total_ms, n=sum(statement["calls"] for statement in statements)), file=sys.stderr)
+    print(tabulate([(phase, round(ms, 2), "{:.0%}".format(ms / total_ms if total_ms else 0)) for phase, ms in phases.items()], headers=["Phase", "ms", "Share"], tablefmt="simple"), file=sys.stderr)
+    print(file=sys.stderr)
+    rows = [(statement["sql"][:90], statement["calls"], statement["total_ms"], statement["max_ms"]) for statement in statements[:PROFILE_TOP_STATEMENTS]]
+    print(tabulate(rows, headers=["Statement", "Calls", "Total ms", "Max ms"], tablefmt="simple"), file=sys.stderr)
+    for statement in slow:
+        print("\nSLOW QUERY ({ms} ms): {sql}".format(**statement), file=sys.stderr)
+        for step in statement["plan"]:
+            print("    " + step, file=sys.stderr)
+
+# HTTP API
+# Endpoints (JSON in, JSON out):
+#   GET   /menu?filter=...&order=...&limit=...   the menu, like --viewmenu
+#   GET   /recipes/NAME                           one recipe, like --printrecipe
+#   GET   /mealplan                               the meal plan, like --printmealplan
+#   GET   /groceries                              the grocery list, like --groceries
+#   POST  /menu          {"name": ..., ...}       add a recipe, like --new
+#   PATCH /menu/NAME     {"ian_rating": 4, ...}   update a recipe, like --update_menu
+# Reads run on a small pool of threads, each with its own connection; writes run one at a time on a single writer thread,
+# which owns the module-level connection. GET responses are cached until PRAGMA data_version says the database has changed.
+def read_cursor():
+    """Returns the read-only cursor of the current API reader thread, opening its connection on first use."""
+    if getattr(_read_local, 'cursor', None) is None:
+        read_connection = sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT)
+        read_connection.execute("PRAGMA query_only=ON")
+        _read_local.cursor = read_connection.cursor()
+    return _read_local.cursor
+
+def recipe_fields(body):
+    """Checks the recipe fields of an API request body, the same way the command line options are checked.
+
+    Args:
+        body (dict): Decoded JSON body.
+
+    Raises:
+        argparse.ArgumentTypeError if a field is unknown, is not a string (or a number, for ratings), or a rating is invalid.
+
+    Returns:
+        dict: The fields, named like the command line options (e.g. "ian_rating"), with the ratings as floats.
+    """
+    fields = {}
+    for key, value in body.items():
+        if key in ("drumlin_rating", "ian_rating", "lina_rating"):
+            # bool is a subclass of int, but true is not a rating
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise argparse.ArgumentTypeError("Invalid rating {r}. Ratings must be numbers between 1 and 5.".format(r=json_text(value)))
+            fields[key] = check_rating(str(value))
+        elif key in ("name", "dish_type", "cuisine", "last_made"):
+            if not isinstance(value, str):
+                raise argparse.ArgumentTypeError("Invalid {k} {v}. It must be a string.".format(k=key, v=json_text(value)))
+            if key != "name":
+                fields[key] = value
+        else:
+            raise argparse.ArgumentTypeError("Unknown field {k}.".format(k=key))
+    return fields
+
+def json_text(value):
+    """Returns a decoded JSON value the way it was written, for error messages (e.g. null instead of None)."""
+    import json
+    return json.dumps(value)
+
+def api_read(path, query):
+    """Answers a GET request of the HTTP API. Runs on a reader thread.
+
+    Args:
+        path (list): The parts of the request path, e.g. ["recipes", "Tacos"].
+        query (dict): The query string parameters.
+
+    Raises:
+        argparse.ArgumentTypeError if a parameter is invalid.
+
+    Returns:
+        The HTTP status and the response (to be encoded as JSON).
+    """
+    db = read_cursor()
+    if path == ["menu"]:
+        args = {
+            'filter': check_filter(query['filter'], db) if 'filter' in query else None,
+            'order': check_order(query['order'], db) if 'order' in query else None,
+            'limit': check_limit(query['limit']) if 'limit' in query else None,
+        }
+        rows = query_menu(args, db)
+        columns = [description[0] for description in rows.description]
+        return 200, {"recipes": [dict(zip(columns, row)) for row in rows]}
+    if len(path) == 2 and path[0] == "recipes":
+        row = db.execute("SELECT id, name FROM menu WHERE name=?", (path[1].lower().title(),)).fetchone()
+        if row is None:
+            return 404, {"error": "{r} was not found in the menu.".format(r=path[1])}
+        recipe = load_recipes([row[0]], db)[row[0]]
+        ingredients = [{"quantity": quantity, "unit": unit, "ingredient": ingredient, "prepmethod": prepmethod} for quantity, unit, ingredient, prepmethod in recipe["ingredients"]]
+        return 200, {"name": row[1], "ingredients": ingredients, "instructions": recipe["instructions"]}
+    if path == ["mealplan"]:
+        return 200, {"mealplan": [{"day": day, "date": date, "recipe": name} for day, date, name in query_mealplan(db)]}
+    if path == ["groceries"]:
+        current_day = datetime.now().strftime('%Y-%m-%d')
+        rows = query_grocery_list(current_day, db)
+        return 200, {"groceries": [{"location": location, "ingredient": ingredient, "unit": unit, "quantity": quantity} for location, ingredient, unit, quantity in rows]}
+    return 404, {"error": "Not found."}
+
+def api_write(method, path, body):
+    """Answers a POST or PATCH request of the HTTP API. Runs on the writer thread, so writes never overlap.
+
+    Args:
+        method (str): "POST" (add a recipe) or "PATCH" (update one).
+        path (list): The parts of the request path, e.g. ["menu", "Tacos"].
+        body (dict): Decoded JSON body.
+
+    Raises:
+        argparse.ArgumentTypeError if a field is invalid.
+
+    Returns:
+        The HTTP status and the response (to be encoded as JSON).
+    """
+    fields = recipe_fields(body)
+    if method == "POST" and path == ["menu"]:
+        name = body.get("name", "").strip()
+        if name == "":
+            return 400, {"error": "Recipe name missing."}
+        if load_lookup('menu', 'name', 'id', [name.lower().title()]):
+            return 409, {"error": "{} is already in the homehold menu.".format(name)}
+        added, error = new_recipe(dict(fields, new=name))
+        return (201, {"name": name.lower().title()}) if added else (400, {"error": error})
+    if method == "PATCH" and len(path) == 2 and path[0] == "menu":
+        if not load_lookup('menu', 'name', 'id', [path[1].lower().title()]):
+            return 404, {"error": "{r} was not found in the menu.".format(r=path[1])}
+        if "name" in body:
+            return 400, {"error": "Recipes can't be renamed. The recipe to update is named in the path."}
+        updated, error = update_menu(dict(fields, update_menu=path[1]))
+        return (200, {"name": path[1].lower().title()}) if updated else (400, {"error": error})
+    return 405, {"error": "Method not allowed."}
+
+def serve(host=None, port=None, **kwargs):
+    """Runs the HTTP API (see the endpoints above) until interrupted with Ctrl-C.
+
+    Args:
+        host (str, optional): Address to listen on. Defaults to SERVE_HOST (every interface, so phones on the home network can connect).
+        port (int, optional): Port to listen on. Defaults to SERVE_PORT.
+    """
+    global connection, cursor
+    import asyncio
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.parse import parse_qsl, unquote, urlsplit
+    host = host or SERVE_HOST
+    port = port or SERVE_PORT
+    # Migrate the schema here, then hand the module-level connection over to the writer thread
+    open_database()
+    connection.close()
+    connection, cursor = None, None
+    writer_pool = ThreadPoolExecutor(max_workers=1, initializer=open_database)
+    reader_pool = ThreadPoolExecutor(max_workers=SERVE_READ_CONNECTIONS)
+    # PRAGMA data_version on this connection changes whenever any other connection (the writer, or another resippy) commits.
+    # It is read on the reader threads, one at a time, so a busy database never blocks the event loop.
+    version_connection = sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    version_lock = threading.Lock()
+    cache = {}
+    cache_version = [None]
+
+    def data_version():
+        with version_lock:
+            return version_connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def read(path, query):
+        """Answers a GET request, along with the data version once it has been read."""
+        status, payload = api_read(path, query)
+        return status, payload, data_version()
+
+    async def respond(method, target, body):
+        loop = asyncio.get_running_loop()
+        url = urlsplit(target)
+        path = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        try:
+            if method == "GET":
+                version = await loop.run_in_executor(reader_pool, data_version)
+                if version != cache_version[0]:
+                    cache.clear()
+                    cache_version[0] = version
+                key = (target, datetime.now().strftime('%Y-%m-%d')) if path[:1] and path[0] in SERVE_DATED_ROUTES else (target, None)
+                if key in cache:
+                    return cache[key]
+                status, payload, read_version = await loop.run_in_executor(reader_pool, read, path, dict(parse_qsl(url.query)))
+                response = status, json.dumps(payload).encode()
+                # Only cache what was read while nothing changed
+                if status == 200 and read_version == version:
+                    cache[key] = response
+                return response
+            if method in ("POST", "PATCH"):
+                fields = json.loads(body or b"{}")
+                if not isinstance(fields, dict):
+                    return 400, json.dumps({"error": "The request body must be a JSON object."}).encode()
+                status, payload = await loop.run_in_executor(writer_pool, api_write, method, path, fields)
+                return status, json.dumps(payload).encode()
+            return 405, json.dumps({"error": "Method not allowed."}).encode()
+        except (argparse.ArgumentTypeError, ValueError) as e:
+            return 400, json.dumps({"error": str(e)}).encode()
+        except sqlite3.Error as e:
+            return 500, json.dumps({"error": str(e)}).encode()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > SERVE_MAX_BODY:
+                    status, payload = 413, json.dumps({"error": "The request body is too large."}).encode()
+                    keep_alive = False
                 else:
-                    likely_locations[location] += 1
-            if len(likely_locations) > 1:
-                most_likely = max(likely_locations, key=likely_locations.get)
-            else:
-                most_likely = list(likely_locations.keys())[0]
-        return most_likely
-    except:
-        return("Unknown")
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await respond(method, target, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write("HTTP/1.1 {s} {r}\r\nContent-Type: application/json\r\nContent-Length: {n}\r\nConnection: {c}\r\n\r\n".format(
+                    s=status, r=HTTP_STATUS[status], n=len(payload), c="keep-alive" if keep_alive else "close").encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            # Malformed request, or the client went away
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, host, port)
+        print("Serving the resippy API on http://{h}:{p}/ (Ctrl-C to stop).".format(h=host, p=port))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader_pool.shutdown()
+        writer_pool.shutdown()
+        version_connection.close()
 
 # I/O Functions
 def create_parser():
@@ -1030,38 +3524,65 @@ def create_parser():
     parser.add_argument('--cuisine', type=str, help="Cuisine the dish is from (e.g., Mexican, Thai).")
     parser.add_argument('--dish_type', type=str, help="Dish type (e.g., pasta, salad, potatoes).")
     parser.add_argument('--viewmenu', action="store_true", help="View the menu.")
-    parser.add_argument('--filter', type=check_filter,  help="Filter you would like to use. Should be formatted as an SQL condition.", metavar="FILTER")
-    parser.add_argument('--order', type=check_order, help="Variable you would like to order the table by (e.g., last_made), as well as ASC or DESC.", metavar="ORDERBY")
+    parser.add_argument('--filter', type=check_filter,  help="Filter you would like to use, e.g. \"drumlin_rating >= 4 AND cuisine = 'Thai'\". Supports =, !=, <, <=, >, >=, LIKE, IN, BETWEEN, IS NULL, AND, OR, NOT, and parentheses.", metavar="FILTER")
+    parser.add_argument('--order', type=check_order, help="Variable you would like to order the table by (e.g., last_made), as well as ASC or DESC. Separate several with commas.", metavar="ORDERBY")
     parser.add_argument('--limit', type=check_limit, help="Number of recipes you would like to limit the output to.")
-    parser.add_argument('--printrecipe', type=str, help="Name of the recipe you would like to see printed.", metavar="RECIPENAME")
+    parser.add_argument('--page', type=check_limit, help="View the menu SIZE recipes at a time, fetching each page only when it is needed.", metavar="SIZE")
+    parser.add_argument('--after', type=int, help="With --viewmenu, start the page after the recipe with this id (printed at the end of the previous page).", metavar="ID")
+    parser.add_argument('--printrecipe', nargs='*', type=str, help="Names of the recipes you would like to see printed. With no names, prints every recipe matching --filter.", metavar="RECIPENAME")
     parser.add_argument('--addingredients', nargs=2, type=str, help="Name of the dish and path to the .csv file containing the recipe. Recipe should be formatted with columns 'ingredient', 'quantity', 'units', and 'prepmethod'.", metavar=('RECIPENAME', 'CSVPATH'))
     parser.add_argument('--addinstructions', nargs=2, type=str, help="Name of the dish and path to the .txt file containing the instructions. Each instruction should be on a new line.", metavar=('RECIPENAME', 'TXTPATH'))
+    parser.add_argument('--canonicalize', action="store_true", help="With --addingredients or --import-dir, use existing ingredients whose names nearly match new ones (e.g. Tomato for Tomatoes) instead of adding duplicates.")
+    parser.add_argument('--import-dir', help="Import every recipe in DIR: each NAME.csv (ingredients) with its optional NAME.txt (instructions). The recipe name comes from the file name (e.g. chickpea_curry.csv -> Chickpea Curry).", metavar="DIR")
+    parser.add_argument('--export', help="Write a snapshot of the whole database to FILE (gzip-compressed JSON Lines).", metavar="FILE")
+    parser.add_argument('--import', dest='import_file', help="Load a snapshot written by --export. Recipes already on the menu are kept as they are.", metavar="FILE")
+    parser.add_argument('--backup', help="Copy the database to FILE without stopping others from using it.", metavar="FILE")
     parser.add_argument('--rating', action="store_true", help="View the rating system.")
     parser.add_argument('--addtomealplan', nargs=2, type=str, help="Day of the week and the recipe you would like to add to the meal plan.", metavar=('WEEKDAY','RECIPENAME'))
+    parser.add_argument('--plan-week', action="store_true", help="Fill the next seven days of the meal plan automatically: no repeats, varied cuisines and dish types, and shared ingredients. Works with --min-rating, --skip-recent, --filter, and --seed.")
+    parser.add_argument('--min-rating', nargs='+', type=check_min_rating, help="With --plan-week, the lowest rating a roommate may have given a planned recipe: one RATING for everyone, or NAME=RATING per roommate (e.g. 3 lina=4).", metavar="RATING")
+    parser.add_argument('--skip-recent', type=int, help="With --plan-week, skip recipes made in the last DAYS days (default: 14).", metavar="DAYS")
     parser.add_argument('--printmealplan', action="store_true", help="View the existing meal plan.")
     parser.add_argument('--groceries', action="store_true", help="Create a grocery list for the meals currently in the meal plan.")
-    parser.add_argument('--save', action="store_true", help="Saves the grocery list into a .txt file.")
-    parser.add_argument('--random', action="store_true", help="Print a random recipe name to the terminal.")
+    parser.add_argument('--diff', action="store_true", help="With --groceries, show what changed since the grocery list was last saved with --save.")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help="Output format of --viewmenu, --printrecipe, --printmealplan, --groceries, and --random (default: grid on a terminal, {p} when piped).".format(p=PIPED_OUTPUT_FORMAT))
+    parser.add_argument('--save', action="store_true", help="Saves the grocery list into a .txt file (or a file in the --format given).")
+    parser.add_argument('--random', nargs='?', const=1, type=check_limit, help="Print K random recipes (default: 1) to the terminal, favouring well-rated recipes that haven't been made recently. Works with --filter.", metavar="K")
+    parser.add_argument('--seed', type=int, help="Seed for --random, to make its suggestions reproducible.")
+    parser.add_argument('--search', type=str, help="Search recipe names, ingredients, and instructions (e.g. chickpea, or '\"air fryer\"' for a phrase). Use --limit to change the number of results (default: 10).", metavar="TERMS")
+    parser.add_argument('--cook-from', nargs='+', help="Rank recipes by how many of their ingredients you have on hand, listing what is missing. Works with --filter and --limit.", metavar="INGREDIENT")
+    parser.add_argument('--resolve-aisles', action="store_true", help="Retry the grocery location lookup for ingredients stored as 'Unknown'. Can be run in the background (e.g. from cron).")
+    parser.add_argument('--train-aisles', action="store_true", help="Retrain the offline aisle classifier on the ingredients table and report how accurate it is.")
+    parser.add_argument('--aisle-cache', action="store_true", help="View the grocery location lookup cache.")
+    parser.add_argument('--warm-aisle-cache', nargs='*', help="Fill the grocery location lookup cache from the ingredients table, then look up the given ingredients (or refresh expired entries).", metavar="INGREDIENT")
+    parser.add_argument('--purge-aisle-cache', nargs='?', const="expired", choices=["expired", "failed", "all"], help="Remove expired entries (default), failed lookups, or all entries from the grocery location lookup cache.")
+    parser.add_argument('--serve', nargs='?', const=SERVE_PORT, type=int, help="Serve the menu, recipes, meal plan, and grocery list as a JSON API on PORT (default: {p}), e.g. for phones on the home network.".format(p=SERVE_PORT), metavar="PORT")
+    parser.add_argument('--host', help="With --serve, the address to listen on (default: every interface).")
+    parser.add_argument('--profile', nargs='?', const="table", choices=["table", "json"], help="Time every SQL statement and each phase of the command (validation, scraping, database writes, rendering), and print a summary (or JSON) to stderr.")
+    parser.add_argument('--slow-query', type=float, help="With --profile, log every statement slower than MS milliseconds, with its query plan.", metavar="MS")
+    parser.add_argument('--batch', help="Run every command in FILE (one set of options per line, e.g. --update_menu Tacos --ian_rating 4) over one connection.", metavar="FILE")
+    parser.add_argument('--commit-every', type=int, default=100, help="With --batch, number of commands to group into one commit (default: 100).", metavar="N")
+    parser.add_argument('--shell', action="store_true", help="Start an interactive resippy session.")
     menu_exclusives = parser.add_mutually_exclusive_group()
     menu_exclusives.add_argument('--new', help="Name of the recipe you would like to add to the menu", metavar="RECIPENAME")
     menu_exclusives.add_argument('--update_menu', help="Name of the recipe you would like to update in the menu", metavar="RECIPENAME")
     menu_exclusives.add_argument('--del_recipe', help="Name of the recipe you would like to delete from the menu", metavar="RECIPENAME")
     return parser
 
-def exit_handler():
+def run_command(args):
     """
-    Closes the SQL connection when the program is exited or otherwise ends.
-    """
-    connection.close()
+    Runs the actions requested by one set of parsed arguments.
 
-if __name__ == "__main__":
-    # Set up parser & exit handler
-    parser = create_parser()
-    args = parser.parse_args()
-    # Get Database
-    setup_database(cursor, connection)
-    # Set up exit handler
-    atexit.register(exit_handler)
+    Args:
+        args (argparse.Namespace): Output from create_parser().parse_args().
+
+    Returns:
+        True if every requested action succeeded, False if any of them reported an error.
+    """
+    succeeded = True
+    # Get Database (only if a command other than --rating needs it)
+    if any(value not in (None, False) for key, value in vars(args).items() if key not in ('rating', 'batch', 'shell', 'commit_every', 'profile', 'slow_query')):
+        open_database()
     # Decide on Next Action
     ## Add new recipe
     if args.new:
@@ -1071,6 +3592,7 @@ if __name__ == "__main__":
             print("{} has been added to the homehold menu!".format(recipe_name))
         else:
             print("An error has ocurred. Please try again. \nError Information: {error}".format(error=error))
+            succeeded = False
     ## View Menu
     if args.viewmenu:
         view_menu(vars(args))
@@ -1089,9 +3611,10 @@ if __name__ == "__main__":
             print("{} has been updated in the homehold menu!".format(args.update_menu))
         else:
             print("An error has ocurred. Please try again. \nError Information: {error}".format(error=error))
+            succeeded = False
     ## Delete a Recipe
     if args.del_recipe:
-        confirm = input("{} will be permanently deleted from the homehold menu. Are you sure you would like to continue? [Y/N]  ".format(args.del_recipe))
+        confirm = prompt_user("{} will be permanently deleted from the homehold menu. Are you sure you would like to continue? [Y/N]  ".format(args.del_recipe))
         deleted = False
         while not deleted:
             if confirm.strip().upper() == "Y":
@@ -1100,11 +3623,12 @@ if __name__ == "__main__":
                     print("{} has been deleted from the menu.".format(args.del_recipe))
                 else:
                     print("An error has ocurred. Please try again. \nError Information: {error}".format(error=error))
+                    succeeded = False
                     deleted = True
             elif confirm.strip().upper() == "N":
                 deleted = True
             else:
-                confirm = input("Unrecognized argument. Please enter Y or N. \n{} will be permanently deleted from the homehold menu. Are you sure you would like to continue? [Y/N]  ".format(args.del_recipe))
+                confirm = prompt_user("Unrecognized argument. Please enter Y or N. \n{} will be permanently deleted from the homehold menu. Are you sure you would like to continue? [Y/N]  ".format(args.del_recipe))
     ## Add a recipe (ingredients)
     if args.addingredients:
         recipe_id, recipe_path = check_ingredients_input(args.addingredients)
@@ -1113,6 +3637,7 @@ if __name__ == "__main__":
             print("The recipe for {} has been added to the homehold menu!".format(args.addingredients[0]))
         else:
             print("An error has occurred. Please try again. \nError Information: {}".format(error))
+            succeeded = False
     ## Add a recipe (instructions)
     if args.addinstructions:
         recipe_id, instructions_path = check_instructions_input(args.addinstructions)
@@ -1121,8 +3646,15 @@ if __name__ == "__main__":
             print("The instructions for {} have been added to the homehold menu!".format(args.addinstructions[0]))
         else:
             print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
+    ## Import a directory of recipes
+    if args.import_dir:
+        imported, error = import_directory(vars(args))
+        if not imported:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
     ## Print a recipe
-    if args.printrecipe:
+    if args.printrecipe is not None:
         print_recipe(vars(args))
     ## Add to the meal plan
     if args.addtomealplan:
@@ -1130,16 +3662,210 @@ if __name__ == "__main__":
         added, error = add_mealplan(weekday, recipe_id)
         if added:
             print("{r} has been added to the mealplan for next {w}".format(r=args.addtomealplan[1], w=weekday.lower().title()))
+        else:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
+    ## Plan the whole week
+    if args.plan_week:
+        planned, error = plan_week(vars(args))
+        if not planned:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
     ## Print the meal plan
     if args.printmealplan:
-        print_mealplan()
+        print_mealplan(args.format)
     ## Creates & prints the grocery list
     if args.groceries:
-        if args.save:
-            created, error = create_grocery_list(save=True)
-        else:
-            created, error = create_grocery_list(save=True)
+        created, error = create_grocery_list(save=args.save, output=args.format, diff=args.diff)
         if not created:
             print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
     if args.random:
-        random_recipe(vars(args))
\ No newline at end of file
+        suggested, error = random_recipe(vars(args))
+        if not suggested:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
+    ## Search the recipes
+    if args.search:
+        searched, error = search_recipes(vars(args))
+        if not searched:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
+    ## Rank recipes by the ingredients on hand
+    if args.cook_from:
+        ranked, error = cook_from(vars(args))
+        if not ranked:
+            print('An error has occurred. Please try again. \nError Information: {}'.format(error))
+            succeeded = False
+    ## Retry unknown grocery locations
+    if args.train_aisles:
+        trained, message = train_aisles()
+        print(message if trained else 'An error has occurred. \nError Information: {}'.format(message))
+        succeeded = succeeded and trained
+    if args.resolve_aisles:
+        resolved, message = resolve_unknown_aisles()
+        print(message)
+    ## Manage the aisle lookup cache
+    if args.warm_aisle_cache is not None:
+        warmed, message = warm_aisle_cache(args.warm_aisle_cache)
+        print(message)
+    if args.purge_aisle_cache:
+        purged, message = purge_aisle_cache(args.purge_aisle_cache)
+        print(message)
+    if args.aisle_cache:
+        print_aisle_cache()
+    ## Serve the HTTP API
+    if args.serve:
+        serve(args.host, args.serve)
+    ## Snapshots & backups
+    if args.import_file:
+        imported, message = import_database(args.import_file)
+        print(message if imported else 'An error has occurred. Please try again. \nError Information: {}'.format(message))
+        succeeded = succeeded and imported
+    if args.export:
+        exported, message = export_database(args.export)
+        print(message if exported else 'An error has occurred. Please try again. \nError Information: {}'.format(message))
+        succeeded = succeeded and exported
+    if args.backup:
+        backed_up, message = backup_database(args.backup)
+        print(message if backed_up else 'An error has occurred. Please try again. \nError Information: {}'.format(message))
+        succeeded = succeeded and backed_up
+    return succeeded
+
+def run_script(lines, commit_every=100, report=True):
+    """
+    Runs many resippy commands, one per line, over a single open connection.
+    Each line is parsed with create_parser(), exactly like the command line (without "resippy.py").
+    Every command runs inside a savepoint, so a failing command is undone on its own; the rest are committed in groups of commit_every.
+
+    Args:
+        lines (iterable): Command lines. Blank lines and lines starting with # are skipped.
+        commit_every (int): Number of commands to group into one commit.
+        report (bool): Whether to print a result line after every command (failures are always printed).
+
+    Returns:
+        list: One dictionary per command with the keys "line", "command", "succeeded", "error", and "ms".
+    """
+    parser = create_parser()
+    open_database()
+    results = []
+    pending = 0
+    connection.defer_commits = True
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                tokens = shlex.split(line, comments=True)
+            except ValueError as e:
+                tokens = None
+                error = str(e)
+            if tokens == []:
+                continue
+            start = time.perf_counter()
+            connection.begin_command()
+            succeeded = False
+            if tokens is not None:
+                error = ''
+                try:
+                    with profile_phase("argument validation"):
+                        args = parser.parse_args(tokens)
+                    if args.batch or args.shell:
+                        raise argparse.ArgumentTypeError("--batch and --shell cannot be used inside a script.")
+                    succeeded = run_command(args)
+                except SystemExit as e:
+                    # argparse has already printed the problem (or the help, for --help)
+                    succeeded = e.code == 0
+                    error = '' if succeeded else "Invalid arguments."
+                except (argparse.ArgumentTypeError, sqlite3.Error, ValueError, OSError) as e:
+                    error = str(e)
+            connection.end_command(succeeded)
+            pending += 1
+            if pending >= commit_every:
+                connection.flush()
+                pending = 0
+            elapsed = (time.perf_counter() - start) * 1000
+            results.append({"line": line_number, "command": line.strip(), "succeeded": succeeded, "error": error, "ms": round(elapsed, 3)})
+            if report or not succeeded:
+                print("[{n}] {status} ({ms:.1f} ms){error}".format(n=line_number, status="OK" if succeeded else "FAILED", ms=elapsed, error=": " + error if error else ""))
+    finally:
+        if connection.in_transaction:
+            connection.flush()
+        connection.defer_commits = False
+    return results
+
+def run_batch(path, commit_every=100):
+    """
+    Runs every command in a batch file (see run_script) and prints a summary.
+
+    Args:
+        path (str): Path to the batch file.
+        commit_every (int): Number of commands to group into one commit.
+
+    Returns:
+        True and an empty string if every command succeeded.
+        False and a summary of the failures otherwise.
+    """
+    start = time.perf_counter()
+    try:
+        with open(path) as batch_file:
+            results = run_script(batch_file, commit_every=commit_every)
+    except FileNotFoundError:
+        return False, "The batch file {} was not found.".format(path)
+    failed = [result for result in results if not result["succeeded"]]
+    print("Ran {n} commands in {s:.2f} s ({f} failed).".format(n=len(results), s=time.perf_counter() - start, f=len(failed)))
+    if failed:
+        return False, "Failed on line(s) {}.".format(", ".join(str(result["line"]) for result in failed))
+    return True, ""
+
+def run_shell():
+    """
+    Starts an interactive resippy session over one open connection. Every command is committed as soon as it finishes.
+    Type "help" for the list of options, and "quit" (or Ctrl-D) to leave.
+    """
+    def read_commands():
+        while True:
+            try:
+                line = input("resippy> ")
+            except EOFError:
+                print()
+                return
+            if line.strip().lower() in ("quit", "exit"):
+                return
+            if line.strip().lower() == "help":
+                line = "--help"
+            yield line
+    print('resippy shell. Enter options as you would on the command line (e.g. --viewmenu --limit 5). Type "quit" to leave.')
+    run_script(read_commands(), commit_every=1, report=False)
+
+def exit_handler():
+    """
+    Closes the SQL connection when the program is exited or otherwise ends.
+    """
+    if connection is not None:
+        connection.close()
+
+if __name__ == "__main__":
+    # Set up parser & exit handler
+    parser = create_parser()
+    parse_start = time.perf_counter()
+    args = parser.parse_args()
+    if args.profile:
+        start_profiling(args.slow_query, time.perf_counter() - parse_start)
+    # Set up exit handler
+    atexit.register(exit_handler)
+    # Decide on Next Action
+    try:
+        if args.batch:
+            completed, error = run_batch(args.batch, commit_every=args.commit_every)
+            if not completed:
+                print('An error has occurred. \nError Information: {}'.format(error))
+                sys.exit(1)
+        elif args.shell:
+            run_shell()
+        elif not run_command(args):
+            sys.exit(1)
+    except BrokenPipeError:
+        # The reader of piped output (e.g. head) stopped early: stop quietly, and keep Python from complaining about stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if args.profile:
+            profile_report(args.profile)
@@ -0,0 +1,30 @@
+# Shared fixtures for the resippy tests
+#
+# usage: python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import resippy
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Points resippy at a new, empty database for one test, and closes it afterwards. Yields the database's path."""
+    path = str(tmp_path / 'resippy.db')
+    monkeypatch.setattr(resippy, 'DATABASE_PATH', path)
+    # In-memory indexes are tied to one database, so none may carry over from another test
+    monkeypatch.setattr(resippy, '_aisle_model', None)
+    monkeypatch.setattr(resippy, '_pantry_index', None)
+    monkeypatch.setattr(resippy, '_name_indexes', {})
+    resippy.connection, resippy.cursor = None, None
+    resippy.open_database()
+    yield path
+    resippy.connection.close()
+    resippy.connection, resippy.cursor = None, None
@@ -0,0 +1,51 @@
+# The HTTP API: request bodies are checked like the command line options before anything is written
+
+import argparse
+
+import pytest
+
+import resippy
+
+def menu_row(name):
+    resippy.cursor.execute("SELECT dish_type, cuisine, ian_rating, last_made FROM menu WHERE name=?", (name,))
+    return resippy.cursor.fetchone()
+
+def test_post_adds_a_recipe(database):
+    assert resippy.api_write("POST", ["menu"], {"name": "pad thai", "cuisine": "Thai", "ian_rating": 4, "last_made": "01/02/2025"}) == (201, {"name": "Pad Thai"})
+    assert menu_row("Pad Thai") == (None, "Thai", 4.0, "2025-02-01")
+
+@pytest.mark.parametrize("body", [
+    {"name": "Pad Thai", "cuisine": None},
+    {"name": "Pad Thai", "cuisine": 7},
+    {"name": "Pad Thai", "dish_type": {"kind": "Noodles"}},
+    {"name": "Pad Thai", "last_made": ["01/02/2025"]},
+    {"name": None},
+    {"name": "Pad Thai", "ian_rating": None},
+    {"name": "Pad Thai", "ian_rating": True},
+    {"name": "Pad Thai", "ian_rating": [4]},
+    {"name": "Pad Thai", "ian_rating": 6},
+    {"name": "Pad Thai", "spiciness": "hot"},
+])
+def test_invalid_fields_are_rejected_before_writing(database, body):
+    with pytest.raises(argparse.ArgumentTypeError):
+        resippy.api_write("POST", ["menu"], body)
+    assert menu_row("Pad Thai") is None
+
+def test_null_is_not_saved_as_text(database):
+    resippy.api_write("POST", ["menu"], {"name": "Tacos", "cuisine": "Mexican"})
+    with pytest.raises(argparse.ArgumentTypeError, match="Invalid cuisine null"):
+        resippy.api_write("PATCH", ["menu", "Tacos"], {"cuisine": None})
+    assert menu_row("Tacos") == (None, "Mexican", None, None)
+
+def test_patch_updates_a_recipe(database):
+    resippy.api_write("POST", ["menu"], {"name": "Tacos"})
+    assert resippy.api_write("PATCH", ["menu", "tacos"], {"ian_rating": "4.5", "dish_type": "Tacos"}) == (200, {"name": "Tacos"})
+    assert menu_row("Tacos") == ("Tacos", None, 4.5, None)
+
+def test_patch_cannot_rename(database):
+    resippy.api_write("POST", ["menu"], {"name": "Tacos"})
+    status, payload = resippy.api_write("PATCH", ["menu", "Tacos"], {"name": "Fish Tacos", "ian_rating": 5})
+    assert status == 400
+    assert "renamed" in payload["error"]
+    assert menu_row("Tacos") == (None, None, None, None)
+    assert menu_row("Fish Tacos") is None
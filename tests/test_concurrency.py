@@ -0,0 +1,19 @@
+# Several roommates writing to one database at the same time, through benchmarks/stress.py
+
+import os
+import sys
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import stress
+
+def test_simultaneous_roommates_never_fail(monkeypatch):
+    # run() sets these for its worker processes; monkeypatch puts them back afterwards
+    monkeypatch.setenv('RESIPPY_BUSY_TIMEOUT', '10')
+    monkeypatch.setenv('RESIPPY_GROCERY_URL', 'http://127.0.0.1:9/search')
+    results = stress.run(processes=6, commands=50, recipes=60, busy_timeout=10)
+    assert results['commands'] == 6 * 50
+    assert results['failures'] == []
+    assert results['locked'] == 0
+    assert results['failed'] == 0
@@ -0,0 +1,109 @@
+# The --filter language: compiling filters to parameterized SQL, and running them against a real menu
+
+import argparse
+
+import pytest
+
+import resippy
+
+COLUMNS = ('id', 'name', 'dish_type', 'cuisine', 'drumlin_rating', 'ian_rating', 'lina_rating', 'last_made')
+
+def compile(text):
+    return resippy.compile_filter(text, COLUMNS)
+
+@pytest.fixture
+def menu(database):
+    """A small menu to run filters against."""
+    recipes = [
+        ('Pad Thai', 'Noodles', 'Thai', 5, 4, None, '2025-01-10'),
+        ('Green Curry', 'Curry', 'Thai', 3, None, 2, '2024-12-01'),
+        ('Tacos', 'Tacos', 'Mexican', 4, 5, 5, None),
+        ('Chana Masala', 'Curry', 'Indian', 2, 3, 4, '2025-02-20'),
+        ("Shepherd's Pie", 'Casserole', 'British', None, 2, 3, '2023-06-15'),
+    ]
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name, dish_type, cuisine, drumlin_rating, ian_rating, lina_rating, last_made) VALUES (?, ?, ?, ?, ?, ?, ?)", recipes)
+    return database
+
+def matching(text):
+    """Names of the menu recipes the filter selects."""
+    menu_filter = resippy.check_filter(text)
+    resippy.cursor.execute("SELECT name FROM menu WHERE {c} ORDER BY id".format(c=menu_filter.sql), menu_filter.parameters)
+    return [row[0] for row in resippy.cursor.fetchall()]
+
+def test_values_are_bound_not_spliced():
+    menu_filter = compile("cuisine = 'Thai' AND drumlin_rating >= 4")
+    assert menu_filter.sql == "(cuisine = ? AND drumlin_rating >= ?)"
+    assert menu_filter.parameters == ('Thai', 4.0)
+
+def test_and_binds_tighter_than_or():
+    assert compile("cuisine = 'Thai' OR cuisine = 'Mexican' AND ian_rating = 5").sql == "(cuisine = ? OR (cuisine = ? AND ian_rating = ?))"
+    assert compile("(cuisine = 'Thai' OR cuisine = 'Mexican') AND ian_rating = 5").sql == "(((cuisine = ? OR cuisine = ?)) AND ian_rating = ?)"
+
+def test_precedence_against_the_menu(menu):
+    assert matching("cuisine = 'Thai' OR cuisine = 'Mexican' AND ian_rating = 5") == ['Pad Thai', 'Green Curry', 'Tacos']
+    assert matching("(cuisine = 'Thai' OR cuisine = 'Mexican') AND ian_rating = 5") == ['Tacos']
+    assert matching("NOT cuisine = 'Thai' AND dish_type = 'Curry'") == ['Chana Masala']
+    assert matching("NOT (cuisine = 'Thai' AND dish_type = 'Curry')") == ['Pad Thai', 'Tacos', 'Chana Masala', "Shepherd's Pie"]
+
+def test_not_in_between_like():
+    assert compile("cuisine NOT IN ('Thai', 'Indian')") == resippy.MenuFilter("cuisine NOT IN (?, ?)", ('Thai', 'Indian'), "cuisine NOT IN ('Thai', 'Indian')")
+    assert compile("ian_rating BETWEEN 2 AND 4").sql == "ian_rating BETWEEN ? AND ?"
+    assert compile("lina_rating NOT BETWEEN 2 AND 4").sql == "lina_rating NOT BETWEEN ? AND ?"
+    assert compile("name LIKE '%curry%'").parameters == ('%curry%',)
+    assert compile("name NOT LIKE 'Pad%'").sql == "name NOT LIKE ?"
+    assert compile("last_made IS NOT NULL").sql == "last_made IS NOT NULL"
+
+def test_not_in_between_like_against_the_menu(menu):
+    assert matching("cuisine NOT IN ('Thai', 'Indian')") == ['Tacos', "Shepherd's Pie"]
+    assert matching("ian_rating BETWEEN 3 AND 4") == ['Pad Thai', 'Chana Masala']
+    assert matching("name LIKE '%curry%'") == ['Green Curry']
+    assert matching("name = 'Shepherd''s Pie'") == ["Shepherd's Pie"]
+    assert matching("last_made IS NULL") == ['Tacos']
+
+@pytest.mark.parametrize("written, stored", [
+    ("01/02/2025", "2025-02-01"),
+    ("31/12/2024", "2024-12-31"),
+    ("2025-02-01", "2025-02-01"),
+])
+def test_dates_are_converted(written, stored):
+    assert compile("last_made >= '{d}'".format(d=written)).parameters == (stored,)
+    assert compile("last_made > {d}".format(d=written)).parameters == (stored,)
+
+def test_dates_against_the_menu(menu):
+    assert matching("last_made BETWEEN 01/12/2024 AND 31/01/2025") == ['Pad Thai', 'Green Curry']
+
+@pytest.mark.parametrize("text", ["last_made > 32/01/2025", "last_made = 01/13/2025", "last_made < 'yesterday'"])
+def test_invalid_dates_are_rejected(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        compile(text)
+
+def test_ratings_are_checked():
+    assert compile("drumlin_rating = 5").parameters == (5.0,)
+    assert compile("lina_rating IN (1, 2.5)").parameters == (1.0, 2.5)
+    for text in ["drumlin_rating > 6", "ian_rating < 0", "lina_rating BETWEEN 1 AND 10", "ian_rating IN (3, 7)", "drumlin_rating = 'great'"]:
+        with pytest.raises(argparse.ArgumentTypeError, match="Ratings must be numbers between 1 and 5"):
+            compile(text)
+
+@pytest.mark.parametrize("text", [
+    "cuisine = 'Thai'; DROP TABLE menu",
+    "cuisine = 'Thai' --",
+    "1 = 1",
+    "cuisine = 'Thai' OR 1 = 1",
+    "cuisine = (SELECT name FROM ingredients)",
+    "cuisine = 'Thai' UNION SELECT * FROM ingredients",
+    "secret_column = 1",
+    "cuisine = 'Thai' AND",
+    "cuisine 'Thai'",
+    "",
+])
+def test_injected_or_malformed_text_is_rejected(text):
+    with pytest.raises(argparse.ArgumentTypeError, match="Invalid filter"):
+        compile(text)
+
+def test_quotes_stay_inside_the_value(menu):
+    # The quote closes nothing: the whole text is one bound value
+    menu_filter = resippy.check_filter("""name = "Tacos'; DROP TABLE menu; --" """)
+    assert menu_filter.parameters == ("Tacos'; DROP TABLE menu; --",)
+    assert matching("""name = "Tacos'; DROP TABLE menu; --" """) == []
+    assert resippy.cursor.execute("SELECT count(*) FROM menu").fetchone()[0] == 5
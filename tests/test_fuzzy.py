@@ -0,0 +1,81 @@
+# Fuzzy name matching: trigram similarity through the bitmap index, and the "did you mean" suggestions built on it
+
+import random
+
+import pytest
+
+import resippy
+
+NAMES = ["Pad Thai", "Pad See Ew", "Green Curry", "Chana Masala", "Chickpea Curry", "Tacos", "Shepherd's Pie", "Thai Basil Tofu"]
+
+@pytest.fixture
+def menu(database):
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name) VALUES (?)", [(name,) for name in NAMES])
+    return database
+
+def similarity(a, b):
+    """Reference: shared trigrams over all trigrams of either name."""
+    a, b = resippy.name_trigrams(a), resippy.name_trigrams(b)
+    return len(a & b) / len(a | b)
+
+def best_names(name, limit=resippy.FUZZY_SUGGESTIONS):
+    return [match for match, _ in resippy.fuzzy_matches('menu', name, limit)]
+
+@pytest.mark.parametrize("typed, meant", [
+    ("Chana Masla", "Chana Masala"),
+    ("chickpee curry", "Chickpea Curry"),
+    ("Shepards Pie", "Shepherd's Pie"),
+    ("Taco", "Tacos"),
+])
+def test_typo(menu, typed, meant):
+    assert best_names(typed)[0] == meant
+
+@pytest.mark.parametrize("typed, meant", [
+    ("Pad Tahi", "Pad Thai"),
+    ("Gerne Curry", "Green Curry"),
+    ("Thai Basli Tofu", "Thai Basil Tofu"),
+])
+def test_transposition(menu, typed, meant):
+    assert best_names(typed)[0] == meant
+
+def test_no_close_match(menu):
+    assert resippy.fuzzy_matches('menu', "Zzyzx Quux") == []
+    assert resippy.fuzzy_matches('menu', "!!!") == []
+    assert resippy.did_you_mean("Zzyzx Quux") == ""
+
+def test_ranking_matches_the_reference_similarity(menu):
+    matches = resippy.fuzzy_matches('menu', "Pad Thai Curry", limit=len(NAMES), min_similarity=0.01)
+    expected = sorted(((name, similarity("Pad Thai Curry", name)) for name in NAMES), key=lambda match: -match[1])
+    expected = [match for match in expected if match[1] >= 0.01]
+    assert [name for name, _ in matches] == [name for name, _ in expected]
+    assert [score for _, score in matches] == pytest.approx([score for _, score in expected])
+
+def test_ranking_on_a_larger_menu(database):
+    # Enough names that the postings span many bytes, and many counts need several binary digits
+    generator = random.Random(25)
+    words = ["Spicy", "Green", "Red", "Curry", "Noodles", "Tofu", "Chickpea", "Lentil", "Soup", "Stew", "Rice", "Bowl", "Roast", "Pie", "Tacos"]
+    names = sorted({" ".join(generator.sample(words, generator.randint(1, 4))) for _ in range(600)})
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name) VALUES (?)", [(name,) for name in names])
+    stored = [row[0] for row in resippy.cursor.execute("SELECT name FROM menu ORDER BY id")]
+    for query in ["Spicy Lentil Soup", "Red Curry Noodles", "Tofu Rice Bowl", "Roast"]:
+        expected = sorted(stored, key=lambda name: -similarity(query, name))[:5]
+        matches = resippy.fuzzy_matches('menu', query, limit=5)
+        assert [score for _, score in matches] == pytest.approx([similarity(query, name) for name in expected])
+        # Ties go to the name added first
+        assert [name for name, _ in matches] == expected
+
+def test_did_you_mean(menu):
+    assert resippy.did_you_mean("Pad Tahi").startswith(" Did you mean Pad Thai")
+    assert resippy.did_you_mean("Chana Masla") == " Did you mean Chana Masala?"
+    updated, error = resippy.update_menu({'update_menu': "Chana Masla", 'ian_rating': 4.0})
+    assert not updated
+    assert error == "Chana Masla was not found in the menu. Did you mean Chana Masala? If you would like to add it, please use --new."
+
+def test_index_follows_the_menu(menu):
+    assert "Massaman Curry" not in best_names("Masaman Curry")
+    resippy.new_recipe({'new': "Massaman Curry"})
+    assert best_names("Masaman Curry")[0] == "Massaman Curry"
+    resippy.delete_recipe({'del_recipe': "Massaman Curry"})
+    assert "Massaman Curry" not in best_names("Masaman Curry")
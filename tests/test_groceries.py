@@ -0,0 +1,110 @@
+# --groceries: the stored grocery list is rebuilt whenever a planned recipe or the meal plan changes, and --diff compares it with the saved one
+
+import csv
+import io
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import resippy
+
+TODAY = date.today()
+
+def add_recipe(name, ingredients):
+    resippy.new_recipe({'new': name})
+    recipe_id = resippy.load_lookup('menu', 'name', 'id', [name])[name]
+    with resippy.connection:
+        resippy.ingest_ingredients({recipe_id: ingredients}, {"Chickpeas": "Canned Goods", "Onion": "Produce", "Tofu": "Produce", "Rice": "Grains"})
+    return recipe_id
+
+def plan(recipe_id, days_ahead):
+    day = TODAY + timedelta(days=days_ahead)
+    with resippy.connection:
+        resippy.cursor.execute("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", (day.isoformat(), recipe_id, day.strftime('%A')))
+
+@pytest.fixture
+def planned(database, tmp_path, monkeypatch):
+    """Chana Masala and Tofu Rice on the meal plan, Plain Rice only on the menu. Saved lists go under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    recipes = {
+        "Chana Masala": add_recipe("Chana Masala", [("Chickpeas", 2, "Cup", None), ("Onion", 1, None, "Diced")]),
+        "Tofu Rice": add_recipe("Tofu Rice", [("Tofu", 1, "Block", "Cubed"), ("Rice", 1, "Cup", None), ("Onion", 1, None, None)]),
+        "Plain Rice": add_recipe("Plain Rice", [("Rice", 2, "Cup", None)]),
+    }
+    plan(recipes["Chana Masala"], 1)
+    plan(recipes["Tofu Rice"], 2)
+    return recipes
+
+def grocery_list(capsys):
+    """The grocery list, as {(ingredient, unit): quantity}."""
+    capsys.readouterr()
+    assert resippy.create_grocery_list(output="csv") == (True, "")
+    return {(row['ingredient'], row['unit']): float(row['quantity']) for row in csv.DictReader(io.StringIO(capsys.readouterr().out))}
+
+def state():
+    return resippy.cursor.execute("SELECT built_for, stale FROM grocery_state").fetchone()
+
+def test_list_sums_the_planned_recipes(planned, capsys):
+    assert grocery_list(capsys) == {("Chickpeas", "Cup"): 2, ("Onion", "Units"): 2, ("Rice", "Cup"): 1, ("Tofu", "Block"): 1}
+    assert state() == (TODAY.isoformat(), 0)
+
+def test_editing_a_planned_recipe_makes_the_list_stale(planned, capsys):
+    grocery_list(capsys)
+    with resippy.connection:
+        resippy.cursor.execute("UPDATE recipe_ingredients SET quantity = 3 WHERE recipe_id = ? AND quantity = 2", (planned["Chana Masala"],))
+    assert state()[1] == 1
+    assert grocery_list(capsys)[("Chickpeas", "Cup")] == 3
+
+def test_editing_an_unplanned_recipe_keeps_the_list(planned, capsys):
+    grocery_list(capsys)
+    with resippy.connection:
+        resippy.cursor.execute("UPDATE recipe_ingredients SET quantity = 5 WHERE recipe_id = ?", (planned["Plain Rice"],))
+        resippy.cursor.execute("INSERT INTO instructions (recipe_id, instruction) VALUES (?, 'Stir.')", (planned["Chana Masala"],))
+    assert state() == (TODAY.isoformat(), 0)
+    assert grocery_list(capsys)[("Rice", "Cup")] == 1
+
+def test_changing_the_meal_plan_makes_the_list_stale(planned, capsys):
+    grocery_list(capsys)
+    plan(planned["Plain Rice"], 3)
+    assert state()[1] == 1
+    assert grocery_list(capsys)[("Rice", "Cup")] == 3
+
+def test_edits_left_by_another_writer_are_applied_first(planned, database, capsys):
+    grocery_list(capsys)
+    # e.g. the sqlite3 shell: the triggers only record the change, and nothing marks the list stale
+    other = sqlite3.connect(database)
+    with other:
+        other.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ? AND quantity = 1", (planned["Tofu Rice"],))
+    other.close()
+    # A read-only connection (like the HTTP API's) doesn't trust the stored list while changes are pending
+    reader = sqlite3.connect(database)
+    assert dict(((ingredient, unit), quantity) for _, ingredient, unit, quantity in resippy.query_grocery_list(TODAY.isoformat(), reader.cursor())) == {
+        ("Chickpeas", "Cup"): 2, ("Onion", "Units"): 1}
+    reader.close()
+    assert grocery_list(capsys) == {("Chickpeas", "Cup"): 2, ("Onion", "Units"): 1}
+    assert resippy.cursor.execute("SELECT count(*) FROM recipe_changes").fetchone()[0] == 0
+
+def test_diff_needs_a_saved_list(planned):
+    assert resippy.create_grocery_list(diff=True, output="grid") == (False, "No grocery list has been saved yet. Use --groceries --save to save one to compare with.")
+
+def test_diff_shows_what_changed_since_saving(planned, capsys, tmp_path):
+    assert resippy.create_grocery_list(save=True, output="csv") == (True, "")
+    assert (tmp_path / 'groceries' / 'groceries_{d}.csv'.format(d=TODAY.isoformat())).exists()
+    capsys.readouterr()
+    assert resippy.create_grocery_list(diff=True, output="grid") == (True, "")
+    assert "Nothing has changed." in capsys.readouterr().out
+    with resippy.connection:
+        resippy.cursor.execute("UPDATE recipe_ingredients SET quantity = 3 WHERE recipe_id = ? AND quantity = 2", (planned["Chana Masala"],))
+        resippy.cursor.execute("UPDATE ingredients SET grocery_location = 'International' WHERE ingredient_name = 'Rice'")
+    plan(planned["Plain Rice"], 2)
+    assert resippy.create_grocery_list(diff=True, output="grid") == (True, "")
+    assert capsys.readouterr().out.splitlines()[2:] == [
+        "CANNED GOODS", "----------------------", "~ Chickpeas: 2 -> 3 Cup", " ",
+        "INTERNATIONAL", "----------------------", "~ Rice: 1 -> 2 Cup (moved from Grains)", " ",
+        "PRODUCE", "----------------------", "~ Onion: 2 -> 1 Units", "- Tofu: 1 Block", " ",
+    ]
+    assert resippy.create_grocery_list(diff=True, output="csv") == (True, "")
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert [(row['change'], row['ingredient'], row['saved_quantity'], row['quantity']) for row in rows] == [
+        ("changed", "Chickpeas", "2", "3"), ("changed", "Rice", "1", "2"), ("changed", "Onion", "2", "1"), ("removed", "Tofu", "1", "")]
@@ -0,0 +1,155 @@
+# Grocery location lookups against a local stand-in for the grocery store's search page, serving the saved pages in fixtures/
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import resippy
+from conftest import FIXTURES
+
+# Saved search pages, by the last word of the search
+PAGES = {
+    'tofu': 'search_tofu.html',
+    'paprika': 'search_paprika.html',
+    'coffee': 'search_coffee.html',
+}
+
+class StoreHandler(BaseHTTPRequestHandler):
+    """Answers /search?filter=... like the grocery store does. A few searches misbehave on purpose:
+    "slow ..." answers later than the client waits, "flaky ..." fails twice with a 503 before answering, and "broken ..." always fails.
+    "plain ..." leaves the charset out of the Content-Type, and "long ..." repeats the page's products far past what the scraper samples.
+    """
+    # Keep-alive, like the real store, so the tests can tell whether the scraper reuses its connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        store = self.server
+        search = parse_qs(urlparse(self.path).query).get('filter', [''])[0]
+        words = search.split() or ['']
+        with store.lock:
+            store.requests[search] = store.requests.get(search, 0) + 1
+            store.connections.add(self.client_address)
+            attempt = store.requests[search]
+            store.in_flight += 1
+            store.max_in_flight = max(store.max_in_flight, store.in_flight)
+        try:
+            time.sleep(store.delay)
+            if words[0] == 'slow':
+                time.sleep(1)
+            if words[0] == 'broken' or words[0] == 'flaky' and attempt <= 2:
+                self.send_error(503)
+                return
+            with open(os.path.join(FIXTURES, PAGES.get(words[-1], 'search_no_results.html')), 'rb') as file:
+                body = file.read()
+            if words[0] == 'long':
+                body = body * 200
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html' if words[0] == 'plain' else 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with store.lock:
+                store.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def store(monkeypatch):
+    """Starts the stand-in store on a free local port and points resippy's scraper at it, with no backoff between retries."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StoreHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = {}
+    server.connections = set()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(resippy, 'GROCERY_SEARCH_URL', 'http://127.0.0.1:{p}/search'.format(p=server.server_address[1]))
+    monkeypatch.setattr(resippy, 'SCRAPE_BACKOFF', 0)
+    monkeypatch.setattr(resippy, 'OFFLINE', False)
+    monkeypatch.setattr(resippy, '_http_session', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_most_common_category_wins(store):
+    assert resippy.find_grocery_location('tofu') == 'Produce'
+    assert resippy.find_grocery_location('paprika') == 'Spices & Seasonings'
+
+def test_pages_without_a_charset_are_utf8(store):
+    assert resippy.find_grocery_location('coffee') == 'Café & Thé'
+    assert resippy.find_grocery_location('plain coffee') == 'Café & Thé'
+
+def test_connection_is_reused_after_a_short_page(store):
+    assert resippy.find_grocery_location('tofu') == 'Produce'
+    assert resippy.find_grocery_location('paprika') == 'Spices & Seasonings'
+    assert len(store.connections) == 1
+
+def test_long_page_download_stops_after_the_sample(store):
+    assert resippy.find_grocery_location('long tofu') == 'Produce'
+    assert resippy.find_grocery_location('long paprika') == 'Spices & Seasonings'
+    # Each long page's connection is closed partway through instead of being read to the end, so the second lookup needs a new one
+    assert len(store.connections) == 2
+
+def test_no_products_is_unknown(store):
+    assert resippy.find_grocery_location('unobtainium') == 'Unknown'
+
+def test_lookups_run_concurrently(store, database):
+    store.delay = 0.2
+    ingredients = ['brand{} tofu'.format(n) for n in range(resippy.SCRAPE_WORKERS)]
+    start = time.perf_counter()
+    aisles = resippy.find_grocery_locations(ingredients, use_classifier=False)
+    elapsed = time.perf_counter() - start
+    assert aisles == {ingredient: 'Produce' for ingredient in ingredients}
+    assert 1 < store.max_in_flight <= resippy.SCRAPE_WORKERS
+    assert elapsed < store.delay * len(ingredients) / 2
+
+def test_timeout_is_retried_then_unknown(store, monkeypatch):
+    monkeypatch.setattr(resippy, 'SCRAPE_TIMEOUT', (0.5, 0.2))
+    start = time.perf_counter()
+    assert resippy.find_grocery_location('slow tofu') == 'Unknown'
+    assert store.requests['slow tofu'] == resippy.SCRAPE_RETRIES + 1
+    assert time.perf_counter() - start < 1 + (resippy.SCRAPE_RETRIES + 1) * 0.2
+
+def test_server_errors_are_retried(store):
+    assert resippy.find_grocery_location('flaky tofu') == 'Produce'
+    assert store.requests['flaky tofu'] == 3
+
+def test_persistent_server_errors_are_unknown(store):
+    assert resippy.find_grocery_location('broken tofu') == 'Unknown'
+    assert store.requests['broken tofu'] == resippy.SCRAPE_RETRIES + 1
+
+def test_resolve_aisles_keeps_unknown_when_lookups_fail(store, database):
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO ingredients (ingredient_name, grocery_location) VALUES (?, ?)",
+                                   [('Tofu', 'Unknown'), ('Unobtainium', 'Unknown'), ('Broken Glass', 'Unknown'), ('Paprika', None)])
+    assert resippy.resolve_unknown_aisles() == (True, "Found the grocery location for 2 of 4 ingredients.")
+    aisles = dict(resippy.cursor.execute("SELECT ingredient_name, grocery_location FROM ingredients"))
+    assert aisles == {'Tofu': 'Produce', 'Unobtainium': 'Unknown', 'Broken Glass': 'Unknown', 'Paprika': 'Spices & Seasonings'}
+    # Failed lookups are retried the next time, not answered from the negative cache
+    assert resippy.resolve_unknown_aisles() == (True, "Found the grocery location for 0 of 2 ingredients.")
+    assert store.requests['unobtainium'] == 2
+
+def test_only_labelled_ingredients_retrain_the_aisle_classifier(database):
+    def version_after(sql):
+        with resippy.connection:
+            resippy.cursor.execute(sql)
+        return resippy.cursor.execute("SELECT version FROM aisle_model_state").fetchone()[0]
+    assert version_after("INSERT INTO ingredients (ingredient_name, grocery_location) VALUES ('Tofu', 'Unknown')") == 0
+    assert version_after("INSERT INTO ingredients (ingredient_name) VALUES ('Paprika')") == 0
+    assert version_after("UPDATE ingredients SET ingredient_name = 'Smoked Paprika' WHERE ingredient_name = 'Paprika'") == 0
+    assert version_after("UPDATE ingredients SET grocery_location = 'Produce' WHERE ingredient_name = 'Tofu'") == 1
+    assert version_after("UPDATE ingredients SET grocery_location = 'Produce' WHERE ingredient_name = 'Tofu'") == 1
+    assert version_after("INSERT INTO ingredients (ingredient_name, grocery_location) VALUES ('Milk', 'Dairy')") == 2
+    assert version_after("DELETE FROM ingredients WHERE ingredient_name = 'Smoked Paprika'") == 2
+    assert version_after("DELETE FROM ingredients WHERE ingredient_name = 'Milk'") == 3
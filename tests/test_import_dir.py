@@ -0,0 +1,65 @@
+# --import-dir: every .csv in a directory is checked like --addingredients checks one, and bad files are reported instead of imported
+
+import argparse
+
+import pytest
+
+import resippy
+
+FILES = {
+    'chana_masala.csv': "ingredient,quantity,units,prepmethod\nchickpeas,2,cup,\nonion,1,,diced\n",
+    'chana_masala.txt': "Fry the onion.\nAdd the chickpeas.\n",
+    # Columns in another order are fine
+    'tofu_scramble.csv': "quantity,units,ingredient,prepmethod\n1,block,tofu,crumbled\n",
+    'no_header.csv': "lentils,1,cup,\nrice,2,cup,\n",
+    'wrong_headers.csv': "name,amount,unit,prep\nlentils,1,cup,\n",
+    'too_few_headers.csv': "ingredient,quantity\nlentils,1\n",
+    'bad_quantity.csv': "ingredient,quantity,units,prepmethod\nlentils,some,cup,\n",
+    'empty.csv': "",
+}
+
+@pytest.fixture
+def recipes(tmp_path, monkeypatch):
+    """A directory of recipe files, some of them broken. Aisles are guessed offline."""
+    monkeypatch.setattr(resippy, 'OFFLINE', True)
+    directory = tmp_path / 'recipes'
+    directory.mkdir()
+    for name, text in FILES.items():
+        (directory / name).write_text(text)
+    return str(directory)
+
+def recipe_ingredients(name):
+    resippy.cursor.execute("""SELECT i.ingredient_name, ri.quantity FROM recipe_ingredients ri
+                              JOIN menu m ON m.id = ri.recipe_id JOIN ingredients i ON i.ingredient_id = ri.ingredient_id
+                              WHERE m.name=? ORDER BY ri.rowid""", (name,))
+    return resippy.cursor.fetchall()
+
+@pytest.mark.parametrize("headers, valid", [
+    (['ingredient', 'quantity', 'units', 'prepmethod'], True),
+    (['prepmethod', 'units', 'quantity', 'ingredient'], True),
+    (['ingredient', 'quantity', 'units'], False),
+    (['ingredient', 'ingredient', 'units', 'prepmethod'], False),
+    (['lentils', '1', 'cup', ''], False),
+])
+def test_headers(headers, valid):
+    assert (resippy.check_ingredients_headers(headers) == "") == valid
+
+def test_only_valid_files_are_imported(database, recipes, capsys):
+    assert resippy.import_directory({'import_dir': recipes}) == (True, "")
+    assert recipe_ingredients('Chana Masala') == [('Chickpeas', 2.0), ('Onion', 1.0)]
+    assert recipe_ingredients('Tofu Scramble') == [('Tofu', 1.0)]
+    resippy.cursor.execute("SELECT name FROM menu ORDER BY name")
+    assert [row[0] for row in resippy.cursor.fetchall()] == ['Chana Masala', 'Tofu Scramble']
+    resippy.cursor.execute("SELECT count(*) FROM ingredients WHERE ingredient_name IN ('Lentils', 'Rice')")
+    assert resippy.cursor.fetchone()[0] == 0
+    report = capsys.readouterr().out
+    assert "Imported 2 recipes (3 ingredients, 2 instructions)" in report
+    for name, error in [('No Header', 'headers in the ingredients file is incorrect'), ('Wrong Headers', 'headers in the ingredients file is incorrect'),
+                        ('Too Few Headers', 'correct amount of headers'), ('Bad Quantity', 'non-numerical quantity'), ('Empty', 'could not be read')]:
+        assert "Not imported: {n}: ".format(n=name) in report
+        assert error in report.split("Not imported: {n}: ".format(n=name))[1].splitlines()[0]
+
+def test_addingredients_checks_headers_the_same_way(database, recipes):
+    resippy.new_recipe({'new': 'No Header'})
+    with pytest.raises(argparse.ArgumentTypeError, match="headers in the ingredients file is incorrect"):
+        resippy.check_ingredients_input(['No Header', recipes + '/no_header.csv'])
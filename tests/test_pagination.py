@@ -0,0 +1,87 @@
+# --page/--after: keyset pagination over the --order columns, including columns with NULLs, checked against plain ORDER BY queries
+
+import argparse
+import csv
+import io
+import re
+
+import pytest
+
+import resippy
+
+@pytest.fixture
+def menu(database):
+    """Ten recipes, four of them never made (last_made NULL) and some without a cuisine."""
+    recipes = [
+        ('Pad Thai', 'Thai', '2025-01-10'),
+        ('Green Curry', 'Thai', None),
+        ('Tacos', None, '2025-01-10'),
+        ('Chana Masala', 'Indian', None),
+        ("Shepherd's Pie", 'British', '2023-06-15'),
+        ('Dal', 'Indian', None),
+        ('Burritos', None, None),
+        ('Ramen', 'Japanese', '2025-02-20'),
+        ('Pho', None, '2024-11-02'),
+        ('Risotto', 'Italian', '2024-11-02'),
+    ]
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name, cuisine, last_made) VALUES (?, ?, ?)", recipes)
+    return database
+
+def page(order, size, after, capsys):
+    """Ids on one --page of the menu, and the --after id suggested for the next page (None on the last page)."""
+    capsys.readouterr()
+    args = {'page': size, 'after': after, 'order': resippy.check_order(order) if order else None, 'format': "csv"}
+    resippy.view_menu_pages(args)
+    captured = capsys.readouterr()
+    ids = [int(row['id']) for row in csv.DictReader(io.StringIO(captured.out))]
+    hint = re.search(r"Add --after (\d+)", captured.err)
+    return ids, int(hint.group(1)) if hint else None
+
+def every_page(order, size, capsys):
+    """Follows the --after hints from the first page to the last, returning the ids of every page."""
+    pages = []
+    ids, after = page(order, size, None, capsys)
+    pages.append(ids)
+    while after is not None:
+        assert after == ids[-1]
+        ids, after = page(order, size, after, capsys)
+        pages.append(ids)
+    return pages
+
+def ordered_ids(order):
+    return [row[0] for row in resippy.cursor.execute("SELECT id FROM menu ORDER BY {o}, id".format(o=order))]
+
+@pytest.mark.parametrize("order", ["last_made DESC", "last_made ASC", "cuisine DESC, last_made ASC", "cuisine ASC, last_made DESC", "name", None])
+@pytest.mark.parametrize("size", [1, 2, 3, 10])
+def test_pages_cover_the_menu_once_in_order(menu, capsys, order, size):
+    pages = every_page(order, size, capsys)
+    assert [recipe_id for ids in pages for recipe_id in ids] == ordered_ids(order or "id")
+    assert all(len(ids) == size for ids in pages[:-1])
+    assert 1 <= len(pages[-1]) <= size
+
+def test_cursor_between_nulls(menu, capsys):
+    # With last_made DESC the never-made recipes come last; starting after the first of them must give only the ones after it
+    never_made = ordered_ids("last_made DESC")[-4:]
+    assert never_made == [2, 4, 6, 7]
+    assert page("last_made DESC", 2, 4, capsys) == ([6, 7], None)
+    assert page("last_made DESC", 1, 6, capsys) == ([7], None)
+    # With ASC they come first, and the page after the last of them starts with the oldest date
+    assert page("last_made ASC", 2, 7, capsys) == ([5, 9], 9)
+
+def test_after_the_last_recipe_is_an_empty_last_page(menu, capsys):
+    assert page("last_made DESC", 3, 7, capsys) == ([], None)
+
+@pytest.mark.parametrize("after", [0, -1, 11, 10 ** 12])
+def test_after_an_unknown_id_is_rejected(menu, capsys, after):
+    with pytest.raises(argparse.ArgumentTypeError, match="There is no recipe with the id {a} in the menu".format(a=after)):
+        page("last_made DESC", 2, after, capsys)
+
+def test_keyset_condition_handles_nulls():
+    columns = [('last_made', 'DESC'), ('id', 'ASC')]
+    assert resippy.keyset_condition(columns, ('2025-01-10', 3)) == (
+        "(((last_made < ? OR last_made IS NULL)) OR (last_made IS ? AND id > ?))", ['2025-01-10', '2025-01-10', 3])
+    # After a NULL with DESC only the later NULLs (by id) are left
+    assert resippy.keyset_condition(columns, (None, 4)) == ("((last_made IS ? AND id > ?))", [None, 4])
+    assert resippy.keyset_condition([('last_made', 'ASC'), ('id', 'ASC')], (None, 4)) == (
+        "((last_made IS NOT NULL) OR (last_made IS ? AND id > ?))", [None, 4])
@@ -0,0 +1,91 @@
+# --plan-week: the plan never repeats a recipe, keeps cuisines and dish types varied, skips recent meals, and meets each roommate's --min-rating
+
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+import resippy
+
+TODAY = date.today()
+
+def add_recipes(rows):
+    """Adds (name, cuisine, dish type, drumlin rating, ian rating, lina rating, last made) rows to the menu."""
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name, cuisine, dish_type, drumlin_rating, ian_rating, lina_rating, last_made) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+def planned():
+    """The planned recipes, as {name: (cuisine, dish type, drumlin rating, ian rating, lina rating, last made)}."""
+    return {row[0]: row[1:] for row in resippy.cursor.execute("SELECT r.name, r.cuisine, r.dish_type, r.drumlin_rating, r.ian_rating, r.lina_rating, r.last_made FROM mealplan m JOIN menu r ON r.id = m.recipe_id")}
+
+@pytest.fixture(autouse=True)
+def replace_plan(monkeypatch):
+    """Answers yes whenever --plan-week asks to replace the upcoming meals."""
+    monkeypatch.setattr(resippy, 'prompt_user', lambda question: "y")
+
+def plan_week(*options):
+    args = vars(resippy.create_parser().parse_args(["--plan-week"] + list(options)))
+    return resippy.plan_week(args)
+
+def test_plan_is_varied_and_never_repeats(database, capsys):
+    cuisines = ["Italian", "Mexican", "Indian", "Thai", "Greek"]
+    dish_types = ["Pasta", "Curry", "Soup", "Salad"]
+    add_recipes([("Recipe {i}".format(i=i), cuisines[i % 5], dish_types[i % 4], 5, 5, 5, None) for i in range(40)])
+    assert plan_week("--seed", "1") == (True, "")
+    plan = planned()
+    assert len(plan) == 7
+    assert len(resippy.cursor.execute("SELECT DISTINCT date FROM mealplan WHERE recipe_id IS NOT NULL").fetchall()) == 7
+    assert max(Counter(recipe[0] for recipe in plan.values()).values()) <= resippy.PLAN_MAX_REPEATS
+    assert max(Counter(recipe[1] for recipe in plan.values()).values()) <= resippy.PLAN_MAX_REPEATS
+
+def test_plan_leaves_days_empty_rather_than_repeat(database, capsys):
+    add_recipes([("Lasagna", "Italian", "Pasta", None, None, None, None), ("Tacos", "Mexican", "Tacos", None, None, None, None)])
+    assert plan_week() == (True, "")
+    assert sorted(planned()) == ["Lasagna", "Tacos"]
+    assert "Only 2 recipes meet the constraints, so 5 days were left empty." in capsys.readouterr().out
+
+def test_recent_meals_are_skipped(database, capsys):
+    recent = (TODAY - timedelta(days=3)).isoformat()
+    old = (TODAY - timedelta(days=30)).isoformat()
+    add_recipes([("Lasagna", "Italian", "Pasta", None, None, None, recent), ("Tacos", "Mexican", "Tacos", None, None, None, old), ("Dal", "Indian", "Curry", None, None, None, None)])
+    assert plan_week() == (True, "")
+    assert sorted(planned()) == ["Dal", "Tacos"]
+    assert plan_week("--skip-recent", "2") == (True, "")
+    assert sorted(planned()) == ["Dal", "Lasagna", "Tacos"]
+
+def test_min_rating_applies_to_every_roommate_who_rated(database, capsys):
+    add_recipes([
+        ("Lasagna", "Italian", "Pasta", 5, 2, None, None),
+        ("Tacos", "Mexican", "Tacos", 4, None, 4, None),
+        ("Dal", "Indian", "Curry", None, None, None, None),
+    ])
+    assert plan_week("--min-rating", "3") == (True, "")
+    assert sorted(planned()) == ["Dal", "Tacos"]
+
+def test_min_rating_per_roommate(database, capsys):
+    add_recipes([
+        ("Lasagna", "Italian", "Pasta", 5, 2, 5, None),
+        ("Tacos", "Mexican", "Tacos", 5, 5, 3, None),
+        ("Dal", "Indian", "Curry", 2, 5, 5, None),
+        ("Pho", "Vietnamese", "Soup", 4, 4, 4, None),
+    ])
+    # Ian doesn't mind much, Lina is picky, and Drumlin gets the default
+    assert plan_week("--min-rating", "3", "ian=1", "lina=4") == (True, "")
+    assert sorted(planned()) == ["Lasagna", "Pho"]
+    assert plan_week("--min-rating", "Lina=4") == (True, "")
+    assert sorted(planned()) == ["Dal", "Lasagna", "Pho"]
+    # A roommate's own threshold wins, whatever the order
+    assert plan_week("--min-rating", "ian=1", "3") == (True, "")
+    assert sorted(planned()) == ["Lasagna", "Pho", "Tacos"]
+
+def test_no_recipe_meets_the_constraints(database, capsys):
+    add_recipes([("Lasagna", "Italian", "Pasta", 2, 2, 2, None)])
+    planned_before = planned()
+    assert plan_week("--min-rating", "drumlin=3") == (False, "No recipes in the menu meet the constraints. Try a lower --min-rating or --skip-recent.")
+    assert planned() == planned_before
+
+@pytest.mark.parametrize("threshold", ["6", "nobody=4", "lina=high", "lina="])
+def test_invalid_min_rating(threshold):
+    with pytest.raises(argparse.ArgumentTypeError):
+        resippy.check_min_rating(threshold)
@@ -0,0 +1,69 @@
+# --printrecipe: recipes are loaded a batch at a time and written as they are loaded, in every --format
+
+import argparse
+import csv
+import io
+import json
+
+import pytest
+
+import resippy
+
+@pytest.fixture
+def menu(database):
+    """Seven curries with two ingredients and one instruction each, and a recipe with no ingredients yet."""
+    for n in range(7):
+        name = "Curry {}".format(n)
+        resippy.new_recipe({'new': name, 'cuisine': "Thai" if n % 2 else "Indian"})
+        recipe_id = resippy.load_lookup('menu', 'name', 'id', [name])[name]
+        with resippy.connection:
+            resippy.ingest_ingredients({recipe_id: [("Onion", n + 1, None, "Diced"), ("Coconut Milk", 1, "Can", None)]}, {"Onion": "Produce", "Coconut Milk": "Canned Goods"})
+            resippy.ingest_instructions({recipe_id: ["Simmer curry {}.".format(n)]})
+    resippy.new_recipe({'new': "Empty Curry", 'cuisine': "Thai"})
+    return database
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Loads two recipes at a time, and records the size of every batch loaded."""
+    monkeypatch.setattr(resippy, 'PRINT_BATCH_SIZE', 2)
+    sizes = []
+    load_recipes = resippy.load_recipes
+    def recording_load_recipes(recipe_ids, db=None):
+        recipe_ids = list(recipe_ids)
+        sizes.append(len(recipe_ids))
+        return load_recipes(recipe_ids, db)
+    monkeypatch.setattr(resippy, 'load_recipes', recording_load_recipes)
+    return sizes
+
+def printed(args, capsys):
+    capsys.readouterr()
+    resippy.print_recipe(args)
+    return capsys.readouterr().out
+
+def test_filtered_recipes_are_loaded_in_batches(menu, batches, capsys):
+    lines = printed({'printrecipe': [], 'filter': resippy.check_filter("cuisine LIKE '%'"), 'format': "jsonl"}, capsys).splitlines()
+    recipes = [json.loads(line) for line in lines]
+    # The recipe without ingredients is left out
+    assert [recipe["name"] for recipe in recipes] == ["Curry {}".format(n) for n in range(7)]
+    assert recipes[3] == {"name": "Curry 3", "instructions": ["Simmer curry 3."], "ingredients": [
+        {"quantity": 4.0, "unit": None, "ingredient": "Onion", "prepmethod": "Diced"},
+        {"quantity": 1.0, "unit": "Can", "ingredient": "Coconut Milk", "prepmethod": None}]}
+    assert batches == [2, 2, 2, 1]
+
+def test_csv_has_a_row_per_ingredient_and_instruction(menu, batches, capsys):
+    rows = list(csv.reader(io.StringIO(printed({'printrecipe': [], 'filter': resippy.check_filter("cuisine = 'Thai'"), 'format': "csv"}, capsys))))
+    assert rows[0] == ["name", "quantity", "unit", "ingredient", "prepmethod", "instruction"]
+    assert rows[1:4] == [["Curry 1", "2", "", "Onion", "Diced", ""], ["Curry 1", "1", "Can", "Coconut Milk", "", ""], ["Curry 1", "", "", "", "", "Simmer curry 1."]]
+    assert len(rows) == 1 + 3 * 3
+    assert batches == [2, 1]
+
+def test_named_recipes_print_in_the_order_given(menu, capsys):
+    text = printed({'printrecipe': ["curry 5", "Curry 2"], 'format': "grid"}, capsys)
+    assert text.index("RECIPE: curry 5") < text.index("RECIPE: Curry 2")
+    assert "    • 6 Onion, Diced" in text
+    assert "Simmer curry 2." in text
+
+def test_named_recipe_without_ingredients_prints_nothing(menu, capsys):
+    with pytest.raises(argparse.ArgumentTypeError, match="The recipe for Empty Curry has not been added"):
+        resippy.print_recipe({'printrecipe': ["Curry 1", "Empty Curry"], 'format': "jsonl"})
+    assert capsys.readouterr().out == ""
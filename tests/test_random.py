@@ -0,0 +1,48 @@
+# --random: weighted sampling of the menu, checked against the weights over many seeded draws
+
+from collections import Counter
+from datetime import date
+
+import pytest
+
+import resippy
+
+DRAWS = 3000
+
+def add_recipes(recipes):
+    """Adds (name, rating, last_made) recipes, with every roommate giving the same rating."""
+    with resippy.connection:
+        resippy.cursor.executemany("INSERT INTO menu (name, drumlin_rating, ian_rating, lina_rating, last_made) VALUES (?, ?, ?, ?, ?)",
+                                   [(name, rating, rating, rating, last_made) for name, rating, last_made in recipes])
+
+def test_weights_have_a_floor():
+    today = date(2025, 3, 1)
+    assert resippy.recipe_weight([5, 5, 5], None, today) == 1.0
+    assert resippy.recipe_weight([None, None, None], None, today) == pytest.approx(0.36)
+    lowest = resippy.recipe_weight([1, 1, 1], "2025-03-01", today)
+    assert lowest == pytest.approx(0.04 * resippy.RANDOM_MIN_RECENCY)
+
+def test_draws_follow_the_weights(database):
+    # Weights 1 and 0.25, so the first is drawn first 4 times out of 5
+    add_recipes([("Favourite", 5, None), ("Fine", 2.5, None)])
+    first = Counter(resippy.sample_recipes(1, seed=seed)[0][1] for seed in range(DRAWS))
+    assert first["Favourite"] / DRAWS == pytest.approx(0.8, abs=0.03)
+
+def test_smallest_weights_are_drawn_evenly(database):
+    # Ten recipes rated 1 and made today all have the smallest weight, so each is the one left out of nine equally often
+    today = date.today().isoformat()
+    add_recipes([("Dish {}".format(n), 1, today) for n in range(10)])
+    left_out = Counter()
+    for seed in range(DRAWS):
+        drawn = {row[1] for row in resippy.sample_recipes(9, seed=seed)}
+        assert len(drawn) == 9
+        left_out.update({"Dish {}".format(n) for n in range(10)} - drawn)
+    assert len(left_out) == 10
+    for name, count in left_out.items():
+        assert count / DRAWS == pytest.approx(0.1, abs=0.025), name
+
+def test_seeded_draws_are_reproducible(database):
+    add_recipes([("Dish {}".format(n), 1 + n % 5, None) for n in range(30)])
+    assert resippy.sample_recipes(5, seed=7) == resippy.sample_recipes(5, seed=7)
+    filtered = resippy.sample_recipes(30, resippy.check_filter("ian_rating >= 4"), seed=7)
+    assert sorted(row[1] for row in filtered) == sorted("Dish {}".format(n) for n in range(30) if n % 5 >= 3)
@@ -0,0 +1,57 @@
+# --search: the recipe_search documents follow every change to a recipe, including changes made outside resippy
+
+import sqlite3
+
+import pytest
+
+import resippy
+
+@pytest.fixture
+def recipes(database):
+    """Two recipes with ingredients and instructions."""
+    for name, ingredients, instructions in [
+        ("Chana Masala", [("Chickpeas", 2, "Cup", None), ("Onion", 1, None, "Diced")], ["Fry the onion.", "Simmer for twenty minutes."]),
+        ("Pad Thai", [("Rice Noodles", 200, "Gram", None), ("Tofu", 1, "Block", "Cubed")], ["Soak the noodles."]),
+    ]:
+        resippy.new_recipe({'new': name})
+        recipe_id = resippy.load_lookup('menu', 'name', 'id', [name])[name]
+        with resippy.connection:
+            resippy.ingest_ingredients({recipe_id: ingredients}, {row[0]: "Produce" for row in ingredients})
+            resippy.ingest_instructions({recipe_id: instructions})
+    return database
+
+def search(terms, capsys):
+    """Names of the recipes --search finds, best first."""
+    capsys.readouterr()
+    assert resippy.search_recipes({'search': terms}) == (True, "")
+    printed = capsys.readouterr().out
+    return [name for name in ["Chana Masala", "Pad Thai", "Tofu Pad Thai"] if "| " + name + " " in printed]
+
+def pending_changes():
+    return resippy.cursor.execute("SELECT count(*) FROM recipe_changes").fetchone()[0]
+
+def test_names_ingredients_and_instructions_are_searched(recipes, capsys):
+    assert search("chickpea", capsys) == ["Chana Masala"]
+    assert search("tofu", capsys) == ["Pad Thai"]
+    assert search('"soak the noodles"', capsys) == ["Pad Thai"]
+    assert search("onion noodles", capsys) == []
+
+def test_changes_through_resippy_are_applied_on_commit(recipes, capsys):
+    resippy.update_menu({'update_menu': "Pad Thai", 'cuisine': "Thai"})
+    with resippy.connection:
+        resippy.cursor.execute("UPDATE ingredients SET ingredient_name = 'Garbanzo Beans' WHERE ingredient_name = 'Chickpeas'")
+    assert pending_changes() == 0
+    assert search("garbanzo", capsys) == ["Chana Masala"]
+    assert search("chickpea", capsys) == []
+
+def test_changes_left_by_another_writer_are_applied_before_searching(recipes, capsys):
+    # e.g. the sqlite3 shell: the triggers record the changed recipes, but nothing applies them
+    other = sqlite3.connect(recipes)
+    with other:
+        other.execute("UPDATE menu SET name = 'Tofu Pad Thai' WHERE name = 'Pad Thai'")
+        other.execute("INSERT INTO instructions (recipe_id, instruction) SELECT id, 'Garnish with peanuts.' FROM menu WHERE name = 'Chana Masala'")
+    other.close()
+    assert pending_changes() == 2
+    assert search("peanuts", capsys) == ["Chana Masala"]
+    assert search("tofu", capsys) == ["Tofu Pad Thai"]
+    assert pending_changes() == 0
@@ -0,0 +1,147 @@
+# The HTTP API, through a real `resippy.py --serve` and a keep-alive client: cached GETs follow every write, and errors get the right status
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+import pytest
+
+import resippy
+from conftest import ROOT
+
+class Client:
+    """A keep-alive client of the API, answering (status, decoded JSON)."""
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    def request(self, method, target, body=None):
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.connection.request(method, target, body=body)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def close(self):
+        self.connection.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def server(database):
+    """Runs `resippy.py --serve` against the test database. Yields its port."""
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'resippy.py'), '--serve', str(port), '--host', '127.0.0.1'],
+                               env=dict(os.environ, RESIPPY_DB=database), stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                assert process.poll() is None, "the server exited"
+                assert time.perf_counter() < deadline, "the server did not start"
+                time.sleep(0.05)
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+@pytest.fixture
+def client(server):
+    client = Client(server)
+    yield client
+    client.close()
+
+def ratings(client):
+    status, payload = client.request("GET", "/menu?order=name")
+    assert status == 200
+    return {recipe["name"]: recipe["ian_rating"] for recipe in payload["recipes"]}
+
+def test_gets_follow_writes_through_the_api(client):
+    assert ratings(client) == {}
+    assert client.request("POST", "/menu", {"name": "tacos", "ian_rating": 3}) == (201, {"name": "Tacos"})
+    assert ratings(client) == {"Tacos": 3}
+    assert ratings(client) == {"Tacos": 3}
+    assert client.request("PATCH", "/menu/Tacos", {"ian_rating": 5}) == (200, {"name": "Tacos"})
+    assert ratings(client) == {"Tacos": 5}
+
+def test_gets_follow_writes_from_another_resippy(client):
+    client.request("POST", "/menu", {"name": "Tacos", "ian_rating": 3})
+    assert ratings(client) == {"Tacos": 3}
+    # The test's own connection is another writer as far as the server is concerned
+    assert resippy.update_menu({'update_menu': "Tacos", 'ian_rating': 4.0}) == (True, "")
+    assert ratings(client) == {"Tacos": 4}
+    assert resippy.new_recipe({'new': "Dal"}) == (True, "")
+    assert ratings(client) == {"Dal": None, "Tacos": 4}
+    status, payload = client.request("GET", "/recipes/" + quote("dal"))
+    assert (status, payload["name"]) == (200, "Dal")
+
+def test_cached_reads_are_not_shared_across_queries(client):
+    for name, rating in [("Tacos", 5), ("Dal", 2), ("Pho", 4)]:
+        client.request("POST", "/menu", {"name": name, "ian_rating": rating})
+    assert [recipe["name"] for recipe in client.request("GET", "/menu?order=name")[1]["recipes"]] == ["Dal", "Pho", "Tacos"]
+    assert [recipe["name"] for recipe in client.request("GET", "/menu?filter=" + quote("ian_rating >= 4") + "&order=name")[1]["recipes"]] == ["Pho", "Tacos"]
+    assert [recipe["name"] for recipe in client.request("GET", "/menu?order=name&limit=1")[1]["recipes"]] == ["Dal"]
+
+@pytest.mark.parametrize("method, target, body, status", [
+    ("GET", "/menu?filter=" + quote("spiciness > 3"), None, 400),
+    ("GET", "/menu?limit=lots", None, 400),
+    ("POST", "/menu", {"name": "Pho", "cuisine": None}, 400),
+    ("POST", "/menu", {"cuisine": "Vietnamese"}, 400),
+    ("POST", "/menu", b"{not json", 400),
+    ("POST", "/menu", [{"name": "Pho"}], 400),
+    ("PATCH", "/menu/Tacos", {"name": "Fish Tacos"}, 400),
+    ("PATCH", "/menu/Tacos", {"ian_rating": 9}, 400),
+    ("GET", "/recipes/Pho", None, 404),
+    ("PATCH", "/menu/Pho", {"ian_rating": 4}, 404),
+    ("GET", "/nowhere", None, 404),
+    ("POST", "/menu", {"name": "tacos"}, 409),
+    ("DELETE", "/menu/Tacos", None, 405),
+])
+def test_error_statuses(client, method, target, body, status):
+    client.request("POST", "/menu", {"name": "Tacos", "ian_rating": 3})
+    answer, payload = client.request(method, target, body)
+    assert answer == status
+    assert payload["error"]
+    # Nothing was written, and the connection is still usable
+    assert ratings(client) == {"Tacos": 3}
+
+def test_concurrent_writes_go_one_at_a_time(server):
+    """Clients racing to add the same recipes: each is added exactly once, and no write fails on a locked database."""
+    names = ["Recipe {}".format(i) for i in range(10)]
+    statuses = []
+    lock = threading.Lock()
+
+    def add_all():
+        client = Client(server)
+        try:
+            for name in names:
+                status, _ = client.request("POST", "/menu", {"name": name})
+                status_read, _ = client.request("GET", "/menu")
+                with lock:
+                    statuses.extend([status, status_read])
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=add_all) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses.count(201) == len(names)
+    assert statuses.count(409) == len(names) * (len(threads) - 1)
+    assert statuses.count(200) == len(names) * len(threads)
+    client = Client(server)
+    assert sorted(ratings(client)) == sorted(names)
+    client.close()
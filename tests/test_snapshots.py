@@ -0,0 +1,98 @@
+# --export, --import and --backup: a snapshot carries the whole household over to another database, with every id remapped by name
+
+import gzip
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+import resippy
+
+TOMORROW = (date.today() + timedelta(days=1))
+
+def add_recipe(name, ingredients, instructions, **menu):
+    resippy.new_recipe(dict(menu, new=name))
+    recipe_id = resippy.load_lookup('menu', 'name', 'id', [name])[name]
+    with resippy.connection:
+        resippy.ingest_ingredients({recipe_id: ingredients}, {"Chickpeas": "Canned Goods", "Onion": "Produce", "Tofu": "Produce", "Salt": "Spices"})
+        resippy.ingest_instructions({recipe_id: instructions})
+    return recipe_id
+
+def switch_to(path, monkeypatch):
+    """Points resippy at another database file."""
+    resippy.connection.close()
+    monkeypatch.setattr(resippy, 'DATABASE_PATH', str(path))
+    resippy.connection, resippy.cursor = None, None
+    resippy.open_database()
+
+def contents(db):
+    """Everything a snapshot carries, keyed by names instead of ids."""
+    return {
+        'menu': sorted(db.execute("SELECT name, dish_type, cuisine, drumlin_rating, ian_rating, lina_rating, last_made FROM menu")),
+        'ingredients': sorted(db.execute("SELECT ingredient_name, grocery_location FROM ingredients")),
+        'recipe_ingredients': sorted(db.execute("""
+            SELECT m.name, i.ingredient_name, ri.quantity, u.unit_name, p.prepmethod_name FROM recipe_ingredients ri
+            JOIN menu m ON m.id = ri.recipe_id JOIN ingredients i ON i.ingredient_id = ri.ingredient_id
+            LEFT JOIN units u ON u.unit_id = ri.unit_id LEFT JOIN prepmethod p ON p.prepmethod_id = ri.prepmethod_id"""), key=repr),
+        'instructions': list(db.execute("SELECT m.name, s.instruction FROM instructions s JOIN menu m ON m.id = s.recipe_id ORDER BY m.name, s.instruction_id")),
+        'mealplan': list(db.execute("SELECT day, date, (SELECT name FROM menu WHERE id = recipe_id) FROM mealplan ORDER BY day")),
+    }
+
+@pytest.fixture
+def household(database):
+    """A household whose ids have gaps (a deleted recipe and ingredient), with a planned meal."""
+    add_recipe("Scratch", [("Salt", 1, "Pinch", None)], ["Taste."])
+    chana = add_recipe("Chana Masala", [("Chickpeas", 2, "Cup", None), ("Onion", 1, None, "Diced")], ["Fry the onion.", "Add the chickpeas."],
+                       cuisine="Indian", ian_rating=4.5, last_made="01/02/2025")
+    add_recipe("Tofu Scramble", [("Tofu", 1, "Block", "Crumbled"), ("Onion", 0.5, None, "Diced")], ["Crumble the tofu."], drumlin_rating=3.0)
+    resippy.delete_recipe({'del_recipe': "Scratch"})
+    with resippy.connection:
+        resippy.cursor.execute("DELETE FROM ingredients WHERE ingredient_name = 'Salt'")
+        resippy.cursor.execute("UPDATE mealplan SET date=?, recipe_id=? WHERE day=?", (TOMORROW.isoformat(), chana, TOMORROW.strftime('%A')))
+    return database
+
+def test_export_then_import_into_an_empty_database(household, tmp_path, monkeypatch):
+    before = contents(resippy.cursor)
+    snapshot = str(tmp_path / 'household.jsonl.gz')
+    assert resippy.export_database(snapshot) == (True, "Exported 2 recipes (24 rows) to {p}.".format(p=snapshot))
+    switch_to(tmp_path / 'new.db', monkeypatch)
+    assert resippy.import_database(snapshot) == (True, "Imported 2 recipes (4 ingredients, 3 instructions) from {p}.".format(p=snapshot))
+    assert contents(resippy.cursor) == before
+    # The imported recipes are searchable straight away
+    assert resippy.cursor.execute("SELECT count(*) FROM recipe_search WHERE recipe_search MATCH 'chickpeas'").fetchone()[0] == 1
+    assert resippy.cursor.execute("SELECT count(*) FROM recipe_changes").fetchone()[0] == 0
+
+def test_import_remaps_ids_and_keeps_existing_recipes(household, tmp_path, monkeypatch):
+    before = contents(resippy.cursor)
+    snapshot = str(tmp_path / 'household.jsonl.gz')
+    resippy.export_database(snapshot)
+    # A database where the same names already have other ids, and Tofu Scramble is already on the menu with its own recipe
+    switch_to(tmp_path / 'busy.db', monkeypatch)
+    add_recipe("Toast", [("Bread", 2, "Slice", "Toasted")], ["Toast it."])
+    add_recipe("Tofu Scramble", [("Tofu", 2, "Block", None)], ["Fry it."], cuisine="Diner")
+    ok, message = resippy.import_database(snapshot)
+    assert ok
+    assert message.endswith("1 recipes were already on the menu and were left as they are.")
+    after = contents(resippy.cursor)
+    assert ("Tofu Scramble", None, "Diner", None, None, None, None) in after['menu']
+    assert [row for row in after['recipe_ingredients'] if row[0] == "Tofu Scramble"] == [("Tofu Scramble", "Tofu", 2.0, "Block", None)]
+    assert [row for row in after['recipe_ingredients'] if row[0] == "Chana Masala"] == [row for row in before['recipe_ingredients'] if row[0] == "Chana Masala"]
+    assert [row for row in after['instructions'] if row[0] == "Chana Masala"] == [row for row in before['instructions'] if row[0] == "Chana Masala"]
+    assert after['mealplan'] == before['mealplan']
+    # Chana Masala was recipe 2 in the snapshot, which is Tofu Scramble here: the references above only match because they were remapped
+    assert resippy.cursor.execute("SELECT name FROM menu WHERE id = 2").fetchone()[0] == "Tofu Scramble"
+
+def test_import_rejects_other_files(database, tmp_path):
+    not_a_snapshot = tmp_path / 'notes.jsonl.gz'
+    with gzip.open(not_a_snapshot, 'wt') as file:
+        file.write('{"hello": "world"}\n')
+    assert resippy.import_database(str(not_a_snapshot)) == (False, "{p} is not a resippy snapshot.".format(p=not_a_snapshot))
+
+def test_backup_is_an_identical_database(household, tmp_path):
+    copy = str(tmp_path / 'backup.db')
+    assert resippy.backup_database(copy) == (True, "The database has been backed up to {p}.".format(p=copy))
+    backup = sqlite3.connect(copy)
+    assert contents(backup) == contents(resippy.cursor)
+    assert backup.execute("PRAGMA user_version").fetchone()[0] == resippy.SCHEMA_VERSION
+    assert backup.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    backup.close()